@@ -8,20 +8,19 @@ Removes logging and defensive error handling around core functions for brevity.
 # Import necessary functions f
 from typing import Tuple, List, Optional, Dict, Any
 import streamlit as st
-from reqpy_M import (REQPY_single, plot_single_results)
+import export
 
 import numpy as np
-import matplotlib.pyplot as plt
 import logging
 import io
 import helperfunctions as hf
+from profiling import StageTimer
 
 log = logging.getLogger(__name__)
 
 st.header("Single Component Spectrum Matching", divider="gray")
 st.write("Modifies a single component from a historic record so that the resulting response spectrum matches the specified design/target spectrum.")
 st.write ("Usess REQPY_single function from reqpy_M module.")
-plt.close('all')
 # --- Configuration ---
 # Setup basic logging to see output from the module
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
@@ -34,13 +33,21 @@ if target is None:
     st.stop()
 else:
         target_file=io.StringIO(target.read().decode("utf-8"))
+library = hf.my_record_library() # Seed records with precomputed spectra (REQPY_LIBRARY_DIR)
+use_library = library is not None and st.toggle(
+    "Pick the seed record from the record library", value=False,
+    help=f"{len(library)} records in {library.path}, ranked by their scaled misfit to the target")
 filenames=None
-filenames=st.file_uploader("Upload PEER file",type=[ "AT2"])
-if filenames is None:
-    st.warning("Please upload a PEER file to proceed.")
-    st.stop()
-else:
-        seed_file=io.StringIO(filenames.read().decode("utf-8"))
+if not use_library:
+    filenames=st.file_uploader("Upload PEER file (or a .npz results file)",type=[ "AT2", "npz"])
+    if filenames is None:
+        st.warning("Please upload a PEER file to proceed.")
+        st.stop()
+    elif filenames.name.lower().endswith('.npz'):
+            seed_file=io.BytesIO(filenames.read()) # Matched record of an earlier run
+    else:
+            seed_file=io.StringIO(filenames.read().decode("utf-8"))
+    seed_name = filenames.name
 
 
 
@@ -49,10 +56,29 @@ with cc1:
      dampratio=st.number_input("Damping ratio for spectra",value=0.05)
      TL1=st.number_input("Lower period limit for matching (s)",value=0.05)
      TL2=st.number_input("Upper period limit for matching (s)",value=6.0)
+     target_points=st.number_input("Target periods used for matching (0 = full target)",value=200,min_value=0)
 with cc2:
      nit_match=st.number_input("Number of matching iterations",value=15)
      baseline_correct=st.checkbox("Perform baseline correction?",value=True)
      p_order=st.number_input("Detrending order for baseline (-1 = none)",value=-1)
+stopping = hf.my_early_stopping_inputs()
+sweep = hf.my_sweep_inputs(dampratio) # None unless the sweep mode is on
+diagnostics = st.checkbox("Show diagnostics (stage timings and peak memory)", value=False)
+low_memory = st.checkbox("Memory-aware mode (single-precision wavelet details)", value=False,
+                         help="Reduces the peak memory of matching long or high sample rate records; "
+                              "the misfits agree with the default mode to about 1e-4 % points.")
+decimate = st.checkbox("Decimate over-sampled records", value=False,
+                       help="Resamples e.g. 200 Hz records to a coarser time step that keeps at least "
+                            "5 points per period at the lower period limit; about halves the matching time.")
+warm_start = st.checkbox("Warm start from earlier runs", value=False,
+                         help="A run whose T1, T2, damping ratio or target changed only slightly starts from the "
+                              "matched record of the closest earlier run of this session, with at most 5 iterations.")
+plot_mode = st.radio("Plots", ("Static", "Interactive"), horizontal=True,
+                     help="Both are drawn from decimated histories and a log-spaced target subset; "
+                          "interactive charts are rendered in the browser and can be zoomed.")
+timer = StageTimer(memory=diagnostics)
+if use_library:
+    seed_name = hf.my_pick_library_seed(library, target_file.getvalue(), TL1, TL2)
 
 
 
@@ -64,39 +90,72 @@ with cc2:
 # nit_match = 15                                # Number of matching iterations
 # baseline_correct = True                       # Perform baseline correction?
 # p_order = -1                                  # Detrending order for baseline (-1 = none)
-output_base_name = filenames.name[:-4]+'_'+target.name[:-4] # Base name for output files
+output_base_name = seed_name[:-4]+'_'+target.name[:-4] # Base name for output files
 saveR =False
 placeholder = st.empty()
 placeholder.write("Work in progress...")
 # --- Load target spectrum and seed record ---
 
-s_orig, dt, npts, eqname = hf.my_load_PEERNGA_record(seed_file)
+with timer.stage('parse seed record'):
+    if use_library:
+        s_orig, dt, npts, eqname = library.load_record(seed_name)
+    else:
+        s_orig, dt, npts, eqname = hf.my_load_PEERNGA_record(seed_file)
+if decimate:
+    with timer.stage('input conditioning'):
+        (s_orig,), dt, conditioning_report = hf.my_condition_records([(s_orig, dt)], TL1, decimate)
+    hf.my_show_conditioning(conditioning_report, [seed_name])
 fs = 1 / dt
 
-target_spectrum = np.loadtxt(target_file)
-if target_spectrum.ndim != 2 or target_spectrum.shape[1] != 2:
-    raise ValueError("Target file should have two columns (Period, PSA).")
-    
-sort_idx = np.argsort(target_spectrum[:, 0])
-To = target_spectrum[sort_idx, 0]  # Target spectrum periods
-dso = target_spectrum[sort_idx, 1] # Target spectrum PSA
+with timer.stage('target spectrum'):
+    To, dso = hf.my_load_target_spectrum(target_file) # Target spectrum periods and PSA
+    if target_points > 0:
+        # Log-spaced resampling: matching in [TL1, TL2], plotting over the full target
+        To_match, dso_match, resample_report = hf.my_resample_target(To, dso, TL1, TL2, npts=target_points)
+        To_plot, dso_plot, _ = hf.my_resample_target(To, dso, npts=target_points)
+if target_points > 0:
+    st.caption(f"Target resampled from {resample_report['n_dense']} to {resample_report['n_resampled']} periods "
+               f"in the matching range (max interpolation error {resample_report['max_error']:.3f}% "
+               f"at T = {resample_report['T_max_error']:.3f} s).")
+else:
+    To_match, dso_match = To, dso
+    To_plot, dso_plot = To, dso
+
+# --- Sweep: the seed matched to several targets / damping ratios, decomposed once ---
+if sweep is not None:
+    sweep_files, sweep_dampings = sweep
+    with timer.stage('sweep targets'):
+        sweep_targets = [(To_match, dso_match)] + hf.my_load_sweep_targets(sweep_files, TL1, TL2, target_points)
+    sweep_names = [target.name] + [f.name for f in sweep_files]
+    sweep_args = dict(s1=s_orig, fs=fs, **hf.my_pack_targets(sweep_targets), zis=np.array(sweep_dampings),
+                      T1=TL1, T2=TL2, nit=nit_match, baseline=baseline_correct, porder=p_order,
+                      low_memory=low_memory, **stopping)
+    sweep_key = hf.my_sweep_key(**sweep_args)
+    summary = hf.my_match_in_background('single_job', sweep_key, hf.my_REQPY_sweep, timer=timer, **sweep_args)
+    st.write(f"Sweep complete: {len(summary['zi'])} combinations.")
+    hf.my_show_sweep(summary, sweep_targets, sweep_names, TL1, TL2)
+    placeholder.write("Completed")
+    if diagnostics:
+        hf.my_show_diagnostics(timer, page='single', result_key=sweep_key, record=seed_name)
+    st.stop()
 
 # --- Perform Spectral Matching ---
-results = REQPY_single(
-    s=s_orig,
-    fs=fs,
-    dso=dso,
-    To=To,
-    T1=TL1,
-    T2=TL2,
-    zi=dampratio,
-    nit=nit_match,
-    baseline=baseline_correct,
-    porder=p_order)
+# Cached on the inputs, so widget changes (e.g. save format) don't re-run matching.
+# A new run goes to a background job with a live progress bar and a cancel button.
+match_args = dict(s=s_orig, fs=fs, dso=dso_match, To=To_match, T1=TL1, T2=TL2, zi=dampratio,
+                  nit=nit_match, baseline=baseline_correct, porder=p_order, low_memory=low_memory, **stopping)
+result_key = hf.my_single_key(**match_args)
+if warm_start:
+    # Started from the matched record of an earlier run if the parameters changed only slightly
+    match_args, result_key = hf.my_warm_start('single_lineage', match_args, result_key)
+results = hf.my_match_in_background('single_job', result_key, hf.my_REQPY_single, timer=timer, **match_args)
 
 st.write("Spectral matching complete.")
+st.write(f"Iterations used: {results['nit_used']} of {match_args['nit']} (best at iteration {results['best_it']})")
 st.write(f"Final RMSE (pre-BC): {results['rmsefin']:.2f}%")
 st.write(f"Final Misfit (pre-BC): {results['meanefin']:.2f}%")
+if warm_start:
+    hf.my_show_lineage('single_lineage', hf.my_record_run('single_lineage', result_key, results))
 
 
 # --- Extract Results ---
@@ -105,15 +164,32 @@ cvel = results['cvel']
 cdespl = results['cdespl']
 
 # --- Plot Results ---
-
-fig_hist, fig_spec = plot_single_results(
-    results=results,
-    s_orig=s_orig,
-    target_spec=(To, dso),
-    T1=TL1,
-    T2=TL2,
-    xlim_min=None,
-    xlim_max=None)
+# Imported once there are results to plot: matplotlib and scipy are slow to import
+import matplotlib.pyplot as plt
+import plotting
+with plotting.lock:
+    plt.close('all')
+
+with timer.stage('plotting'), plotting.lock:
+    # Decimated histories and a log-spaced target subset, so long records draw quickly
+    figures = st.session_state.get('single_figures')
+    if figures is None or figures[0] != (result_key, plot_mode):
+        plot_data = plotting.plot_data_single(
+            results=results,
+            s_orig=s_orig,
+            target_spec=(To_plot, dso_plot),
+            T1=TL1,
+            T2=TL2)
+        if plot_mode == "Interactive":
+            hist_chart, spec_chart = plotting.charts(plot_data)
+            st.session_state['single_figures'] = ((result_key, plot_mode), hist_chart, spec_chart)
+        else:
+            fig_hist, fig_spec = plotting.figures(plot_data)
+            st.session_state['single_figures'] = ((result_key, plot_mode), fig_hist, fig_spec)
+    elif plot_mode == "Interactive":
+        _, hist_chart, spec_chart = figures
+    else:
+        _, fig_hist, fig_spec = figures
 
 
 
@@ -122,10 +198,25 @@ fig_hist, fig_spec = plot_single_results(
 # spec_filename = f"{output_base_name}_Spectra.png"
 # fig_hist.savefig(hist_filename, dpi=300)
 # fig_spec.savefig(spec_filename, dpi=300)
-st.pyplot(fig_spec) # Display plots
-st.pyplot(fig_hist) # Display plots
-
-
+with timer.stage('display plots'), plotting.lock:
+    if plot_mode == "Interactive":
+        st.altair_chart(spec_chart, width="stretch")
+        st.altair_chart(hist_chart, width="stretch")
+    else:
+        st.pyplot(fig_spec) # Display plots
+        st.pyplot(fig_hist) # Display plots
+
+with st.expander("Verification spectra at other damping ratios"):
+    verify_damping = st.multiselect("Damping ratios", (0.02, 0.05, 0.10, 0.20), default=(0.05,),
+                                    format_func=lambda z: f"{100 * z:g}%")
+    if verify_damping:
+        dampings = tuple(sorted(verify_damping))
+        with timer.stage('verification spectra'):
+            psa_verify = hf.my_verification_spectra((s_orig[:len(ccs)] * results['sf'], ccs), results['dt'],
+                                                    results['T'], dampings)
+        with plotting.lock:
+            st.pyplot(hf.my_plot_verification_spectra(results['T'], psa_verify, dampings,
+                                                      ('Scaled Seed', 'Matched'), TL1, TL2))
 
 saveR = True
 placeholder.write("Completed")
@@ -135,19 +226,21 @@ if saveR:
         "Select output format for matched record:",
         ("Save as .AT2 format",
         "Save as 2-column (Time, Accel) .txt file",
-        "Save as 1-column (Accel) .txt file")
+        "Save as 1-column (Accel) .txt file",
+        "Save as binary results (.npz)")
     )   
 
     if saveoption == "Save as .AT2 format":
     # --- Option 1: Save as .AT2 format ---
         at2_filepath = f"{output_base_name}_Matched.AT2"
         at2_header_details = {
-            'title': f'Matched record from {filenames.name} (Target: {target.name})',
+            'title': f'Matched record from {seed_name} (Target: {target.name})',
             'date': '01/01/2025', # Placeholder date
             'station': eqname.split('_comp_')[0] if '_comp_' in eqname else eqname,
             'component': f"{eqname.split('_comp_')[-1]}-Matched"
         }
-        outputfile = hf.my_save_results_as_at2(results, comp_key='ccs', header_details=at2_header_details)
+        with timer.stage('serialization'):
+            outputfile = hf.my_save_results_as_at2(results, result_key=result_key, comp_key='ccs', header_details=at2_header_details)
         st.download_button("Save Spectrally Matched Record as .AT2", outputfile.getvalue(), file_name=at2_filepath, mime="text/csv",)
 
     elif saveoption == "Save as 2-column (Time, Accel) .txt file":
@@ -157,9 +250,21 @@ if saveR:
                     f"Original Seed: {eqname}\n"
                     f"Target Spectrum: {target.name}\n"
                     f"Time (s), Acceleration (g)")
-        outputfile = hf.my_save_results_as_2col(results, comp_key='ccs', header_str=header_2col)
+        with timer.stage('serialization'):
+            outputfile = hf.my_save_results_as_2col(results, result_key=result_key, comp_key='ccs', header_str=header_2col)
         st.download_button("Save Spectrally Matched Record as 2-Column TXT", outputfile.getvalue(), file_name=txt_2col_filepath, mime="text/plain")
 
+    elif saveoption == "Save as binary results (.npz)":
+        # --- Option 4: All results (time series, spectra, target) in one binary file ---
+        npz_filepath = f"{output_base_name}_Matched.npz"
+        float32 = st.checkbox("Single precision (half the size)", value=False)
+        npz_metadata = {'records': [eqname], 'seed_files': [seed_name], 'target': target.name,
+                        'T1': TL1, 'T2': TL2, 'zi': dampratio}
+        with timer.stage('serialization'):
+            outputfile = hf.my_save_results_as_npz(results, result_key=result_key, float32=float32, target_spec=(To_plot, dso_plot),
+                                                   metadata=npz_metadata)
+        st.download_button("Save Spectrally Matched Results as .npz", outputfile.getvalue(), file_name=npz_filepath, mime="application/octet-stream")
+
     else:
         # --- Option 3: Save as 1-column (Accel) .txt file ---
         txt_1col_filepath = f"{output_base_name}_Matched_1col.txt"
@@ -167,9 +272,17 @@ if saveR:
                     f"Original Seed: {eqname}\n"
                     f"Target Spectrum: {target.name}\n"
                     f"Data points follow:")
-        outputfile = hf.my_save_results_as_1col(results, comp_key='ccs', header_str=header_1col)
+        with timer.stage('serialization'):
+            outputfile = hf.my_save_results_as_1col(results, result_key=result_key, comp_key='ccs', header_str=header_1col)
         st.download_button("Save Spectrally Matched Record as 1-Column TXT", outputfile.getvalue(), file_name=txt_1col_filepath, mime="text/plain")
+
+    # --- All formats, velocity/displacement and spectra in one archive ---
+    hf.my_export_bundle_button(results, result_key, [(output_base_name, seed_name, eqname, export.SINGLE_KEYS)],
+                               output_base_name, target.name, (To_plot, dso_plot))
         
 
     print("\nScript finished.")
 
+if diagnostics:
+    hf.my_show_diagnostics(timer, page='single', result_key=result_key, record=seed_name)
+
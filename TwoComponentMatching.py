@@ -12,19 +12,17 @@ This is the recommended approach for matching two components.
 # Import necessary functions 
 from typing import Tuple, List, Optional, Dict, Any
 import streamlit as st
-from reqpy_M import (REQPYrotdnn,  plot_rotdnn_results)
+import export
 import numpy as np
-import matplotlib.pyplot as plt
 import logging
 import io
 import helperfunctions as hf
+from profiling import StageTimer
 
 log = logging.getLogger(__name__)
 
 
 
-plt.close('all')
-
 st.header("Two Component Spectrum Matching", divider="gray")
 st.write("Modifies two horizontal components from a historic record simultaneously so that the resulting RotD100 response spectrum (computed from the pair) matches the specified RotD100 design/target spectrum.")
 st.write ("Uses REQPYrotdnn function from reqpy_M module.")
@@ -45,17 +43,21 @@ filenames1=None
 
 c1,c2 =st.columns(2)
 with c1:
-    filenames1=st.file_uploader("Upload PEER file for component 1",type=[ "AT2"])
+    filenames1=st.file_uploader("Upload PEER file for component 1 (or a .npz results file)",type=[ "AT2", "npz"])
     if filenames1 is None:
         st.warning("Please upload a PEER file for component 1 to proceed.")
         st.stop()
+    elif filenames1.name.lower().endswith('.npz'):
+            seed_file1=io.BytesIO(filenames1.read()) # Matched record of an earlier run
     else:
             seed_file1=io.StringIO(filenames1.read().decode("utf-8"))
 with c2:
-    filenames2=st.file_uploader("Upload PEER file for component 2",type=[ "AT2"])
+    filenames2=st.file_uploader("Upload PEER file for component 2 (or a .npz results file)",type=[ "AT2", "npz"])
     if filenames2 is None:
         st.warning("Please upload a PEER file for component 2 to proceed.")
         st.stop()
+    elif filenames2.name.lower().endswith('.npz'):
+            seed_file2=io.BytesIO(filenames2.read()) # Matched record of an earlier run
     else:
             seed_file2=io.StringIO(filenames2.read().decode("utf-8"))
 
@@ -65,11 +67,28 @@ with cc1:
      dampratio=st.number_input("Damping ratio for spectra",value=0.05)
      TL1=st.number_input("Lower period limit for matching (s)",value=0.05)
      TL2=st.number_input("Upper period limit for matching (s)",value=6.0)
+     target_points=st.number_input("Target periods used for matching (0 = full target)",value=200,min_value=0)
 with cc2:
      nit_match=st.number_input("Number of matching iterations",value=15)
      nn = st.number_input("Percentile for RotD (e.g., 100 for RotD100)",value=100)
      baseline_correct=st.checkbox("Perform baseline correction?",value=True)
      p_order=st.number_input("Detrending order for baseline (-1 = none)",value=-1)
+stopping = hf.my_early_stopping_inputs()
+sweep = hf.my_sweep_inputs(dampratio) # None unless the sweep mode is on
+diagnostics = st.checkbox("Show diagnostics (stage timings and peak memory)", value=False)
+low_memory = st.checkbox("Memory-aware mode (single-precision wavelet details)", value=False,
+                         help="Reduces the peak memory of matching long or high sample rate records; "
+                              "the misfits agree with the default mode to about 1e-4 % points.")
+decimate = st.checkbox("Decimate over-sampled records", value=False,
+                       help="Resamples e.g. 200 Hz records to a coarser time step that keeps at least "
+                            "5 points per period at the lower period limit; about halves the matching time.")
+warm_start = st.checkbox("Warm start from earlier runs", value=False,
+                         help="A run whose T1, T2, damping ratio or target changed only slightly starts from the "
+                              "matched record of the closest earlier run of this session, with at most 5 iterations.")
+plot_mode = st.radio("Plots", ("Static", "Interactive"), horizontal=True,
+                     help="Both are drawn from decimated histories and a log-spaced target subset; "
+                          "interactive charts are rendered in the browser and can be zoomed.")
+timer = StageTimer(memory=diagnostics)
 
 # seed_file_1 = 'RSN175_IMPVALL.H_H-E12140.AT2' # Seed record comp1 [g]
 # seed_file_2 = 'RSN175_IMPVALL.H_H-E12230.AT2' # Seed record comp2 [g]
@@ -87,49 +106,100 @@ placeholder = st.empty()
 placeholder.write("Work in progress...")
 # --- Load target spectrum and seed record ---
 
-s1, dt, n1, name1 = hf.my_load_PEERNGA_record(seed_file1)
-s2, _, n2, name2 = hf.my_load_PEERNGA_record(seed_file2)
+with timer.stage('parse seed records'):
+    s1, dt1, n1, name1 = hf.my_load_PEERNGA_record(seed_file1)
+    s2, dt2, n2, name2 = hf.my_load_PEERNGA_record(seed_file2, component=2)
+with timer.stage('input conditioning'):
+    # A common time step and length for both components (resampled / padded if they differ)
+    (s1, s2), dt, conditioning_report = hf.my_condition_records([(s1, dt1), (s2, dt2)], TL1, decimate)
+hf.my_show_conditioning(conditioning_report, [filenames1.name, filenames2.name])
 
 fs = 1 / dt
 
-target_spectrum = np.loadtxt(target_file)
-sort_idx = np.argsort(target_spectrum[:, 0])
-To = target_spectrum[sort_idx, 0]  # Target spectrum periods
-dso = target_spectrum[sort_idx, 1] # Target spectrum PSA
+with timer.stage('target spectrum'):
+    To, dso = hf.my_load_target_spectrum(target_file) # Target spectrum periods and PSA
+    if target_points > 0:
+        # Log-spaced resampling: matching in [TL1, TL2], plotting over the full target
+        To_match, dso_match, resample_report = hf.my_resample_target(To, dso, TL1, TL2, npts=target_points)
+        To_plot, dso_plot, _ = hf.my_resample_target(To, dso, npts=target_points)
+if target_points > 0:
+    st.caption(f"Target resampled from {resample_report['n_dense']} to {resample_report['n_resampled']} periods "
+               f"in the matching range (max interpolation error {resample_report['max_error']:.3f}% "
+               f"at T = {resample_report['T_max_error']:.3f} s).")
+else:
+    To_match, dso_match = To, dso
+    To_plot, dso_plot = To, dso
     
 
+# --- Sweep: the pair matched to several targets / damping ratios, decomposed once ---
+if sweep is not None:
+    sweep_files, sweep_dampings = sweep
+    with timer.stage('sweep targets'):
+        sweep_targets = [(To_match, dso_match)] + hf.my_load_sweep_targets(sweep_files, TL1, TL2, target_points)
+    sweep_names = [target.name] + [f.name for f in sweep_files]
+    sweep_args = dict(s1=s1, s2=s2, fs=fs, **hf.my_pack_targets(sweep_targets), zis=np.array(sweep_dampings),
+                      nn=nn, T1=TL1, T2=TL2, nit=nit_match, baseline=baseline_correct, porder=p_order,
+                      low_memory=low_memory, **stopping)
+    sweep_key = hf.my_sweep_key(**sweep_args)
+    summary = hf.my_match_in_background('rotdnn_job', sweep_key, hf.my_REQPY_sweep, timer=timer, **sweep_args)
+    st.write(f"Sweep complete: {len(summary['zi'])} combinations (RotD{nn:g}).")
+    hf.my_show_sweep(summary, sweep_targets, sweep_names, TL1, TL2)
+    placeholder.write("Completed")
+    if diagnostics:
+        hf.my_show_diagnostics(timer, page='rotdnn', result_key=sweep_key,
+                               records=[filenames1.name, filenames2.name])
+    st.stop()
+
 # --- Perform Direct RotDnn Spectral Matching ---
-# Call the  REQPYrotdnn function
-results = REQPYrotdnn(
-    s1=s1,
-    s2=s2,
-    fs=fs,
-    dso=dso,
-    To=To,
-    nn=nn,
-    T1=TL1,
-    T2=TL2,
-    zi=dampratio,
-    nit=nit_match,
-    baseline=baseline_correct,
-    porder=p_order)
+# Cached on the inputs, so widget changes don't re-run matching.
+# A new run goes to a background job with a live progress bar and a cancel button.
+match_args = dict(s1=s1, s2=s2, fs=fs, dso=dso_match, To=To_match, nn=nn, T1=TL1, T2=TL2,
+                  zi=dampratio, nit=nit_match, baseline=baseline_correct, porder=p_order,
+                  low_memory=low_memory, **stopping)
+result_key = hf.my_rotdnn_key(**match_args)
+if warm_start:
+    # Started from the matched record of an earlier run if the parameters changed only slightly
+    match_args, result_key = hf.my_warm_start('rotdnn_lineage', match_args, result_key)
+results = hf.my_match_in_background('rotdnn_job', result_key, hf.my_REQPYrotdnn, timer=timer, **match_args)
 
 st.write("Spectral matching complete.")
+st.write(f"Iterations used: {results['nit_used']} of {match_args['nit']} (best at iteration {results['best_it']})")
 st.write(f"Final RMSE (pre-BC): {results.get('rmsefin', 'N/A'):.2f}%")
 st.write(f"Final Misfit (pre-BC): {results.get('meanefin', 'N/A'):.2f}%")
+if warm_start:
+    hf.my_show_lineage('rotdnn_lineage', hf.my_record_run('rotdnn_lineage', result_key, results))
 
 
 # --- Plot Results ---
+# Imported once there are results to plot: matplotlib and scipy are slow to import
+import matplotlib.pyplot as plt
+import plotting
+import spectra
+with plotting.lock:
+    plt.close('all')
 # Call the plotting function for RotDnn results
-fig_hist, fig_spec = plot_rotdnn_results(
-    results=results,
-    s1_orig=s1, # Pass original unscaled record 1
-    s2_orig=s2, # Pass original unscaled record 2
-    target_spec=(To, dso),
-    T1=TL1,
-    T2=TL2,
-    xlim_min=None,
-    xlim_max=None)
+with timer.stage('plotting'), plotting.lock:
+    # Decimated histories and a log-spaced target subset, so long records draw quickly
+    figures = st.session_state.get('rotdnn_figures')
+    if figures is None or figures[0] != (result_key, plot_mode):
+        plot_data = plotting.plot_data_rotdnn(
+            results=results,
+            s1_orig=s1, # Pass original unscaled record 1
+            s2_orig=s2, # Pass original unscaled record 2
+            target_spec=(To_plot, dso_plot),
+            T1=TL1,
+            T2=TL2,
+            nn=nn)
+        if plot_mode == "Interactive":
+            hist_chart, spec_chart = plotting.charts(plot_data)
+            st.session_state['rotdnn_figures'] = ((result_key, plot_mode), hist_chart, spec_chart)
+        else:
+            fig_hist, fig_spec = plotting.figures(plot_data)
+            st.session_state['rotdnn_figures'] = ((result_key, plot_mode), fig_hist, fig_spec)
+    elif plot_mode == "Interactive":
+        _, hist_chart, spec_chart = figures
+    else:
+        _, fig_hist, fig_spec = figures
 
 # Save and show plots
 # hist_filename = f"{output_base_name}_TimeHistories.png"
@@ -137,8 +207,38 @@ fig_hist, fig_spec = plot_rotdnn_results(
 # fig_hist.savefig(hist_filename, dpi=300)
 # fig_spec.savefig(spec_filename, dpi=300)
 # print(f"Saved plots to {hist_filename} and {spec_filename}")
-st.pyplot(fig_spec) # Display plots
-st.pyplot(fig_hist) # Display plots
+with timer.stage('display plots'), plotting.lock:
+    if plot_mode == "Interactive":
+        st.altair_chart(spec_chart, width="stretch")
+        st.altair_chart(hist_chart, width="stretch")
+    else:
+        st.pyplot(fig_spec) # Display plots
+        st.pyplot(fig_hist) # Display plots
+
+with st.expander("Verification spectra at other damping ratios"):
+    verify_damping = st.multiselect("Damping ratios", (0.02, 0.05, 0.10, 0.20), default=(0.05,),
+                                    format_func=lambda z: f"{100 * z:g}%")
+    if verify_damping:
+        dampings = tuple(sorted(verify_damping))
+        with timer.stage('verification spectra'):
+            psa_verify = hf.my_verification_spectra((results['scc1'], results['scc2']), results['dt'],
+                                                    results['T'], dampings)
+        with plotting.lock:
+            st.pyplot(hf.my_plot_verification_spectra(results['T'], psa_verify, dampings,
+                                                      ('Matched Comp. 1', 'Matched Comp. 2'), TL1, TL2))
+
+with st.expander("RotDnn spectra of the matched pair"):
+    rotd_nns = st.multiselect("Percentiles", (0, 50, 100), default=(50, 100),
+                              format_func=lambda p: f"RotD{p}")
+    if rotd_nns:
+        # Per-angle spectra are computed once per result; percentiles are cheap
+        with timer.stage('rotated spectra'):
+            psa_angles = hf.my_rotated_spectra(results['scc1'], results['scc2'], results['dt'],
+                                               results['T'], dampratio)
+        nns = tuple(sorted(rotd_nns))
+        with plotting.lock:
+            st.pyplot(hf.my_plot_rotdnn_spectra(results['T'], spectra.rotdnn(psa_angles, nns), nns,
+                                                (To_plot, dso_plot), TL1, TL2))
 
 # --- Save Matched Records ---
 placeholder.write("Completed")
@@ -148,7 +248,8 @@ if saveR:
     saveoption = st.selectbox(
         "Select output format for matched record:",
         ("Save as .AT2 format",
-        "Save as 1-column (Accel) .txt file")
+        "Save as 1-column (Accel) .txt file",
+        "Save as binary results (.npz)")
     )   
 
     if saveoption == "Save as .AT2 format":
@@ -159,7 +260,8 @@ if saveR:
             'station': name1.split('_comp_')[0] if '_comp_' in name1 else name1,
             'component': f"{name1.split('_comp_')[-1]}-Matched"
         }
-        outputfile_1 = hf.my_save_results_as_at2(results, comp_key='scc1', header_details=at2_header1)
+        with timer.stage('serialization'):
+            outputfile_1 = hf.my_save_results_as_at2(results, result_key=result_key, comp_key='scc1', header_details=at2_header1)
         
 
         # --- Save Component 2 ---
@@ -169,7 +271,8 @@ if saveR:
             'station': name2.split('_comp_')[0] if '_comp_' in name2 else name2,
             'component': f"{name2.split('_comp_')[-1]}-Matched"
         }
-        outputfile_2 = hf.my_save_results_as_at2(results, comp_key='scc2', header_details=at2_header2)
+        with timer.stage('serialization'):
+            outputfile_2 = hf.my_save_results_as_at2(results, result_key=result_key, comp_key='scc2', header_details=at2_header2)
 
         hf.callATSave(outputfile_1,outputfile_2, at2_filepath1,at2_filepath2)
         
@@ -181,7 +284,8 @@ if saveR:
                         f"Original Seed: {name1}\n"
                         f"Target Spectrum: {target.name}\n"
                         f"Data points follow:")
-        outputfile_1col_1 = hf.my_save_results_as_1col(results, comp_key='scc1', header_str=header_1col_1)
+        with timer.stage('serialization'):
+            outputfile_1col_1 = hf.my_save_results_as_1col(results, result_key=result_key, comp_key='scc1', header_str=header_1col_1)
         
         # --- Save Component 2 ---
         txt_1col_filepath2 = f"{output_base_name}_Comp2_Matched_1col.txt"
@@ -189,12 +293,34 @@ if saveR:
                         f"Original Seed: {name2}\n"
                         f"Target Spectrum: {target.name}\n"
                         f"Data points follow:")
-        outputfile_1col_2 = hf.my_save_results_as_1col(results, comp_key='scc2', header_str=header_1col_2)
+        with timer.stage('serialization'):
+            outputfile_1col_2 = hf.my_save_results_as_1col(results, result_key=result_key, comp_key='scc2', header_str=header_1col_2)
 
         hf.call1colSave(outputfile_1col_1,outputfile_1col_2, txt_1col_filepath1,txt_1col_filepath2)
+
+    elif saveoption == "Save as binary results (.npz)":
+        # --- Both components, spectra and target in one binary file ---
+        npz_filepath = f"{output_base_name}_Matched.npz"
+        float32 = st.checkbox("Single precision (half the size)", value=False)
+        npz_metadata = {'records': [name1, name2], 'seed_files': [filenames1.name, filenames2.name],
+                        'target': target.name, 'nn': nn, 'T1': TL1, 'T2': TL2, 'zi': dampratio}
+        with timer.stage('serialization'):
+            outputfile = hf.my_save_results_as_npz(results, result_key=result_key, float32=float32, target_spec=(To_plot, dso_plot),
+                                                   metadata=npz_metadata)
+        st.download_button("Save Spectrally Matched Results as .npz", outputfile.getvalue(), file_name=npz_filepath, mime="application/octet-stream")
+
+    # --- All formats of both components, velocity/displacement and spectra in one archive ---
+    components = [(f"{output_base_name}_Comp1", filenames1.name, name1, export.ROTDNN_KEYS[0]),
+                  (f"{output_base_name}_Comp2", filenames2.name, name2, export.ROTDNN_KEYS[1])]
+    hf.my_export_bundle_button(results, result_key, components, output_base_name, target.name,
+                               (To_plot, dso_plot), nn=nn)
         
         
 
 
 print("\nScript finished.")
 
+if diagnostics:
+    hf.my_show_diagnostics(timer, page='rotdnn', result_key=result_key,
+                           records=[filenames1.name, filenames2.name])
+
@@ -0,0 +1,414 @@
+"""
+Headless batch spectral matching.
+
+Matches a suite of PEER .AT2 records (e.g. the 11-40 records of an ASCE 7
+Ch. 16 suite) to one target spectrum outside of the Streamlit pages. Records
+are matched in parallel in a process pool; a failing record is reported in
+the summary without stopping the rest of the suite.
+
+Records are given either as a directory of .AT2 files or as a manifest text
+file with one record per line (two records per line, separated by a comma or
+whitespace, in rotdnn mode). Paths in a manifest are relative to the manifest.
+In rotdnn mode a directory is grouped by the RSN prefix of the file names
+(e.g. RSN175_...-E12140.AT2 and RSN175_...-E12230.AT2).
+
+Usage:
+    python batchmatch.py TARGET RECORDS [--mode single|rotdnn] [--out DIR]
+                         [--workers N] [--T1 0.05] [--T2 6.0] [--zi 0.05]
+                         [--nit 15] [--nn 100] [--no-baseline] [--porder -1]
+                         [--target-points 200] [--formats at2 2col 1col npz] [--float32]
+                         [--verify-damping 0.02 0.05 0.1]
+                         [--tol 0] [--mean-tol 0] [--delta 0] [--patience 0]
+                         [--profile timings.jsonl] [--zip] [--low-memory] [--decimate] [--qa]
+
+With --profile, the wall time and peak memory of each stage (parsing,
+matching and its sub-stages, serialization) are appended to the given file
+as one JSON line per record, preceded by a line for the target loading.
+The npz format writes one binary results file per record (or record pair)
+with all components, spectra and the target (see resultsfile.py); --float32
+stores it in single precision. With --zip, all outputs and summary.csv are also packed into DIR/matched.zip.
+--low-memory runs the matching in memory-aware mode (single-precision wavelet
+details, see matching.py), e.g. for long 200 Hz records on many workers.
+The components of a pair are brought to a common time step and length before
+matching (see conditioning.py); --decimate also resamples over-sampled records
+to the coarsest time step that keeps 5 points per period at T1.
+With --qa, a quality assurance report of the whole suite (see qa.py) is
+written to DIR/qa.csv (spectral ratios per record or pair), DIR/qa_motion.csv
+(motion parameters per component) and DIR/qa.png and printed.
+"""
+
+from typing import Tuple, List, Optional, Dict, Any
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import contextlib
+import csv
+import logging
+import os
+import sys
+import time
+import zipfile
+import numpy as np
+import streamlit.logger
+
+streamlit.logger.set_log_level('error') # Caching outside the Streamlit runtime is expected here
+import conditioning
+import helperfunctions as hf
+import qa
+import resultsfile
+from profiling import StageTimer
+
+log = logging.getLogger(__name__)
+
+FORMATS = ('at2', '2col', '1col', 'npz')
+
+
+def find_records(records: str, mode: str) -> List[Tuple[str, ...]]:
+    """Lists the records (single) or record pairs (rotdnn) to be matched.
+
+    Parameters
+    ----------
+    records : str
+        Directory of .AT2 files or manifest file.
+    mode : str
+        'single' or 'rotdnn'.
+
+    Returns
+    -------
+    List[Tuple[str, ...]]
+        One tuple of paths per matching job (1 path for single, 2 for rotdnn).
+    """
+    ncomp = 2 if mode == 'rotdnn' else 1
+    if os.path.isdir(records):
+        paths = sorted(os.path.join(records, f) for f in os.listdir(records)
+                       if f.upper().endswith('.AT2'))
+        if ncomp == 1:
+            return [(p,) for p in paths]
+        groups: Dict[str, List[str]] = {}
+        for p in paths:
+            groups.setdefault(os.path.basename(p).split('_')[0], []).append(p)
+        return [tuple(g) for g in groups.values()]
+
+    jobs = []
+    base = os.path.dirname(os.path.abspath(records))
+    with open(records) as fp:
+        for line in fp:
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            parts = line.replace(',', ' ').split()
+            jobs.append(tuple(p if os.path.isabs(p) else os.path.join(base, p) for p in parts))
+    return jobs
+
+
+def _record_header(path: str, eqname: str, target_name: str) -> Dict[str, str]:
+    return {
+        'title': f'Matched record from {os.path.basename(path)} (Target: {target_name})',
+        'station': eqname.split('_comp_')[0] if '_comp_' in eqname else eqname,
+        'component': f"{eqname.split('_comp_')[-1]}-Matched"
+    }
+
+
+def _save_outputs(results: Dict[str, Any], result_key: str, comp_key: str, path: str, eqname: str,
+                  target_name: str, out_base: str, formats: List[str]) -> List[str]:
+    """Writes the requested output formats of one matched component."""
+    written = []
+    if 'at2' in formats:
+        out_path = f"{out_base}_Matched.AT2"
+        with open(out_path, 'w') as fp:
+            hf.my_write_at2(fp, results[comp_key], results['dt'], comp_key=comp_key,
+                            header_details=_record_header(path, eqname, target_name))
+        written.append(out_path)
+    if '2col' in formats:
+        out_path = f"{out_base}_Matched_2col.txt"
+        header = (f"Matched acceleration (g) vs. Time (s)\n"
+                  f"Original Seed: {eqname}\n"
+                  f"Target Spectrum: {target_name}\n"
+                  f"Time (s), Acceleration (g)")
+        output = hf.my_save_results_as_2col(results, result_key=result_key, comp_key=comp_key,
+                                            header_str=header)
+        with open(out_path, 'w') as fp:
+            fp.write(output.getvalue())
+        written.append(out_path)
+    if '1col' in formats:
+        out_path = f"{out_base}_Matched_1col.txt"
+        header = (f"Matched acceleration (g), dt={results['dt']:.8f}s\n"
+                  f"Original Seed: {eqname}\n"
+                  f"Target Spectrum: {target_name}\n"
+                  f"Data points follow:")
+        output = hf.my_save_results_as_1col(results, result_key=result_key, comp_key=comp_key,
+                                            header_str=header)
+        with open(out_path, 'w') as fp:
+            fp.write(output.getvalue())
+        written.append(out_path)
+    return written
+
+
+def _save_spectra(results: Dict[str, Any], comp_key: str, dampings: List[float], out_base: str) -> str:
+    """Writes matched-record PSA at the verification damping ratios as CSV."""
+    T = results['T']
+    psa = hf.my_verification_spectra((results[comp_key],), results['dt'], T, tuple(dampings))[0]
+    out_path = f"{out_base}_Spectra.csv"
+    header = 'Period (s),' + ','.join(f"PSA {100 * z:g}% (g)" for z in dampings)
+    np.savetxt(out_path, np.column_stack((T, psa.T)), fmt='%.8e', delimiter=',', header=header, comments='')
+    return out_path
+
+
+def _stage(timer: Optional[StageTimer], name: str):
+    return timer.stage(name) if timer is not None else contextlib.nullcontext()
+
+
+def match_record(paths: Tuple[str, ...], target: Tuple[str, Any, Any], params: Dict[str, Any],
+                 out_dir: str, formats: List[str]) -> Dict[str, Any]:
+    """Matches one record (or record pair) and saves the outputs.
+
+    Runs in a worker process. Errors are returned in the summary row rather
+    than raised, so one bad record does not abort the suite. With
+    params['profile'] the stage timings are returned under row['stages'];
+    the paths of the files written are returned under row['outputs'] and,
+    with params['qa'], the arrays of the QA report under row['qa'].
+    """
+    name = ' + '.join(os.path.basename(p) for p in paths)
+    row = {'record': name, 'status': 'ok', 'rmsefin': None, 'meanefin': None, 'nit_used': None,
+           'sf': None, 'npts': None, 'dt': None, 'seconds': None, 'error': ''}
+    timer = StageTimer(memory=True) if params.get('profile') else None
+    outputs: List[str] = []
+    t0 = time.perf_counter()
+    try:
+        target_name, To, dso = target
+        records = []
+        with _stage(timer, 'parse'):
+            for p in paths:
+                with open(p) as fp:
+                    records.append(hf.my_parse_PEERNGA_record(fp))
+        with _stage(timer, 'conditioning'):
+            accs, dt, report = conditioning.condition_records([(rec[0], rec[1]) for rec in records],
+                                                              params['T1'], params.get('decimate', False))
+        for line in conditioning.describe(report, [os.path.basename(p) for p in paths]):
+            log.warning(line)
+        stopping = {k: params.get(k, 0) for k in ('tol', 'mean_tol', 'delta', 'patience')}
+        with _stage(timer, 'matching'):
+            if params['mode'] == 'rotdnn':
+                if len(records) != 2:
+                    raise ValueError(f"rotdnn mode needs two components, got {len(records)}.")
+                results, result_key = hf.my_REQPYrotdnn(
+                    s1=accs[0], s2=accs[1], fs=1 / dt, dso=dso, To=To, nn=params['nn'],
+                    T1=params['T1'], T2=params['T2'], zi=params['zi'], nit=params['nit'],
+                    baseline=params['baseline'], porder=params['porder'], timer=timer,
+                    low_memory=params.get('low_memory', False), **stopping)
+                comp_keys = ('scc1', 'scc2')
+            else:
+                if len(records) != 1:
+                    raise ValueError(f"single mode needs one record per line, got {len(records)}.")
+                results, result_key = hf.my_REQPY_single(
+                    s=accs[0], fs=1 / dt, dso=dso, To=To,
+                    T1=params['T1'], T2=params['T2'], zi=params['zi'], nit=params['nit'],
+                    baseline=params['baseline'], porder=params['porder'], timer=timer,
+                    low_memory=params.get('low_memory', False), **stopping)
+                comp_keys = ('ccs',)
+
+        target_stem = os.path.splitext(target_name)[0]
+        with _stage(timer, 'serialization'):
+            for i, (p, rec, comp_key) in enumerate(zip(paths, records, comp_keys)):
+                stem = os.path.splitext(os.path.basename(p))[0]
+                suffix = f"_Comp{i + 1}" if len(comp_keys) > 1 else ''
+                out_base = os.path.join(out_dir, f"{stem}_{target_stem}{suffix}")
+                outputs += _save_outputs(results, result_key, comp_key, p, rec[3], target_name, out_base, formats)
+                if params.get('verify_damping'):
+                    outputs.append(_save_spectra(results, comp_key, params['verify_damping'], out_base))
+            if 'npz' in formats:
+                stem = os.path.splitext(os.path.basename(paths[0]))[0]
+                out_path = os.path.join(out_dir, f"{stem}_{target_stem}_Matched.npz")
+                resultsfile.save_results(out_path, results, float32=params.get('float32', False),
+                                         target_spec=(To, dso),
+                                         metadata={'records': [rec[3] for rec in records],
+                                                   'seed_files': [os.path.basename(p) for p in paths],
+                                                   'target': target_name, 'mode': params['mode'],
+                                                   'nn': params['nn'], 'T1': params['T1'], 'T2': params['T2'],
+                                                   'zi': params['zi']})
+                outputs.append(out_path)
+
+        row.update(rmsefin=results['rmsefin'], meanefin=results['meanefin'],
+                   nit_used=results['nit_used'], sf=results['sf'],
+                   npts=len(results[comp_keys[0]]), dt=results['dt'])
+        if params.get('qa'):
+            row['qa'] = qa.record_data(results, accs, comp_keys)
+    except Exception as e:
+        row.update(status='failed', error=f"{type(e).__name__}: {e}")
+    row['seconds'] = time.perf_counter() - t0
+    if timer is not None:
+        row['stages'] = timer.records
+    row['outputs'] = outputs
+    return row
+
+
+def format_summary(rows: List[Dict[str, Any]]) -> str:
+    """Formats the summary rows as a fixed-width text table."""
+    width = max([len('record')] + [len(r['record']) for r in rows])
+    lines = [f"{'record':<{width}s}  {'status':<6s}  {'RMSE %':>7s}  {'misfit %':>8s}  {'sf':>7s}  {'time s':>7s}"]
+    for r in rows:
+        if r['status'] == 'ok':
+            lines.append(f"{r['record']:<{width}s}  {r['status']:<6s}  {r['rmsefin']:7.2f}  "
+                         f"{r['meanefin']:8.2f}  {r['sf']:7.3f}  {r['seconds']:7.1f}")
+        else:
+            lines.append(f"{r['record']:<{width}s}  {r['status']:<6s}  {r['error']}")
+    ok = [r for r in rows if r['status'] == 'ok']
+    if ok:
+        lines.append(f"{len(ok)}/{len(rows)} matched, mean RMSE {sum(r['rmsefin'] for r in ok) / len(ok):.2f}%, "
+                     f"mean misfit {sum(r['meanefin'] for r in ok) / len(ok):.2f}%")
+    else:
+        lines.append(f"0/{len(rows)} matched")
+    return '\n'.join(lines)
+
+
+def write_qa_report(records: List[Dict[str, Any]], names: List[str], To: np.ndarray, dso: np.ndarray,
+                    T1: float, T2: float, out_dir: str) -> List[str]:
+    """Writes the QA report of the matched records (qa.csv, qa_motion.csv, qa.png) and prints it."""
+    report = qa.suite_report(records, names, To, dso, T1, T2)
+    paths = [os.path.join(out_dir, name) for name in ('qa.csv', 'qa_motion.csv', 'qa.png')]
+    for path, rows in zip(paths, (report['rows'], report['components'])):
+        with open(path, 'w', newline='') as fp:
+            writer = csv.DictWriter(fp, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+    qa.plot_report(report, paths[2])
+    print()
+    print(qa.format_report(report))
+    return paths
+
+
+def _append_line(path: str, line: str) -> None:
+    with open(path, 'a') as fp:
+        fp.write(line + '\n')
+
+
+def run_batch(target_path: str, records: str, out_dir: str, params: Dict[str, Any],
+              formats: List[str], workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Matches all records against one target and writes summary.csv to `out_dir`.
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        One summary row per record (or record pair), in input order.
+    """
+    profile = params.get('profile')
+    timer = StageTimer(memory=True) if profile else None
+    with _stage(timer, 'target spectrum'):
+        To, dso = hf.my_load_target_spectrum(target_path)
+        if params.get('target_points', 0) > 0:
+            To, dso, report = hf.my_resample_target(To, dso, params['T1'], params['T2'],
+                                                    npts=params['target_points'])
+    if params.get('target_points', 0) > 0:
+        print(f"Target resampled from {report['n_dense']} to {report['n_resampled']} periods "
+              f"(max interpolation error {report['max_error']:.3f}%)")
+    target = (os.path.basename(target_path), To, dso)
+    if profile:
+        _append_line(profile, timer.to_json(record=None, target=target[0], mode=params['mode']))
+    jobs = find_records(records, params['mode'])
+    if not jobs:
+        raise ValueError(f"No .AT2 records found in {records}.")
+    os.makedirs(out_dir, exist_ok=True)
+
+    rows: List[Optional[Dict[str, Any]]] = [None] * len(jobs)
+    qa_data: List[Optional[Dict[str, Any]]] = [None] * len(jobs)
+    outputs: List[str] = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(match_record, paths, target, params, out_dir, formats): i
+                   for i, paths in enumerate(jobs)}
+        for done, fut in enumerate(as_completed(futures), start=1):
+            i = futures[fut]
+            try:
+                row = fut.result()
+            except Exception as e: # e.g. a worker process died
+                row = {'record': ' + '.join(os.path.basename(p) for p in jobs[i]), 'status': 'failed',
+                       'rmsefin': None, 'meanefin': None, 'nit_used': None, 'sf': None, 'npts': None, 'dt': None,
+                       'seconds': None, 'error': f"{type(e).__name__}: {e}"}
+            outputs += row.pop('outputs', [])
+            qa_data[i] = row.pop('qa', None)
+            if profile and 'stages' in row:
+                stages = StageTimer()
+                stages.records = row.pop('stages')
+                _append_line(profile, stages.to_json(record=row['record'], target=target[0],
+                                                     mode=params['mode'], status=row['status']))
+            rows[i] = row
+            if row['status'] == 'ok':
+                print(f"[{done}/{len(jobs)}] {row['record']}: RMSE {row['rmsefin']:.2f}%, "
+                      f"misfit {row['meanefin']:.2f}%, {row['nit_used']} iterations "
+                      f"({row['seconds']:.1f} s)", flush=True)
+            else:
+                print(f"[{done}/{len(jobs)}] {row['record']}: FAILED - {row['error']}", flush=True)
+
+    with open(os.path.join(out_dir, 'summary.csv'), 'w', newline='') as fp:
+        writer = csv.DictWriter(fp, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+    if params.get('qa') and any(d is not None for d in qa_data):
+        outputs += write_qa_report([d for d in qa_data if d is not None],
+                                   [r['record'] for r, d in zip(rows, qa_data) if d is not None],
+                                   To, dso, params['T1'], params['T2'], out_dir)
+    if params.get('zip'):
+        # The files are already serialized; they are only copied into the archive
+        with zipfile.ZipFile(os.path.join(out_dir, 'matched.zip'), 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+            for path in outputs + [os.path.join(out_dir, 'summary.csv')]:
+                zf.write(path, arcname=os.path.basename(path))
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Batch spectral matching of a suite of PEER .AT2 records.")
+    parser.add_argument('target', help="Target spectrum file (two columns: Period (s), PSA (g))")
+    parser.add_argument('records', help="Directory of .AT2 files or manifest file")
+    parser.add_argument('--mode', choices=('single', 'rotdnn'), default='single',
+                        help="single: REQPY_single per record; rotdnn: REQPYrotdnn per record pair")
+    parser.add_argument('--out', default='matched', help="Output directory (default: ./matched)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--T1', type=float, default=0.05, help="Lower period limit for matching (s)")
+    parser.add_argument('--T2', type=float, default=6.0, help="Upper period limit for matching (s)")
+    parser.add_argument('--zi', type=float, default=0.05, help="Damping ratio for spectra")
+    parser.add_argument('--nit', type=int, default=15, help="Number of matching iterations")
+    parser.add_argument('--nn', type=int, default=100, help="Percentile for RotD (rotdnn mode)")
+    parser.add_argument('--no-baseline', action='store_true', help="Skip baseline correction")
+    parser.add_argument('--porder', type=int, default=-1, help="Detrending order for baseline (-1 = none)")
+    parser.add_argument('--target-points', type=int, default=200,
+                        help="Log-spaced target periods used for matching (0 = full target)")
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=['at2'], help="Output formats")
+    parser.add_argument('--float32', action='store_true',
+                        help="Store npz results files in single precision")
+    parser.add_argument('--verify-damping', type=float, nargs='+', default=[],
+                        help="Also write matched spectra at these damping ratios (e.g. 0.02 0.05 0.1)")
+    parser.add_argument('--tol', type=float, default=0.0,
+                        help="Stop early once the RMSE is below this value (%%, 0 = off)")
+    parser.add_argument('--mean-tol', type=float, default=0.0,
+                        help="Stop early once the mean misfit is below this value (%%, 0 = off)")
+    parser.add_argument('--delta', type=float, default=0.0,
+                        help="Minimum RMSE improvement (%% points) counted by --patience")
+    parser.add_argument('--patience', type=int, default=0,
+                        help="Stop after this many iterations without improvement (0 = off)")
+    parser.add_argument('--profile', default=None, metavar='FILE',
+                        help="Append per-stage wall time and peak memory as JSON lines to FILE")
+    parser.add_argument('--zip', action='store_true',
+                        help="Also pack all outputs and summary.csv into OUT/matched.zip")
+    parser.add_argument('--low-memory', action='store_true',
+                        help="Single-precision wavelet details (lower peak memory per worker)")
+    parser.add_argument('--qa', action='store_true',
+                        help="Write a QA report of the suite (spectral ratios, PGA/PGV/PGD/Arias changes)")
+    parser.add_argument('--decimate', action='store_true',
+                        help="Resample over-sampled records to a coarser time step (>= 5 points per period at T1)")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Show matching progress logs")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(levelname)s: %(message)s')
+    params = {'mode': args.mode, 'T1': args.T1, 'T2': args.T2, 'zi': args.zi, 'nit': args.nit,
+              'nn': args.nn, 'baseline': not args.no_baseline, 'porder': args.porder,
+              'target_points': args.target_points, 'verify_damping': args.verify_damping,
+              'tol': args.tol, 'mean_tol': args.mean_tol, 'delta': args.delta, 'patience': args.patience,
+              'profile': args.profile, 'zip': args.zip,
+              'float32': args.float32, 'low_memory': args.low_memory, 'decimate': args.decimate, 'qa': args.qa}
+    rows = run_batch(args.target, args.records, args.out, params, args.formats, args.workers)
+    print()
+    print(format_summary(rows))
+    return 0 if all(r['status'] == 'ok' for r in rows) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
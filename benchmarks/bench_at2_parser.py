@@ -0,0 +1,88 @@
+"""
+Benchmark: PEER .AT2 parsing.
+
+Compares the bulk parser used by helperfunctions.my_parse_PEERNGA_record
+against the previous per-token implementation (a Python list built with
+float() per value). The bundled RSN175 records are tiled to 100k+ points
+to mimic long 200 Hz records.
+
+Usage:
+    python benchmarks/bench_at2_parser.py [--repeat 5] [--sizes 7814 100000 500000]
+"""
+
+from typing import Tuple, List
+import argparse
+import io
+import os
+import sys
+import time
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import helperfunctions as hf
+
+SEED_FILES = ('SampleInput_RSN175_IMPVALL.H_H-E12140.AT2',
+              'SampleInput_RSN175_IMPVALL.H_H-E12230.AT2')
+
+
+def legacy_parse(fp) -> Tuple[np.ndarray, float, int, str]:
+    """Per-token parser, as implemented before the bulk parser."""
+    next(fp)
+    line2 = next(fp).strip().split(',')
+    eqname = f"{line2[1].strip().split('/')[2]}_{line2[0].strip()}_{line2[2].strip()}_comp_{line2[3].strip()}"
+    next(fp)
+    line4 = next(fp).strip().split(',')
+    npts = int(line4[0].split('=')[1].strip())
+    dt = float(line4[1].split('=')[1].split()[0])
+    acc_flat = [float(p) for line in fp for p in line.split()]
+    acc = np.array(acc_flat)
+    return acc, dt, len(acc), eqname
+
+
+def make_record(path: str, npts: int) -> str:
+    """Tiles the data block of a bundled record to `npts` points."""
+    with open(path) as fp:
+        header = [next(fp) for _ in range(4)]
+        acc = np.fromstring(fp.read(), sep=' ')
+    acc = np.resize(acc, npts)
+    header[3] = f"NPTS= {npts:7d}, DT=   .0050 SEC,\n"
+    body = io.StringIO()
+    full, rest = divmod(npts, 5)
+    np.savetxt(body, acc[:full * 5].reshape(-1, 5), fmt='%15.7E', delimiter='')
+    if rest:
+        np.savetxt(body, acc[full * 5:].reshape(1, -1), fmt='%15.7E', delimiter='')
+    return ''.join(header) + body.getvalue()
+
+
+def best_time(func, text: str, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        fp = io.StringIO(text)
+        t0 = time.perf_counter()
+        func(fp)
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[7814, 100000, 200000, 500000])
+    args = parser.parse_args(argv)
+
+    print(f"{'record':<45s} {'npts':>8s} {'legacy [ms]':>12s} {'bulk [ms]':>10s} {'speedup':>8s}")
+    for name in SEED_FILES:
+        for npts in args.sizes:
+            text = make_record(os.path.join(ROOT, name), npts)
+            new = hf.my_parse_PEERNGA_record(io.StringIO(text))[0]
+            old = legacy_parse(io.StringIO(text))[0]
+            if not np.array_equal(new, old):
+                raise AssertionError(f"Parsers disagree for {name} at {npts} points")
+            t_old = best_time(legacy_parse, text, args.repeat)
+            t_new = best_time(hf.my_parse_PEERNGA_record, text, args.repeat)
+            print(f"{name:<45s} {npts:8d} {t_old * 1e3:12.2f} {t_new * 1e3:10.2f} {t_old / t_new:7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
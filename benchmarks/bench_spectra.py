@@ -0,0 +1,103 @@
+"""
+Benchmark: response spectra for many periods and damping ratios.
+
+Compares spectra.response_spectra (one batched pass over all periods and
+damping ratios) against naive loops over the periods: a per-period
+frequency-domain loop in numpy and reqpy_M.compute_spectrum called once per
+damping ratio. Also compares spectra.rotated_spectra (RotDnn of the pair)
+against reqpy_M.compute_rotated_spectra. Uses the bundled RSN175 records.
+
+Usage:
+    python benchmarks/bench_spectra.py [--periods 200] [--damping 0.02 0.05 0.1]
+"""
+
+from typing import List
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import spectra
+from reqpy_M import compute_spectrum, compute_rotated_spectra
+
+SEED_FILES = ('SampleInput_RSN175_IMPVALL.H_H-E12140.AT2',
+              'SampleInput_RSN175_IMPVALL.H_H-E12230.AT2')
+
+
+def load_record(path: str):
+    with open(path) as fp:
+        lines = fp.readlines()
+    dt = float(lines[3].split('DT=')[1].split()[0])
+    return np.fromstring(''.join(lines[4:]), sep=' '), dt
+
+
+def naive_spectra(T: np.ndarray, s: np.ndarray, dt: float, dampings: np.ndarray) -> np.ndarray:
+    """One FFT-based oscillator at a time (same padding as reqpy_M)."""
+    npo = len(s)
+    nfft = int(2**np.ceil(np.log2(npo + 10 * np.max(T) / dt)))
+    ffts = np.fft.rfft(s, nfft)
+    ww = 2 * np.pi * np.fft.rfftfreq(nfft, dt)
+    PSA = np.zeros((len(dampings), len(T)))
+    for i, z in enumerate(dampings):
+        for k, Tk in enumerate(T):
+            wn = 2 * np.pi / Tk
+            d = np.fft.irfft(-ffts / (wn**2 - ww**2 + 2j * z * wn * ww), nfft)[:npo]
+            PSA[i, k] = wn**2 * np.max(np.abs(d))
+    return PSA
+
+
+def reqpy_spectra(T: np.ndarray, s: np.ndarray, dt: float, dampings: np.ndarray) -> np.ndarray:
+    return np.array([compute_spectrum(T, s, z, dt)[0] for z in dampings])
+
+
+def best_time(func, repeat: int):
+    best, out = np.inf, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = func()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--periods', type=int, default=200)
+    parser.add_argument('--damping', type=float, nargs='+', default=[0.02, 0.05, 0.10])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    T = np.geomspace(0.01, 10.0, args.periods)
+    dampings = np.array(args.damping)
+    print(f"{len(T)} periods x {len(dampings)} damping ratios")
+    print(f"{'record':<45s} {'method':<28s} {'time [ms]':>10s} {'max rel. diff':>14s}")
+    for name in SEED_FILES:
+        s, dt = load_record(os.path.join(ROOT, name))
+        compute_spectrum(T[:2], s, 0.02, dt) # numba compilation outside the timings
+        t_ref, ref = best_time(lambda: reqpy_spectra(T, s, dt, dampings), args.repeat)
+        rows = [('reqpy_M.compute_spectrum loop', t_ref, ref)]
+        rows.append(('naive per-period FD loop', *best_time(lambda: naive_spectra(T, s, dt, dampings), args.repeat)))
+        for method in ('auto', 'fd', 'pw'):
+            rows.append((f"response_spectra ({method})",
+                         *best_time(lambda: spectra.response_spectra(T, s, dt, dampings, method)[0], args.repeat)))
+        for label, t, psa in rows:
+            print(f"{name:<45s} {label:<28s} {t * 1e3:10.1f} {np.max(np.abs(psa / ref - 1)):14.2e}")
+
+    s1, dt = load_record(os.path.join(ROOT, SEED_FILES[0]))
+    s2, _ = load_record(os.path.join(ROOT, SEED_FILES[1]))
+    n = min(len(s1), len(s2))
+    theta = np.arange(0, 180, 1)
+    print()
+    print(f"RotDnn of the RSN175 pair, {len(T)} periods x 180 angles")
+    print(f"{'damping':<8s} {'method':<34s} {'time [ms]':>10s} {'max rel. diff':>14s}")
+    for z in dampings:
+        t_ref, ref = best_time(lambda: compute_rotated_spectra(T, s1[:n], s2[:n], z, dt, theta)[0], args.repeat)
+        t_new, psa = best_time(lambda: spectra.rotated_spectra(T, s1, s2, dt, z), args.repeat)
+        print(f"{z:<8g} {'reqpy_M.compute_rotated_spectra':<34s} {t_ref * 1e3:10.1f} {0.0:14.2e}")
+        print(f"{z:<8g} {'spectra.rotated_spectra':<34s} {t_new * 1e3:10.1f} {np.max(np.abs(psa / ref - 1)):14.2e}")
+
+
+if __name__ == '__main__':
+    main()
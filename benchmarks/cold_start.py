@@ -0,0 +1,100 @@
+"""
+Cold-start report of the Streamlit pages.
+
+Each page is run once, before any file is uploaded, in a fresh Python
+process (as in a newly started container): the page script's imports and its
+first render are timed, and the heavy modules loaded by then are listed.
+matplotlib, scipy, reqpy_M, numba and the matching/plotting modules should
+only be imported once a matching run starts, so the first render stays
+fast. The slowest imports of the run (python -X importtime) are listed too.
+
+The run fails (exit code 1) if a page takes longer than the target.
+
+Usage:
+    python benchmarks/cold_start.py [--pages Main.py SingleComponentMatching.py ...]
+                                    [--target 0.25] [--repeat 3] [--out cold_start.json]
+"""
+
+from typing import List, Dict, Any, Optional
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PAGES = ('Main.py', 'SingleComponentMatching.py', 'TwoComponentMatching.py')
+HEAVY_MODULES = ('matplotlib', 'scipy', 'reqpy_M', 'numba', 'matching', 'plotting', 'spectra')
+TARGET_S = 0.25 # First render of a page, imports included
+
+# Run in the child process: streamlit itself is imported before timing, as
+# the server has it loaded before any page runs.
+_CHILD = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({page!r}, default_timeout=60)
+t0 = time.perf_counter()
+at.run()
+seconds = time.perf_counter() - t0
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(json.dumps({{'seconds': seconds, 'heavy': heavy, 'exceptions': [e.value for e in at.exception]}}))
+"""
+
+
+def slowest_imports(stderr: str, top: int) -> List[Dict[str, Any]]:
+    """Packages and modules (not submodules) with the largest cumulative time in -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        if '.' not in name:
+            rows.append({'module': name, 'ms': int(cumulative) / 1000})
+    return sorted(rows, key=lambda r: -r['ms'])[:top]
+
+
+def run_page(page: str, top: int = 5) -> Dict[str, Any]:
+    """First render of `page` in a fresh process."""
+    code = _CHILD.format(page=os.path.join(ROOT, page), heavy=HEAVY_MODULES)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, capture_output=True,
+                          text=True, env={**os.environ, 'PYTHONPATH': ROOT})
+    if proc.returncode != 0:
+        raise RuntimeError(f"{page} failed:\n{proc.stderr[-2000:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    # Imports made while the page ran are listed after those of AppTest; keep the page's only
+    page_part = proc.stderr.split('streamlit.testing.v1\n', 1)[-1]
+    result['slowest_imports'] = slowest_imports(page_part, top)
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--pages', nargs='+', default=list(PAGES), help="Page scripts to run")
+    parser.add_argument('--target', type=float, default=TARGET_S, help="Target first render time per page (s)")
+    parser.add_argument('--repeat', type=int, default=3, help="Fresh processes per page (the minimum is reported)")
+    parser.add_argument('--out', default=None, help="Write the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = []
+    print(f"{'page':<30s} {'first render [s]':>17s}  heavy modules loaded")
+    for page in args.pages:
+        runs = [run_page(page) for _ in range(args.repeat)]
+        best = min(runs, key=lambda r: r['seconds'])
+        report.append({'page': page, **best, 'runs': [r['seconds'] for r in runs]})
+        print(f"{page:<30s} {best['seconds']:>17.3f}  {', '.join(best['heavy']) or '-'}")
+        for e in best['exceptions']:
+            print(f"    exception: {e}")
+        for r in best['slowest_imports']:
+            print(f"    {r['module']:<26s} {r['ms']:>8.1f} ms")
+    slow = [r['page'] for r in report if r['seconds'] > args.target]
+    print(f"Target {args.target:.2f} s per page: " + (f"exceeded by {', '.join(slow)}" if slow else "met"))
+    if args.out:
+        with open(args.out, 'w') as fp:
+            json.dump({'target_s': args.target, 'pages': report}, fp, indent=2)
+        print(f"Report written to {args.out}")
+    return 1 if slow else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,262 @@
+"""
+Load test of the Streamlit matching pages with concurrent simulated users.
+
+Each simulated user is a thread driving the pages with Streamlit's AppTest,
+as a browser session would: it opens a page, uploads the bundled target and
+seed record(s) (SampleInput_*), waits for the background matching job to
+finish and then changes the output format (a rerun on cached results). All
+users run in this one process, like the sessions of one Streamlit server,
+so they share the job queue (REQPY_WORKERS worker threads), the caches and
+the memory of the process. AppTest installs a process-wide runtime for each
+script run, so the script runs of the sessions take turns (as they do for the
+GIL on one CPU); their matching jobs run concurrently in the job queue.
+
+Every session uploads a slightly scaled copy of the target (by 1e-4 per
+session), so each one is a distinct matching run rather than a cache hit or
+an attached job; --shared-inputs uploads the same files in every session
+instead.
+
+Reported per page: end-to-end latency (page load to results shown) and
+rerun latency, p50 / p95 / max; and for the whole run: CPU seconds per
+session (process CPU time / sessions) and memory (resident set size before
+the test, its peak, and the increase per concurrent user). The run fails
+(exit code 1) if a session fails or the p95 end-to-end latency exceeds
+--max-p95.
+
+Usage:
+    python benchmarks/load_test.py [--users 4] [--sessions 2] [--workers 1]
+                                   [--pages SingleComponentMatching.py TwoComponentMatching.py]
+                                   [--shared-inputs] [--warmup 1] [--max-p95 S] [--out load_test.json]
+"""
+
+from typing import List, Dict, Any, Optional
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PAGES = ('SingleComponentMatching.py', 'TwoComponentMatching.py')
+TARGET = 'SampleInput_ASCE7.txt'
+SEEDS = {'SingleComponentMatching.py': ('SampleInput_RSN175_IMPVALL.H_H-E12140.AT2',),
+         'TwoComponentMatching.py': ('SampleInput_RSN175_IMPVALL.H_H-E12140.AT2',
+                                     'SampleInput_RSN175_IMPVALL.H_H-E12230.AT2')}
+
+
+_SCRIPT_RUN = threading.Lock() # One AppTest script run at a time (see the module docstring)
+
+
+def _read(name: str) -> bytes:
+    with open(os.path.join(ROOT, name), 'rb') as fp:
+        return fp.read()
+
+
+def scaled_target(data: bytes, factor: float) -> bytes:
+    """The two-column target file with its PSA column scaled by `factor`."""
+    T, psa = np.loadtxt(data.decode().splitlines(), unpack=True)
+    return '\n'.join(f"{t:.6f} {p * factor:.8f}" for t, p in zip(T, psa)).encode()
+
+
+def rss_mb() -> float:
+    """Current resident set size of this process (MB)."""
+    try:
+        with open('/proc/self/statm') as fp:
+            return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024**2
+    except OSError: # Not Linux: the peak so far (KB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024
+
+
+class _MemoryMonitor(threading.Thread):
+    """Samples the resident set size every `interval` seconds and keeps the peak."""
+
+    def __init__(self, interval: float = 0.1):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = rss_mb()
+        self._halt = threading.Event()
+
+    def run(self) -> None:
+        while not self._halt.wait(self.interval):
+            self.peak = max(self.peak, rss_mb())
+
+    def stop(self) -> float:
+        self._halt.set()
+        self.join()
+        return max(self.peak, rss_mb())
+
+
+def _run(node) -> None:
+    """Runs the page script of an AppTest (or of the AppTest of a widget with a new value)."""
+    with _SCRIPT_RUN:
+        node.run()
+
+
+def _upload(at, page: str, target: bytes) -> None:
+    _run(at.file_uploader[0].set_value((TARGET, target, 'text/plain')))
+    for i, seed in enumerate(SEEDS[page]):
+        _run(at.file_uploader[1 + i].set_value((seed, _read(seed), 'text/plain')))
+
+
+def _finished(at) -> bool:
+    """Whether the page shows results, an error or a warning (not the progress of a job)."""
+    return bool(at.exception or at.error or at.warning or any('Final RMSE' in m.value for m in at.markdown))
+
+
+def run_session(page: str, target: bytes, poll: float = 0.25, timeout: float = 600) -> Dict[str, Any]:
+    """One simulated user session on `page`: uploads, matching, and a rerun on the cached results."""
+    from streamlit.testing.v1 import AppTest
+
+    t0 = time.perf_counter()
+    at = AppTest.from_file(os.path.join(ROOT, page), default_timeout=timeout)
+    _run(at)
+    _upload(at, page, target)
+    while True:
+        # AppTest drops the widget state of a script run cut short (by the app rerun of the
+        # progress fragment, or a failed compile of the page) where a browser keeps it
+        if at.file_uploader and at.file_uploader[0].value is None:
+            _upload(at, page, target)
+        if _finished(at):
+            break
+        if time.perf_counter() - t0 > timeout:
+            raise TimeoutError(f"{page} did not finish within {timeout:.0f} s")
+        time.sleep(poll)
+        _run(at)
+    latency = time.perf_counter() - t0
+    errors = [e.value for e in at.exception]
+    if not errors and not any('Final RMSE' in m.value for m in at.markdown):
+        errors.append(f"No results shown: {[m.value for m in (*at.error, *at.warning)][0]}")
+    rerun = None
+    if not errors:
+        t1 = time.perf_counter()
+        _run(at.selectbox[0].set_value(at.selectbox[0].options[-1]))
+        rerun = time.perf_counter() - t1
+        errors = [e.value for e in at.exception]
+    return {'page': page, 'latency': latency, 'rerun': rerun, 'errors': errors}
+
+
+def _user(index: int, pages: List[str], sessions: int, target: bytes, shared: bool, poll: float,
+          results: List[Dict[str, Any]]) -> None:
+    for k in range(sessions):
+        page = pages[(index + k) % len(pages)]
+        n = index * sessions + k + 1
+        data = target if shared else scaled_target(target, 1 + 1e-4 * n)
+        try:
+            row = run_session(page, data, poll)
+        except Exception as e:
+            row = {'page': page, 'latency': None, 'rerun': None, 'errors': [f"{type(e).__name__}: {e}"]}
+        row.update(user=index, session=n)
+        results.append(row)
+        status = 'ok' if not row['errors'] else f"FAILED - {row['errors'][0]}"
+        print(f"  user {index} session {n} {page}: "
+              + (f"{row['latency']:.2f} s, {status}" if row['latency'] is not None else status), flush=True)
+
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {'p50': None, 'p95': None, 'max': None}
+    return {'p50': float(np.percentile(values, 50)), 'p95': float(np.percentile(values, 95)),
+            'max': float(np.max(values))}
+
+
+def run_load_test(users: int, sessions: int, pages: List[str], shared: bool = False,
+                  warmup: int = 1, poll: float = 0.25) -> Dict[str, Any]:
+    """Runs `users` concurrent simulated users with `sessions` sessions each and summarises them."""
+    target = _read(TARGET)
+    for page in pages if warmup else ():
+        for k in range(warmup): # Imports, numba compilation and first-use caches are not measured
+            run_session(page, scaled_target(target, 1 - 1e-4 * (k + 1)), poll)
+
+    rows: List[Dict[str, Any]] = []
+    rss_before = rss_mb()
+    monitor = _MemoryMonitor()
+    monitor.start()
+    cpu0, t0 = time.process_time(), time.perf_counter()
+    threads = [threading.Thread(target=_user, args=(i, pages, sessions, target, shared, poll, rows))
+               for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    cpu, wall = time.process_time() - cpu0, time.perf_counter() - t0
+    rss_peak = monitor.stop()
+
+    ok = [r for r in rows if not r['errors']]
+    per_page = {}
+    for page in pages:
+        done = [r for r in ok if r['page'] == page]
+        per_page[page] = {'sessions': sum(r['page'] == page for r in rows), 'ok': len(done),
+                          'latency': _percentiles([r['latency'] for r in done]),
+                          'rerun': _percentiles([r['rerun'] for r in done])}
+    return {'users': users, 'sessions_per_user': sessions, 'workers': int(os.environ.get('REQPY_WORKERS', 1)),
+            'shared_inputs': shared, 'cpu_count': os.cpu_count(), 'wall_s': wall, 'cpu_s': cpu,
+            'cpu_s_per_session': cpu / len(rows) if rows else None, 'cpu_utilisation': cpu / wall,
+            'rss_before_mb': rss_before, 'rss_peak_mb': rss_peak,
+            'rss_per_user_mb': (rss_peak - rss_before) / users,
+            'pages': per_page, 'sessions': rows}
+
+
+def _fmt(value: Optional[float]) -> str:
+    return f"{value:8.2f}" if value is not None else f"{'-':>8s}"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=4, help="Concurrent simulated users")
+    parser.add_argument('--sessions', type=int, default=2, help="Sessions per user, run one after the other")
+    parser.add_argument('--pages', nargs='+', default=list(PAGES), choices=PAGES,
+                        help="Pages the users alternate between")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Matching worker threads (default: $REQPY_WORKERS or 1)")
+    parser.add_argument('--shared-inputs', action='store_true',
+                        help="Upload the same files in every session (cache hits and attached jobs)")
+    parser.add_argument('--warmup', type=int, default=1, help="Unmeasured sessions per page before the test")
+    parser.add_argument('--poll', type=float, default=0.25, help="Seconds between reruns while a job runs")
+    parser.add_argument('--max-p95', type=float, default=None,
+                        help="Fail if the p95 end-to-end latency of a page exceeds this (s)")
+    parser.add_argument('--out', default=None, help="Write the report as JSON")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING) # Before the pages configure INFO logging
+    if args.workers is not None:
+        os.environ['REQPY_WORKERS'] = str(args.workers)
+    os.environ['REQPY_QUEUE_DIR'] = tempfile.mkdtemp(prefix='reqpy_load_') # No results of earlier runs
+    sys.path.insert(0, ROOT)
+
+    print(f"{args.users} users x {args.sessions} sessions, {os.environ.get('REQPY_WORKERS', '1')} "
+          f"matching worker(s), {os.cpu_count()} CPUs")
+    report = run_load_test(args.users, args.sessions, args.pages, args.shared_inputs, args.warmup, args.poll)
+
+    print(f"{'page':<28s} {'ok':>7s} {'p50 [s]':>8s} {'p95 [s]':>8s} {'max [s]':>8s}   "
+          f"{'rerun p50':>9s} {'rerun p95':>9s}")
+    for page, p in report['pages'].items():
+        print(f"{page:<28s} {p['ok']:>3d}/{p['sessions']:<3d} {_fmt(p['latency']['p50'])} "
+              f"{_fmt(p['latency']['p95'])} {_fmt(p['latency']['max'])}   {_fmt(p['rerun']['p50'])}  "
+              f"{_fmt(p['rerun']['p95'])}")
+    print(f"CPU: {report['cpu_s_per_session']:.2f} s per session, {100 * report['cpu_utilisation']:.0f}% of one CPU "
+          f"over {report['wall_s']:.1f} s")
+    print(f"Memory: {report['rss_before_mb']:.0f} MB before, {report['rss_peak_mb']:.0f} MB peak, "
+          f"{report['rss_per_user_mb']:.1f} MB per concurrent user")
+    failed = [r for r in report['sessions'] if r['errors']]
+    slow = [page for page, p in report['pages'].items()
+            if args.max_p95 is not None and p['latency']['p95'] is not None and p['latency']['p95'] > args.max_p95]
+    if failed:
+        print(f"{len(failed)} session(s) failed")
+    if slow:
+        print(f"p95 latency above {args.max_p95:.1f} s: {', '.join(slow)}")
+    if args.out:
+        with open(args.out, 'w') as fp:
+            json.dump(report, fp, indent=2)
+        print(f"Report written to {args.out}")
+    return 1 if failed or slow else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
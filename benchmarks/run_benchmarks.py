@@ -0,0 +1,288 @@
+"""
+Benchmark suite: loading, matching, RotDnn, plotting and export.
+
+Times the pipeline the pages run, on the bundled SampleInput_* files and on
+synthetic variants of the RSN175 records lengthened to a given number of
+points, either by tiling the record ('tile', longer duration at the same dt)
+or by resampling it ('resample', same duration at a finer dt). Cases:
+
+* load_at2       - hf.my_parse_PEERNGA_record of one record
+* load_suite     - parsing a suite of 1-40 records
+* load_target    - hf.my_load_target_spectrum (uncached) + hf.my_resample_target
+* match_single   - hf.my_REQPY_single (fresh result cache)
+* match_rotdnn   - hf.my_REQPYrotdnn (fresh result cache)
+* match_single_lowmem / match_rotdnn_lowmem - the same in memory-aware mode (low_memory=True)
+* sweep_single   - hf.my_REQPY_sweep: 2 targets x 2 damping ratios on one decomposition of the seed
+                   (4 x match_single without it)
+* rotdnn_spectra - spectra.rotated_spectra of the record pair
+* plot_single / plot_rotdnn - the pages' decimated plotting.figures rendered to PNG
+                              (as st.pyplot does)
+* plot_single_full / plot_rotdnn_full - reqpy_M plot_*_results at full resolution, for reference
+* save_at2 / save_2col / save_1col - the hf.my_save_results_as_* writers (uncached)
+* save_zip       - export.bundle_bytes: all formats of acc/vel/disp in one zip archive
+* save_npz / load_npz - binary results file (resultsfile.py) written and read back
+
+Each case is run once untimed (numba compilation, imports) and then
+`--repeat` times; the minimum and median wall times are reported. Results
+are written as JSON together with the versions of Python, numpy and reqpy_M
+and the git commit, and can be compared against an earlier results file:
+
+Usage:
+    python benchmarks/run_benchmarks.py [--quick] [--sizes 0 10000 100000]
+                                        [--records 1 10 40] [--variant tile|resample]
+                                        [--cases match_single save_at2 ...]
+                                        [--out results.json] [--compare baseline.json]
+                                        [--threshold 1.10]
+
+With --compare the exit status is 1 if any case is slower than the baseline
+by more than --threshold (a ratio of the minimum times).
+"""
+
+from typing import Callable, Dict, Any, List, Optional, Tuple
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import streamlit.logger
+streamlit.logger.set_log_level('error') # Caching outside the Streamlit runtime is expected here
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import helperfunctions as hf
+import resultcache as rc
+import spectra
+import plotting
+import export
+import resultsfile
+from reqpy_M import plot_single_results, plot_rotdnn_results
+
+SEED_FILES = ('SampleInput_RSN175_IMPVALL.H_H-E12140.AT2',
+              'SampleInput_RSN175_IMPVALL.H_H-E12230.AT2')
+TARGET_FILE = 'SampleInput_ASCE7.txt'
+CASES = ('load_at2', 'load_suite', 'load_target', 'match_single', 'match_rotdnn', 'match_single_lowmem',
+         'match_rotdnn_lowmem', 'sweep_single', 'rotdnn_spectra',
+         'plot_single', 'plot_rotdnn', 'plot_single_full', 'plot_rotdnn_full', 'save_at2', 'save_2col', 'save_1col',
+         'save_zip', 'save_npz', 'load_npz')
+MATCH_CASES = ('match_single', 'match_rotdnn', 'match_single_lowmem', 'match_rotdnn_lowmem', 'sweep_single',
+               'plot_single',
+               'plot_rotdnn', 'plot_single_full', 'plot_rotdnn_full')
+MATCH_PARAMS = dict(T1=0.05, T2=6.0, zi=0.05, nit=15, baseline=True, porder=-1)
+
+
+def load_seed(name: str) -> Tuple[np.ndarray, float]:
+    with open(os.path.join(ROOT, name)) as fp:
+        acc, dt, _, _ = hf.my_parse_PEERNGA_record(fp)
+    return acc, dt
+
+
+def make_variant(acc: np.ndarray, dt: float, npts: int, variant: str) -> Tuple[np.ndarray, float]:
+    """Lengthens a record to `npts` points by tiling or by resampling (npts=0: unchanged)."""
+    if npts <= 0:
+        return acc, dt
+    if variant == 'tile':
+        return np.resize(acc, npts), dt
+    duration = (len(acc) - 1) * dt
+    t_new = np.linspace(0, duration, npts)
+    return np.interp(t_new, np.arange(len(acc)) * dt, acc), duration / (npts - 1)
+
+
+def at2_text(acc: np.ndarray, dt: float, name: str) -> str:
+    fp = io.StringIO()
+    hf.my_write_at2(fp, acc, dt, header_details={'title': f"Benchmark record from {name}",
+                                                 'station': name, 'component': 'BENCH'})
+    return fp.getvalue()
+
+
+def time_case(func: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    func() # Warm-up: numba compilation, first imports
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return {'min': min(times), 'median': float(np.median(times)), 'repeat': repeat}
+
+
+def uncached(cached_func: Callable, *args: Any, **kwargs: Any) -> Any:
+    """Calls a cached writer with its cache cleared."""
+    cached_func.clear()
+    return cached_func(*args, **kwargs)
+
+
+def render(figs: Tuple[Any, ...]) -> None:
+    for fig in figs:
+        fig.savefig(io.BytesIO(), format='png') # What st.pyplot does
+    plt.close('all')
+
+
+def build_cases(npts: int, variant: str, records: List[int], selected: List[str]) -> List[Tuple[str, Dict[str, Any], Callable]]:
+    """Returns (case, parameters, callable) for one record length."""
+    (a1, dt0), (a2, _) = (load_seed(n) for n in SEED_FILES)
+    n = min(len(a1), len(a2))
+    s1, dt = make_variant(a1[:n], dt0, npts, variant)
+    s2, _ = make_variant(a2[:n], dt0, npts, variant)
+    if npts <= 0:
+        with open(os.path.join(ROOT, SEED_FILES[0])) as fp:
+            text = fp.read()
+    else:
+        text = at2_text(s1, dt, SEED_FILES[0])
+    with open(os.path.join(ROOT, TARGET_FILE)) as fp:
+        target_text = fp.read()
+    To, dso = hf.my_load_target_spectrum(io.StringIO(target_text))
+    To_m, dso_m, _ = hf.my_resample_target(To, dso, MATCH_PARAMS['T1'], MATCH_PARAMS['T2'])
+    fs = 1 / dt
+
+    def load_target() -> Tuple[np.ndarray, np.ndarray, Dict[str, float]]:
+        rc.targets_cache.clear() # Time the parsing, not a cache hit
+        return hf.my_resample_target(*hf.my_load_target_spectrum(io.StringIO(target_text)),
+                                     MATCH_PARAMS['T1'], MATCH_PARAMS['T2'])
+
+    def single(low_memory: bool = False) -> Dict[str, Any]:
+        return hf.my_REQPY_single(s=s1, fs=fs, dso=dso_m, To=To_m, cache=rc.ResultCache(1),
+                                  low_memory=low_memory, **MATCH_PARAMS)[0]
+
+    def rotdnn(low_memory: bool = False) -> Dict[str, Any]:
+        return hf.my_REQPYrotdnn(s1=s1, s2=s2, fs=fs, dso=dso_m, To=To_m, nn=100, cache=rc.ResultCache(1),
+                                 low_memory=low_memory, **MATCH_PARAMS)[0]
+
+    def sweep() -> Dict[str, Any]:
+        params = {k: v for k, v in MATCH_PARAMS.items() if k != 'zi'}
+        return hf.my_REQPY_sweep(s1=s1, fs=fs, **hf.my_pack_targets([(To_m, dso_m), (To_m, 1.5 * dso_m)]),
+                                 zis=np.array([0.05, 0.10]), cache=rc.ResultCache(1), **params)[0]
+
+    results_single = single() if {'plot_single', 'plot_single_full'} & set(selected) else None
+    results_rotdnn = rotdnn() if {'plot_rotdnn', 'plot_rotdnn_full'} & set(selected) else None
+    results_save = {'ccs': s1, 'dt': dt} # The writers only need the record and dt
+    npz_bytes = hf.my_save_results_as_npz(results_save).getvalue()
+    T = np.geomspace(0.01, 10.0, 100)
+    params = {'npts': len(s1), 'dt': dt, 'variant': variant if npts > 0 else 'bundled'}
+    cases = [
+        ('load_at2', params, lambda: hf.my_parse_PEERNGA_record(io.StringIO(text))),
+        ('load_target', params, load_target),
+        ('match_single', params, single),
+        ('match_rotdnn', params, rotdnn),
+        ('match_single_lowmem', params, lambda: single(low_memory=True)),
+        ('match_rotdnn_lowmem', params, lambda: rotdnn(low_memory=True)),
+        ('sweep_single', params, sweep),
+        ('rotdnn_spectra', params, lambda: spectra.rotated_spectra(T, s1, s2, dt, 0.05)),
+        ('plot_single', params, lambda: render(plotting.figures(plotting.plot_data_single(
+            results=results_single, s_orig=s1, target_spec=(To, dso), T1=MATCH_PARAMS['T1'],
+            T2=MATCH_PARAMS['T2'])))),
+        ('plot_rotdnn', params, lambda: render(plotting.figures(plotting.plot_data_rotdnn(
+            results=results_rotdnn, s1_orig=s1, s2_orig=s2, target_spec=(To, dso), T1=MATCH_PARAMS['T1'],
+            T2=MATCH_PARAMS['T2'], nn=100)))),
+        ('plot_single_full', params, lambda: render(plot_single_results(
+            results=results_single, s_orig=s1, target_spec=(To, dso), T1=MATCH_PARAMS['T1'],
+            T2=MATCH_PARAMS['T2'], xlim_min=None, xlim_max=None))),
+        ('plot_rotdnn_full', params, lambda: render(plot_rotdnn_results(
+            results=results_rotdnn, s1_orig=s1, s2_orig=s2, target_spec=(To, dso), T1=MATCH_PARAMS['T1'],
+            T2=MATCH_PARAMS['T2'], xlim_min=None, xlim_max=None))),
+        ('save_at2', params, lambda: uncached(hf.my_save_results_as_at2, results_save, comp_key='ccs')),
+        ('save_2col', params, lambda: uncached(hf.my_save_results_as_2col, results_save, comp_key='ccs',
+                                               header_str='Benchmark')),
+        ('save_1col', params, lambda: uncached(hf.my_save_results_as_1col, results_save, comp_key='ccs',
+                                               header_str='Benchmark')),
+        ('save_zip', params, lambda: export.bundle_bytes({'ccs': s1, 'cvel': s1, 'cdespl': s1, 'dt': dt},
+                                                         [('bench', SEED_FILES[0], 'Benchmark', export.SINGLE_KEYS)])),
+        ('save_npz', params, lambda: uncached(hf.my_save_results_as_npz, results_save)),
+        ('load_npz', params, lambda: resultsfile.read_record(io.BytesIO(npz_bytes))),
+    ]
+    for nrec in records:
+        cases.append(('load_suite', {**params, 'records': nrec},
+                      lambda nrec=nrec: [hf.my_parse_PEERNGA_record(io.StringIO(text)) for _ in range(nrec)]))
+    return [c for c in cases if c[0] in selected]
+
+
+def environment() -> Dict[str, Any]:
+    from importlib.metadata import version, PackageNotFoundError
+    env = {'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+           'python': platform.python_version(), 'platform': platform.platform(),
+           'cpus': os.cpu_count(), 'numpy': np.__version__}
+    for pkg in ('reqpy_M', 'scipy', 'streamlit', 'matplotlib'):
+        try:
+            env[pkg] = version(pkg)
+        except PackageNotFoundError:
+            env[pkg] = None
+    try:
+        env['git_commit'] = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                           text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        env['git_commit'] = None
+    return env
+
+
+def case_id(r: Dict[str, Any]) -> str:
+    p = r['params']
+    extra = f" x{p['records']}" if 'records' in p else ''
+    return f"{r['case']}[{p['variant']} {p['npts']}{extra}]"
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str, threshold: float) -> bool:
+    """Prints current vs baseline minimum times; returns True if any case regressed."""
+    with open(baseline_path) as fp:
+        baseline = {case_id(r): r for r in json.load(fp)['results']}
+    print()
+    print(f"Comparison against {baseline_path} (ratio = current / baseline, threshold {threshold:.2f})")
+    print(f"{'case':<44s} {'baseline [ms]':>14s} {'current [ms]':>13s} {'ratio':>7s}")
+    regressed = False
+    for r in results:
+        base = baseline.get(case_id(r))
+        if base is None:
+            print(f"{case_id(r):<44s} {'-':>14s} {r['min'] * 1e3:13.1f} {'new':>7s}")
+            continue
+        ratio = r['min'] / base['min']
+        flag = ''
+        if ratio > threshold:
+            flag, regressed = '  SLOWER', True
+        elif ratio < 1 / threshold:
+            flag = '  faster'
+        print(f"{case_id(r):<44s} {base['min'] * 1e3:14.1f} {r['min'] * 1e3:13.1f} {ratio:7.2f}{flag}")
+    return regressed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[0, 10000, 100000],
+                        help="Record lengths (points); 0 = the bundled records (~7800 points) unchanged")
+    parser.add_argument('--records', type=int, nargs='+', default=[1, 10, 40], help="Suite sizes for load_suite")
+    parser.add_argument('--variant', choices=('tile', 'resample'), default='tile')
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=list(CASES))
+    parser.add_argument('--max-match-points', type=int, default=100000,
+                        help="Skip matching and plotting cases above this length (CWT memory grows as 100 x npts)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--quick', action='store_true', help="Bundled records only, one repeat")
+    parser.add_argument('--out', default='benchmark_results.json', help="Results file (JSON)")
+    parser.add_argument('--compare', default=None, metavar='BASELINE', help="Results file to compare against")
+    parser.add_argument('--threshold', type=float, default=1.10, help="Slowdown ratio flagged as a regression")
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.sizes, args.repeat = [0], 1
+
+    results = []
+    print(f"{'case':<44s} {'min [ms]':>10s} {'median [ms]':>12s}")
+    for npts in args.sizes:
+        selected = [c for c in args.cases if npts <= args.max_match_points or c not in MATCH_CASES]
+        for case, params, func in build_cases(npts, args.variant, args.records, selected):
+            r = {'case': case, 'params': params, **time_case(func, args.repeat)}
+            results.append(r)
+            print(f"{case_id(r):<44s} {r['min'] * 1e3:10.1f} {r['median'] * 1e3:12.1f}", flush=True)
+
+    with open(args.out, 'w') as fp:
+        json.dump({'environment': environment(), 'results': results}, fp, indent=1)
+    print(f"Results written to {args.out}")
+    if args.compare:
+        return 1 if compare(results, args.compare, args.threshold) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
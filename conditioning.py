@@ -0,0 +1,163 @@
+"""
+Input conditioning of seed records: a common time step and length.
+
+The matching takes one sampling frequency for all components, and
+REQPYrotdnn truncates the longer component of a pair. A pair recorded at
+different rates (e.g. a 200 Hz and a 100 Hz component) was therefore matched
+with the wrong time axis for one of them. condition_records brings the
+records of a run to a common time step and length before matching:
+
+* records with a different time step are resampled to the finest one: with
+  a polyphase filter (scipy.signal.resample_poly) when the ratio of the time
+  steps is a simple fraction, otherwise with the FFT method
+  (scipy.signal.resample);
+* records of different lengths are padded with trailing zeros to the longest
+  one (or trimmed to the shortest one, length='trim');
+* optionally, over-sampled records are decimated. With decimate=True the
+  time step is multiplied by the largest integer factor that still leaves
+  `points_per_period` samples per period at the lower end of the matching
+  range (dt <= T1 / points_per_period). The matching cost is roughly
+  proportional to the number of points, so 200 Hz -> 100 Hz about halves it.
+
+Both resampling methods are anti-aliased. Records that already share a time
+step and length are returned as they are, without copies.
+"""
+
+from typing import Optional, Dict, Any, List, Tuple, Sequence
+from fractions import Fraction
+import logging
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+POINTS_PER_PERIOD = 5.0 # Samples per period at T1 kept by decimation
+_MAX_FACTOR = 64 # Largest up / down factor of the polyphase filter
+_RTOL = 1e-6 # Time steps closer than this (relative) are the same
+
+
+def _same_dt(a: float, b: float) -> bool:
+    return abs(a - b) <= _RTOL * max(a, b)
+
+
+def decimation_factor(dt: float, T1: float, points_per_period: float = POINTS_PER_PERIOD) -> int:
+    """Largest integer q with q * dt <= T1 / points_per_period (1 if T1 is 0 or too short)."""
+    if T1 <= 0:
+        return 1
+    return max(1, int(np.floor(T1 / (points_per_period * dt) * (1 + _RTOL))))
+
+
+def resample(acc: np.ndarray, dt: float, dt_new: float) -> Tuple[np.ndarray, str]:
+    """Resamples a record from time step dt to dt_new.
+
+    Returns
+    -------
+    Tuple[np.ndarray, str]
+        The resampled record and the method used.
+    """
+    from scipy import signal # Imported here: only needed for mismatched or decimated records
+
+    ratio = dt / dt_new
+    fraction = Fraction(ratio).limit_denominator(_MAX_FACTOR)
+    if fraction.numerator <= _MAX_FACTOR and abs(float(fraction) - ratio) <= _RTOL * ratio:
+        up, down = fraction.numerator, fraction.denominator
+        return signal.resample_poly(acc, up, down), f"polyphase x{up}/{down}"
+    return signal.resample(acc, int(round(len(acc) * ratio))), "FFT"
+
+
+def is_conditioned(
+    records: Sequence[Tuple[np.ndarray, float]],
+    T1: float = 0.0,
+    decimate: bool = False,
+    points_per_period: float = POINTS_PER_PERIOD
+) -> bool:
+    """True if `condition_records` would return the records unchanged."""
+    dt = min(float(dt) for _, dt in records)
+    if decimate and decimation_factor(dt, T1, points_per_period) > 1:
+        return False
+    return (all(_same_dt(float(dt_i), dt) for _, dt_i in records)
+            and len({np.size(acc) for acc, _ in records}) == 1)
+
+
+def condition_records(
+    records: Sequence[Tuple[np.ndarray, float]],
+    T1: float = 0.0,
+    decimate: bool = False,
+    length: str = 'pad',
+    points_per_period: float = POINTS_PER_PERIOD
+) -> Tuple[Tuple[np.ndarray, ...], float, Dict[str, Any]]:
+    """Brings seed records to a common time step and length.
+
+    Parameters
+    ----------
+    records : Sequence[Tuple[np.ndarray, float]]
+        (acceleration, dt) of each record, e.g. the two components of a pair.
+    T1 : float, optional
+        Lower period of the matching range (s), which limits the decimation.
+    decimate : bool, optional
+        Decimate over-sampled records (see the module docstring). Default
+        is False.
+    length : str, optional
+        'pad' (default): pad records with zeros to the longest one;
+        'trim': trim them to the shortest one.
+    points_per_period : float, optional
+        Samples per period at T1 kept by the decimation. Default is 5.
+
+    Returns
+    -------
+    Tuple[Tuple[np.ndarray, ...], float, Dict[str, Any]]
+        The conditioned records, their time step and a report with 'dt',
+        'npts', 'decimation' (factor), 'points_per_period', 'changed' and
+        'records' (per record: 'dt', 'npts', 'method', 'padded' and 'trimmed'
+        points).
+    """
+    if length not in ('pad', 'trim'):
+        raise ValueError(f"length must be 'pad' or 'trim', got '{length}'.")
+    dt = min(float(dt_i) for _, dt_i in records)
+    q = decimation_factor(dt, T1, points_per_period) if decimate else 1
+    dt_new = dt * q
+
+    resampled, rows = [], []
+    for acc, dt_i in records:
+        if _same_dt(float(dt_i), dt_new):
+            method = 'none'
+        else:
+            acc, method = resample(np.asarray(acc, dtype=float), float(dt_i), dt_new)
+        resampled.append(acc)
+        rows.append({'dt': float(dt_i), 'npts': None, 'method': method})
+    n = max(len(a) for a in resampled) if length == 'pad' else min(len(a) for a in resampled)
+
+    conditioned = []
+    for (acc_in, _), acc, row in zip(records, resampled, rows):
+        row['npts'] = len(acc_in)
+        row['padded'], row['trimmed'] = max(0, n - len(acc)), max(0, len(acc) - n)
+        if row['padded']:
+            acc = np.concatenate((acc, np.zeros(row['padded'])))
+        elif row['trimmed']:
+            acc = acc[:n]
+        conditioned.append(acc)
+    report = {'dt': dt_new, 'npts': n, 'decimation': q, 'points_per_period': float(points_per_period),
+              'records': rows,
+              'changed': any(r['method'] != 'none' or r['padded'] or r['trimmed'] for r in rows)}
+    for line in describe(report):
+        log.info(line)
+    return tuple(conditioned), dt_new, report
+
+
+def describe(report: Dict[str, Any], names: Optional[List[str]] = None) -> List[str]:
+    """One line per record changed by `condition_records`."""
+    lines = []
+    for i, r in enumerate(report['records']):
+        name = names[i] if names is not None else f"Record {i + 1}"
+        changes = []
+        if r['method'] != 'none':
+            changes.append(f"resampled from dt = {r['dt']:g} s to {report['dt']:g} s ({r['method']})")
+        if r['padded']:
+            changes.append(f"padded with {r['padded']} zeros")
+        if r['trimmed']:
+            changes.append(f"trimmed by {r['trimmed']} points")
+        if changes:
+            lines.append(f"{name}: {', '.join(changes)}; {r['npts']} -> {report['npts']} points.")
+    if report['decimation'] > 1:
+        lines.append(f"Decimated by {report['decimation']} (dt = {report['dt']:g} s, at least "
+                     f"{report['points_per_period']:g} points per period in the matching range).")
+    return lines
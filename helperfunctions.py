@@ -1,57 +1,1327 @@
-from typing import Tuple, List, Optional, Dict, Any
+from typing import Callable, Tuple, List, Optional, Dict, Any, TYPE_CHECKING
 import numpy as np
-import matplotlib.pyplot as plt
+import functools
+import inspect
 import logging
 import io
+import os
+import time
+import uuid
+import warnings
 import streamlit as st
+import resultcache as rc
+import conditioning
+import jobqueue
+import export
+import resultsfile
+import recordlibrary
+import warmstart
+from profiling import StageTimer
+if TYPE_CHECKING:
+    # Imported where they are used: matplotlib, scipy, numba and reqpy_M take most of the
+    # start-up time of the pages and are not needed before a run starts
+    import matplotlib.pyplot as plt
+    import matching
 log = logging.getLogger(__name__)
 
-@st.cache_data
-def my_load_PEERNGA_record(f) -> Tuple[np.ndarray, float, int, str]:
-    
-    print(f)
+def _parse_at2_values(body: str) -> np.ndarray:
+    """Parses the numeric body of a PEER .AT2 file in a single vectorized pass.
+
+    Tokens are split on any whitespace by numpy's C parser, which reads
+    Fortran-style values such as `.3654112E-03` directly. Double precision
+    exponents (`D-03`) are translated to `E-03` first.
+    """
+    if 'D' in body or 'd' in body:
+        body = body.replace('D', 'E').replace('d', 'E')
+    with warnings.catch_warnings():
+        # Older numpy versions only warn when a token cannot be parsed
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            return np.fromstring(body, sep=' ')
+        except (ValueError, DeprecationWarning) as e:
+            raise ValueError(f"Non-numeric token in acceleration data: {e}")
+
+def my_parse_PEERNGA_record(fp) -> Tuple[np.ndarray, float, int, str]:
+    """Parses an open PEER NGA .AT2 file.
+
+    Parameters
+    ----------
+    fp : file-like
+        Text file object positioned at the start of the .AT2 file.
+
+    Returns
+    -------
+    Tuple[np.ndarray, float, int, str]
+        Acceleration (g), time step (s), number of points and record name.
+
+    Raises
+    ------
+    ValueError
+        If the header is malformed, NPTS/DT are invalid or the data block
+        contains non-numeric or non-finite values.
+    """
+    try:
+        header = [next(fp) for _ in range(4)]
+    except StopIteration:
+        raise ValueError("Incomplete header. Expected 4 header lines before the data.")
+    line2 = header[1].strip().split(',') # Line 1 is skipped
+    if len(line2) < 4:
+        raise ValueError("Line 2 format incorrect. Expected Name, Date, Station, Component.")
+    date_parts = line2[1].strip().split('/')
+    if len(date_parts) < 3:
+        raise ValueError("Date format incorrect on Line 2. Expected MM/DD/YYYY.")
+    year = date_parts[2]
+    eqname = (f"{year}_{line2[0].strip()}_{line2[2].strip()}_comp_{line2[3].strip()}")
+
+    line4 = header[3].strip().split(',') # Line 3 is skipped
+    if len(line4) < 2 or 'NPTS=' not in line4[0] or 'DT=' not in line4[1]:
+         raise ValueError("Line 4 format incorrect. Expected NPTS=..., DT=...")
+    try:
+        npts_str = line4[0].split('=')[1].strip()
+        npts = int(npts_str)
+        dt_str = line4[1].split('=')[1].split()[0] # Handle potential extra text
+        dt = float(dt_str)
+    except (IndexError, ValueError) as e:
+        raise ValueError(f"Could not parse NPTS or DT from Line 4: {e}")
+    if npts <= 0:
+        raise ValueError(f"NPTS must be positive, got {npts}.")
+    if not np.isfinite(dt) or dt <= 0:
+        raise ValueError(f"DT must be a positive number, got {dt_str}.")
+
+    # Read acceleration data in bulk
+    acc = _parse_at2_values(fp.read())
+
+    if len(acc) == 0:
+        raise ValueError("No acceleration data found after the header.")
+    if not np.all(np.isfinite(acc)):
+        raise ValueError("Acceleration data contains NaN or infinite values.")
+    if len(acc) != npts:
+        log.warning(f"Warning: Number of data points read ({len(acc)}) "
+                    f"does not match NPTS specified in header ({npts}). Using read data.")
+        npts = len(acc) # Update npts to actual data length
+
+    return acc, dt, npts, eqname
+
+def _is_results_file(fp) -> bool:
+    """True if `fp` is a binary stream holding a zip (.npz results file)."""
+    if not _is_binary_stream(fp):
+        return False
+    magic = fp.read(2)
+    fp.seek(0)
+    return magic == b'PK'
+
+def _file_bytes(f) -> bytes:
+    """Contents of a path or file object (left unread), for content-addressed cache keys."""
+    if isinstance(f, (str, os.PathLike)):
+        with open(f, 'rb') as fp:
+            return fp.read()
+    if hasattr(f, 'getvalue'): # StringIO, BytesIO and Streamlit uploads
+        data = f.getvalue()
+    else:
+        pos = f.tell()
+        data = f.read()
+        f.seek(pos)
+    return data.encode() if isinstance(data, str) else data
+
+def my_load_PEERNGA_record(f, component: int = 1) -> Tuple[np.ndarray, float, int, str]:
+    """Loads a seed record (.AT2 or .npz results file), shared by all sessions.
+
+    `f` is a path or a file object (an upload).
+
+    Cached in `resultcache.records_cache` on the bytes of the file, so the
+    same upload is parsed once for all sessions. The acceleration array is
+    read-only: the same array is returned to every session that loads the
+    record, instead of a copy per call.
+    """
+    key = rc.hash_inputs(_file_bytes(f), kind='record', component=int(component))
+    record = rc.records_cache.get(key)
+    if record is None:
+        record = rc.records_cache.put(key, _load_record(f, component))
+    return record
+
+def _load_record(f, component: int) -> Tuple[np.ndarray, float, int, str]:
+    is_path = isinstance(f, (str, os.PathLike))
+    name = os.fspath(f) if is_path else getattr(f, 'name', 'uploaded record') # StringIO uploads have no name
     try:
+        if is_path:
+            f = open(f, 'rb')
+            if not _is_results_file(f):
+                f = io.TextIOWrapper(f) # .AT2 files are parsed as text
         with f as fp:
-            next(fp) # Skip header line 1
-            line2 = next(fp).strip().split(',')
-            if len(line2) < 4:
-                raise ValueError("Line 2 format incorrect. Expected Name, Date, Station, Component.")
-            date_parts = line2[1].strip().split('/')
-            if len(date_parts) < 3:
-                raise ValueError("Date format incorrect on Line 2. Expected MM/DD/YYYY.")
-            year = date_parts[2]
-            eqname = (f"{year}_{line2[0].strip()}_{line2[2].strip()}_comp_{line2[3].strip()}")
-
-            next(fp) # Skip header line 3
-            line4 = next(fp).strip().split(',')
-            if len(line4) < 2 or 'NPTS=' not in line4[0] or 'DT=' not in line4[1]:
-                 raise ValueError("Line 4 format incorrect. Expected NPTS=..., DT=...")
-            try:
-                npts_str = line4[0].split('=')[1].strip()
-                npts = int(npts_str)
-                dt_str = line4[1].split('=')[1].split()[0] # Handle potential extra text
-                dt = float(dt_str)
-            except (IndexError, ValueError) as e:
-                raise ValueError(f"Could not parse NPTS or DT from Line 4: {e}")
-
-            # Read acceleration data efficiently
-            acc_flat = [float(p) for line in fp for p in line.split()]
-            acc = np.array(acc_flat)
-
-            if len(acc) != npts:
-                log.warning(f"Warning: Number of data points read ({len(acc)}) "
-                            f"does not match NPTS specified in header ({npts}). Using read data.")
-                npts = len(acc) # Update npts to actual data length
+            if _is_results_file(fp):
+                # A binary results file of an earlier run (see resultsfile.py)
+                acc, dt, npts, eqname = resultsfile.read_record(fp, component)
+            else:
+                acc, dt, npts, eqname = my_parse_PEERNGA_record(fp)
     except FileNotFoundError:
-        log.error(f"File not found: {f.name}")
+        log.error(f"File not found: {name}")
         raise
     except Exception as e:
-        log.error(f"Error parsing file {f.name}: {e}")
-        raise ValueError(f"Error parsing file {f.name}: {e}")
+        log.error(f"Error parsing file {name}: {e}")
+        raise ValueError(f"Error parsing file {name}: {e}")
 
+    acc.setflags(write=False)
     return acc, dt, npts, eqname
 
-@st.cache_data
+def my_condition_records(
+    records: List[Tuple[np.ndarray, float]],
+    T1: float = 0.0,
+    decimate: bool = False
+) -> Tuple[Tuple[np.ndarray, ...], float, Dict[str, Any]]:
+    """Brings seed records to a common time step and length (see conditioning.py).
+
+    Records that need no change are returned as they are; resampled ones are
+    cached in `resultcache.records_cache`, so widget changes don't resample
+    them again.
+    """
+    if conditioning.is_conditioned(records, T1, decimate):
+        return conditioning.condition_records(records, T1, decimate)
+    key = rc.hash_inputs(*[acc for acc, _ in records], kind='conditioned',
+                         dts=tuple(float(dt) for _, dt in records), T1=float(T1), decimate=bool(decimate))
+    cached = rc.records_cache.get(key)
+    if cached is None:
+        accs, dt, report = conditioning.condition_records(records, T1, decimate)
+        cached = rc.records_cache.put(key, (dt, report) + accs) # Arrays at the top level are made read-only
+    return tuple(cached[2:]), cached[0], cached[1]
+
+def my_show_conditioning(report: Dict[str, Any], names: List[str]) -> None:
+    """Reports the changes made by `my_condition_records` under the inputs."""
+    for line in conditioning.describe(report, names):
+        st.caption(line)
+
+def my_load_target_spectrum(f) -> Tuple[np.ndarray, np.ndarray]:
+    """Loads a two-column (Period, PSA) target spectrum, sorted by period.
+
+    Cached in `resultcache.targets_cache` on the bytes of the file; the
+    arrays are read-only.
+
+    Parameters
+    ----------
+    f : str or file-like
+        Path or text file object accepted by np.loadtxt.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Target periods To (s) and PSA ordinates dso (g).
+    """
+    data = _file_bytes(f)
+    key = rc.hash_inputs(data, kind='target')
+    target = rc.targets_cache.get(key)
+    if target is not None:
+        return target
+    target_spectrum = np.loadtxt(io.StringIO(data.decode('latin-1')))
+    if target_spectrum.ndim != 2 or target_spectrum.shape[1] != 2:
+        raise ValueError("Target file should have two columns (Period, PSA).")
+
+    sort_idx = np.argsort(target_spectrum[:, 0])
+    To = target_spectrum[sort_idx, 0]  # Target spectrum periods
+    dso = target_spectrum[sort_idx, 1] # Target spectrum PSA
+    return rc.targets_cache.put(key, (To, dso))
+
+def my_resample_target(
+    To: np.ndarray,
+    dso: np.ndarray,
+    T1: float = 0.0,
+    T2: float = 0.0,
+    npts: int = 200,
+    tol: float = 0.1,
+    max_refine: int = 50
+) -> Tuple[np.ndarray, np.ndarray, Dict[str, float]]:
+    """Resamples a dense target spectrum onto a log-spaced period grid in [T1, T2].
+
+    The matching and the spectrum evaluations only need the target inside the
+    matching range, so a few hundred log-spaced periods replace tens of
+    thousands of linearly spaced ordinates. Dense ordinates are inserted where
+    the log grid misses a corner of the spectrum (e.g. Ts or TL), until the
+    linear interpolation of the resampled target reproduces the dense target
+    within `tol` percent.
+
+    Parameters
+    ----------
+    To : np.ndarray
+        Dense target periods (s), sorted in ascending order.
+    dso : np.ndarray
+        Dense target PSA ordinates (g).
+    T1 : float, optional
+        Lower period of the grid (s). 0 (default) uses the smallest positive
+        target period.
+    T2 : float, optional
+        Upper period of the grid (s). 0 (default) uses the largest target period.
+    npts : int, optional
+        Number of log-spaced periods before refinement. Default is 200.
+    tol : float, optional
+        Target maximum interpolation error (%). Default is 0.1.
+    max_refine : int, optional
+        Maximum number of dense ordinates inserted. Default is 50.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, Dict[str, float]]
+        Resampled periods, resampled PSA and an accuracy report with keys
+        'n_dense', 'n_resampled', 'max_error' (%), 'mean_error' (%) and
+        'T_max_error' (s).
+    """
+    positive = To > 0
+    T1 = T1 if T1 > 0 else To[positive][0]
+    T2 = T2 if T2 > 0 else To[-1]
+    T1 = max(T1, To[positive][0])
+    T2 = min(T2, To[-1])
+    if T1 >= T2:
+        raise ValueError(f"Invalid period range for resampling: T1 ({T1:.3f}s) >= T2 ({T2:.3f}s)")
+
+    in_range = (To >= T1) & (To <= T2) & (dso > 0)
+    T_dense = To[in_range]
+    ds_dense = dso[in_range]
+
+    Tr = np.geomspace(T1, T2, max(int(npts), 2))
+    dsr = np.interp(Tr, To, dso)
+    for _ in range(max_refine + 1):
+        err = np.abs(np.interp(T_dense, Tr, dsr) - ds_dense) / ds_dense * 100
+        worst = int(np.argmax(err)) if err.size else 0
+        if err.size == 0 or err[worst] <= tol or _ == max_refine:
+            break
+        loc = np.searchsorted(Tr, T_dense[worst])
+        Tr = np.insert(Tr, loc, T_dense[worst])
+        dsr = np.insert(dsr, loc, ds_dense[worst])
+
+    report = {
+        'n_dense': int(T_dense.size),
+        'n_resampled': int(Tr.size),
+        'max_error': float(err[worst]) if err.size else 0.0,
+        'mean_error': float(np.mean(err)) if err.size else 0.0,
+        'T_max_error': float(T_dense[worst]) if err.size else 0.0,
+    }
+    log.info(f"Target resampled from {report['n_dense']} to {report['n_resampled']} periods "
+             f"(max error {report['max_error']:.3f}%)")
+    return Tr, dsr, report
+
+def _stopping_params(tol: float, mean_tol: float, delta: float, patience: int) -> Dict[str, Any]:
+    """Early-stopping settings as normalised keyword arguments."""
+    return {'tol': float(tol), 'mean_tol': float(mean_tol), 'delta': float(delta), 'patience': int(patience)}
+
+def _memory_params(low_memory: bool) -> Dict[str, Any]:
+    """Memory-aware mode as a cache key parameter (omitted when off, so existing keys stay valid)."""
+    return {'low_memory': True} if low_memory else {}
+
+def _warm_params(*warm: Optional[np.ndarray]) -> Dict[str, Any]:
+    """Warm start records as a cache key parameter (omitted for a cold start)."""
+    return {} if warm[0] is None else {'warm': rc.hash_inputs(*warm)}
+
+def my_single_key(
+    s: np.ndarray,
+    fs: float,
+    dso: np.ndarray,
+    To: np.ndarray,
+    T1: float,
+    T2: float,
+    zi: float,
+    nit: int,
+    baseline: bool,
+    porder: int,
+    tol: float = 0.0,
+    mean_tol: float = 0.0,
+    delta: float = 0.0,
+    patience: int = 0,
+    low_memory: bool = False,
+    warm: Optional[np.ndarray] = None
+) -> str:
+    """Cache key of a single component matching run."""
+    return rc.hash_inputs(s, dso, To, kind='single', fs=float(fs), T1=float(T1), T2=float(T2),
+                          zi=float(zi), nit=int(nit), baseline=bool(baseline), porder=int(porder),
+                          **_stopping_params(tol, mean_tol, delta, patience), **_memory_params(low_memory),
+                          **_warm_params(warm))
+
+def my_rotdnn_key(
+    s1: np.ndarray,
+    s2: np.ndarray,
+    fs: float,
+    dso: np.ndarray,
+    To: np.ndarray,
+    nn: int,
+    T1: float,
+    T2: float,
+    zi: float,
+    nit: int,
+    baseline: bool,
+    porder: int,
+    tol: float = 0.0,
+    mean_tol: float = 0.0,
+    delta: float = 0.0,
+    patience: int = 0,
+    low_memory: bool = False,
+    warm1: Optional[np.ndarray] = None,
+    warm2: Optional[np.ndarray] = None
+) -> str:
+    """Cache key of a RotDnn matching run."""
+    return rc.hash_inputs(s1, s2, dso, To, kind='rotdnn', fs=float(fs), nn=int(nn), T1=float(T1),
+                          T2=float(T2), zi=float(zi), nit=int(nit), baseline=bool(baseline),
+                          porder=int(porder), **_stopping_params(tol, mean_tol, delta, patience),
+                          **_memory_params(low_memory), **_warm_params(warm1, warm2))
+
+def my_REQPY_single(
+    s: np.ndarray,
+    fs: float,
+    dso: np.ndarray,
+    To: np.ndarray,
+    T1: float,
+    T2: float,
+    zi: float,
+    nit: int,
+    baseline: bool,
+    porder: int,
+    cache: Optional[rc.ResultCache] = None,
+    callback: Optional["matching.ProgressCallback"] = None,
+    tol: float = 0.0,
+    mean_tol: float = 0.0,
+    delta: float = 0.0,
+    patience: int = 0,
+    timer: Optional[StageTimer] = None,
+    low_memory: bool = False,
+    warm: Optional[np.ndarray] = None
+) -> Tuple[Dict[str, Any], str]:
+    """Runs single component matching, returning a cached result when the inputs were seen before.
+
+    Parameters
+    ----------
+    s, fs, dso, To, T1, T2, zi, nit, baseline, porder
+        As for reqpy_M.REQPY_single.
+    cache : Optional[rc.ResultCache], optional
+        Cache to use. Defaults to the shared `resultcache.results_cache`.
+    callback : Optional[matching.ProgressCallback], optional
+        Per-iteration progress callback (see `matching.match_single`). Not
+        called on a cache hit.
+    tol, mean_tol, delta, patience : optional
+        Early-stopping settings (see `matching.match_single`). The defaults
+        run all `nit` iterations.
+    timer : Optional[StageTimer], optional
+        Records the matching stages (not on a cache hit).
+    low_memory : bool, optional
+        Memory-aware mode: single-precision wavelet details and smaller
+        spectrum blocks (see `matching.estimate_peak_bytes`).
+    warm : Optional[np.ndarray], optional
+        Matched record of an earlier run to start the iterations from (see
+        `matching.match_single` and `my_warm_start`).
+
+    Returns
+    -------
+    Tuple[Dict[str, Any], str]
+        The REQPY_single results dictionary and the cache key of the run.
+        The results are shared with other sessions; their arrays are read-only.
+    """
+    import matching
+    cache = rc.results_cache if cache is None else cache
+    stopping = _stopping_params(tol, mean_tol, delta, patience)
+    key = my_single_key(s, fs, dso, To, T1, T2, zi, nit, baseline, porder, **stopping, low_memory=low_memory,
+                        warm=warm)
+    results = cache.get(key)
+    if results is None:
+        results = matching.match_single(s=s, fs=fs, dso=dso, To=To, T1=T1, T2=T2, zi=zi, nit=nit,
+                                        baseline=baseline, porder=porder, callback=callback,
+                                        timer=timer, low_memory=low_memory, warm=warm, **stopping)
+        results = cache.put(key, results)
+    else:
+        log.info(f"Using cached REQPY_single result {key[:12]}")
+    return results, key
+
+def my_REQPYrotdnn(
+    s1: np.ndarray,
+    s2: np.ndarray,
+    fs: float,
+    dso: np.ndarray,
+    To: np.ndarray,
+    nn: int,
+    T1: float,
+    T2: float,
+    zi: float,
+    nit: int,
+    baseline: bool,
+    porder: int,
+    cache: Optional[rc.ResultCache] = None,
+    callback: Optional["matching.ProgressCallback"] = None,
+    tol: float = 0.0,
+    mean_tol: float = 0.0,
+    delta: float = 0.0,
+    patience: int = 0,
+    timer: Optional[StageTimer] = None,
+    low_memory: bool = False,
+    warm1: Optional[np.ndarray] = None,
+    warm2: Optional[np.ndarray] = None
+) -> Tuple[Dict[str, Any], str]:
+    """Runs RotDnn matching, returning a cached result when the inputs were seen before.
+
+    Parameters
+    ----------
+    s1, s2, fs, dso, To, nn, T1, T2, zi, nit, baseline, porder
+        As for reqpy_M.REQPYrotdnn.
+    cache : Optional[rc.ResultCache], optional
+        Cache to use. Defaults to the shared `resultcache.results_cache`.
+    callback : Optional[matching.ProgressCallback], optional
+        Per-iteration progress callback (see `matching.match_rotdnn`). Not
+        called on a cache hit.
+    tol, mean_tol, delta, patience : optional
+        Early-stopping settings (see `matching.match_rotdnn`). The defaults
+        run all `nit` iterations.
+    timer : Optional[StageTimer], optional
+        Records the matching stages (not on a cache hit).
+    low_memory : bool, optional
+        Memory-aware mode: single-precision wavelet details and smaller
+        spectrum blocks (see `matching.estimate_peak_bytes`).
+    warm1, warm2 : Optional[np.ndarray], optional
+        Matched pair of an earlier run to start the iterations from (see
+        `matching.match_rotdnn` and `my_warm_start`).
+
+    Returns
+    -------
+    Tuple[Dict[str, Any], str]
+        The REQPYrotdnn results dictionary and the cache key of the run.
+        The results are shared with other sessions; their arrays are read-only.
+    """
+    import matching
+    cache = rc.results_cache if cache is None else cache
+    stopping = _stopping_params(tol, mean_tol, delta, patience)
+    key = my_rotdnn_key(s1, s2, fs, dso, To, nn, T1, T2, zi, nit, baseline, porder, **stopping,
+                        low_memory=low_memory, warm1=warm1, warm2=warm2)
+    results = cache.get(key)
+    if results is None:
+        warm = None if warm1 is None else (warm1, warm2)
+        results = matching.match_rotdnn(s1=s1, s2=s2, fs=fs, dso=dso, To=To, nn=nn, T1=T1, T2=T2,
+                                        zi=zi, nit=nit, baseline=baseline, porder=porder, callback=callback,
+                                        timer=timer, low_memory=low_memory, warm=warm, **stopping)
+        results = cache.put(key, results)
+    else:
+        log.info(f"Using cached REQPYrotdnn result {key[:12]}")
+    return results, key
+
+def my_pack_targets(targets: List[Tuple[np.ndarray, np.ndarray]]) -> Dict[str, np.ndarray]:
+    """Packs (To, dso) target spectra as the To, dso and sizes arguments of my_REQPY_sweep."""
+    return {'To': np.concatenate([To for To, _ in targets]), 'dso': np.concatenate([dso for _, dso in targets]),
+            'sizes': np.array([len(To) for To, _ in targets])}
+
+def _sweep_cases(
+    s1: np.ndarray,
+    s2: Optional[np.ndarray],
+    fs: float,
+    To: np.ndarray,
+    dso: np.ndarray,
+    sizes: np.ndarray,
+    zis: np.ndarray,
+    nn: int,
+    T1: float,
+    T2: float,
+    nit: int,
+    baseline: bool,
+    porder: int,
+    stopping: Dict[str, Any],
+    low_memory: bool
+) -> List[Tuple[np.ndarray, np.ndarray, float, str]]:
+    """(To, dso, zi, cache key) of every combination of a sweep, target by target."""
+    bounds = np.cumsum(sizes)[:-1]
+    cases = []
+    for To_i, dso_i in zip(np.split(To, bounds), np.split(dso, bounds)):
+        for zi in zis:
+            if s2 is None:
+                key = my_single_key(s1, fs, dso_i, To_i, T1, T2, zi, nit, baseline, porder, **stopping,
+                                    low_memory=low_memory)
+            else:
+                key = my_rotdnn_key(s1, s2, fs, dso_i, To_i, nn, T1, T2, zi, nit, baseline, porder, **stopping,
+                                    low_memory=low_memory)
+            cases.append((To_i, dso_i, float(zi), key))
+    return cases
+
+def my_sweep_key(
+    s1: np.ndarray,
+    fs: float,
+    To: np.ndarray,
+    dso: np.ndarray,
+    sizes: np.ndarray,
+    zis: np.ndarray,
+    T1: float,
+    T2: float,
+    nit: int,
+    baseline: bool,
+    porder: int,
+    s2: Optional[np.ndarray] = None,
+    nn: int = 100,
+    tol: float = 0.0,
+    mean_tol: float = 0.0,
+    delta: float = 0.0,
+    patience: int = 0,
+    low_memory: bool = False
+) -> str:
+    """Cache key of a sweep (a hash of the cache keys of its combinations)."""
+    cases = _sweep_cases(s1, s2, fs, To, dso, sizes, zis, nn, T1, T2, nit, baseline, porder,
+                         _stopping_params(tol, mean_tol, delta, patience), low_memory)
+    return rc.hash_inputs(kind='sweep', keys=tuple(key for *_, key in cases))
+
+def my_REQPY_sweep(
+    s1: np.ndarray,
+    fs: float,
+    To: np.ndarray,
+    dso: np.ndarray,
+    sizes: np.ndarray,
+    zis: np.ndarray,
+    T1: float,
+    T2: float,
+    nit: int,
+    baseline: bool,
+    porder: int,
+    s2: Optional[np.ndarray] = None,
+    nn: int = 100,
+    cache: Optional[rc.ResultCache] = None,
+    callback: Optional["matching.ProgressCallback"] = None,
+    tol: float = 0.0,
+    mean_tol: float = 0.0,
+    delta: float = 0.0,
+    patience: int = 0,
+    timer: Optional[StageTimer] = None,
+    low_memory: bool = False
+) -> Tuple[Dict[str, Any], str]:
+    """Matches a seed record (or pair) to every combination of several targets and damping ratios.
+
+    Each combination is the run of my_REQPY_single (my_REQPYrotdnn if `s2`
+    is given) with that target and damping ratio, and is cached under the
+    same key, so combinations matched before - in another sweep or in a
+    single run - are not matched again. The others are matched by
+    `matching.match_sweep`, which decomposes the seed once and runs them in
+    parallel.
+
+    Parameters
+    ----------
+    s1, s2 : np.ndarray
+        Seed record, and the second horizontal component for RotDnn
+        matching (default None: single component matching).
+    fs, T1, T2, nit, baseline, porder
+        As for my_REQPY_single, the same for all combinations.
+    To, dso, sizes : np.ndarray
+        Periods and PSA of the targets, concatenated, and the number of
+        periods of each target (see `my_pack_targets`).
+    zis : np.ndarray
+        Damping ratios.
+    nn : int, optional
+        RotDnn percentile (RotDnn matching only). Default is 100.
+    cache : Optional[rc.ResultCache], optional
+        Cache of the combinations and of the summary. Defaults to the shared
+        `resultcache.results_cache`.
+    callback : Optional[matching.ProgressCallback], optional
+        Progress callback over the iterations of all combinations (see
+        `matching.match_sweep`). Not called on a cache hit.
+    tol, mean_tol, delta, patience, low_memory : optional
+        As for my_REQPY_single.
+    timer : Optional[StageTimer], optional
+        Records the decomposition and the combinations (not on a cache hit).
+
+    Returns
+    -------
+    Tuple[Dict[str, Any], str]
+        Summary of the sweep and its cache key (`my_sweep_key`). The summary
+        has one entry per combination, target by target: 'target' (index of
+        the target), 'zi', 'rmsefin', 'meanefin', 'sf', 'nit_used',
+        'best_it', 'keys' (cache keys of the results of the combinations),
+        and 'T' and 'PSA' (the matched spectrum, stacked).
+    """
+    import matching
+    cache = rc.results_cache if cache is None else cache
+    stopping = _stopping_params(tol, mean_tol, delta, patience)
+    cases = _sweep_cases(s1, s2, fs, To, dso, sizes, zis, nn, T1, T2, nit, baseline, porder, stopping, low_memory)
+    keys = [key for *_, key in cases]
+    key = rc.hash_inputs(kind='sweep', keys=tuple(keys))
+    summary = cache.get(key)
+    if summary is not None:
+        log.info(f"Using cached sweep result {key[:12]}")
+        return summary, key
+
+    results = [cache.get(k) for k in keys]
+    todo = [i for i, r in enumerate(results) if r is None]
+    log.info(f"Sweep of {len(cases)} combinations, {len(cases) - len(todo)} of them cached")
+    if todo:
+        records = (s1,) if s2 is None else (s1, s2)
+        matched = matching.match_sweep(records, fs, [cases[i][:3] for i in todo], nn=nn, T1=T1, T2=T2,
+                                       nit=nit, baseline=baseline, porder=porder, callback=callback,
+                                       timer=timer, low_memory=low_memory, **stopping)
+        for i, r in zip(todo, matched):
+            results[i] = cache.put(keys[i], r)
+    psa_key = 'PSAccs' if s2 is None else 'PSArotnn'
+    summary = {'target': np.repeat(np.arange(len(sizes)), len(zis)), 'zi': np.array([c[2] for c in cases]),
+               'keys': np.array(keys), 'T': np.array([r['T'] for r in results]),
+               'PSA': np.array([r[psa_key] for r in results]),
+               **{k: np.array([r[k] for r in results]) for k in ('rmsefin', 'meanefin', 'sf', 'nit_used', 'best_it')}}
+    return cache.put(key, summary), key
+
+def my_early_stopping_inputs() -> Dict[str, Any]:
+    """Widgets for the early-stopping settings.
+
+    Returns
+    -------
+    Dict[str, Any]
+        tol, mean_tol, delta and patience, to pass to my_REQPY_single /
+        my_REQPYrotdnn (all zero when early stopping is disabled).
+    """
+    with st.expander("Early stopping"):
+        enabled = st.checkbox("Stop early when the misfit has converged", value=False)
+        ec1, ec2, ec3, ec4 = st.columns(4)
+        with ec1:
+            tol = st.number_input("Stop at RMSE below (%) (0 = off)", value=0.0, min_value=0.0)
+        with ec2:
+            mean_tol = st.number_input("Stop at mean misfit below (%) (0 = off)", value=0.0, min_value=0.0)
+        with ec3:
+            delta = st.number_input("Minimum RMSE improvement (% points)", value=0.0, min_value=0.0, step=0.01)
+        with ec4:
+            patience = st.number_input("Iterations without improvement", value=3, min_value=1)
+    if not enabled:
+        return _stopping_params(0.0, 0.0, 0.0, 0)
+    return _stopping_params(tol, mean_tol, delta, patience)
+
+@st.fragment(run_every=0.5)
+def my_show_match_progress(key: str) -> None:
+    """Live progress bar and misfit chart of a queued matching job.
+
+    Re-runs every 0.5 s without re-running the page; once the job has
+    finished, the whole page is re-run so it can pick up the results. Only
+    the session that submitted the job can cancel it: other sessions attached
+    to the same inputs follow it.
+    """
+    queue = jobqueue.default_queue()
+    job = queue.get(key)
+    if job is None or job.done:
+        st.rerun(scope="app")
+    if job.status == jobqueue.QUEUED:
+        text = f"Matching: waiting for a worker ({queue.position(key)} job(s) ahead in the queue)"
+    elif job.history:
+        m, rmse, _ = job.history[-1]
+        of = " (all combinations)" if job.kind == 'my_REQPY_sweep' else ""
+        text = f"Matching: iteration {m} of {job.nit}{of}, RMSE {rmse:.2f}% ({job.elapsed:.0f} s)"
+    else:
+        text = f"Matching: decomposing the seed record(s) ({job.elapsed:.0f} s)"
+    st.progress(job.progress, text=text)
+    if job.history:
+        _, rmse, meane = np.array(job.history).T
+        st.line_chart({'RMSE (%)': rmse, 'Misfit (%)': meane}, x_label="Iteration", height=220)
+    if job.owner != _session_id():
+        st.caption("Started by another session with the same inputs; it can only be cancelled there.")
+    elif st.button("Cancel matching"):
+        queue.cancel(key)
+
+def _add_job_stages(timer: StageTimer, job: jobqueue.Job) -> None:
+    """Adds the matching stages of a finished queued job to `timer`."""
+    peaks = [r['peak_mb'] for r in job.stages if r['peak_mb'] is not None]
+    timer.add('matching', job.elapsed, max(peaks) if peaks else None)
+    for r in job.stages:
+        timer.add(f"matching/{r['stage']}", r['seconds'], r['peak_mb'])
+
+def my_show_diagnostics(timer: StageTimer, **extra: Any) -> None:
+    """Diagnostics expander with the wall time and peak memory of each stage.
+
+    Parameters
+    ----------
+    timer : StageTimer
+        Stages recorded for this page run.
+    **extra : Any
+        Additional fields for the JSON download (e.g. the result key).
+    """
+    with st.expander("Diagnostics", expanded=True):
+        st.dataframe(
+            [{'Stage': r['stage'], 'Wall time (s)': r['seconds'], 'Peak memory (MB)': r['peak_mb']}
+             for r in timer.records],
+            hide_index=True)
+        st.caption(f"Total of the top-level stages: {timer.total:.2f} s. Peak memory is traced "
+                   f"process wide (tracemalloc), so it includes any other sessions running at the same time.")
+        stats = rc.cache_stats()
+        st.dataframe(
+            [{'Cache': c['cache'], 'Entries': f"{c['entries']} / {c['max_entries']}",
+              'Memory (MB)': c['mb'], 'Hits': c['hits'], 'Misses': c['misses'],
+              'Hit rate': c['hit_rate'], 'Evictions': c['evictions'], 'Expired': c['expirations']}
+             for c in stats],
+            hide_index=True)
+        st.caption("Caches shared by all sessions of this server; counters since the server started.")
+        st.download_button("Download diagnostics as JSON", timer.to_json(caches=stats, **extra),
+                           file_name="diagnostics.json", mime="application/json")
+
+def my_session_memory_budget() -> int:
+    """Memory budget (bytes) of the matching jobs of one session (REQPY_SESSION_MEMORY_MB, default 2048)."""
+    return int(float(os.environ.get('REQPY_SESSION_MEMORY_MB', 2048)) * 1024**2)
+
+def my_estimate_match_bytes(kwargs: Dict[str, Any]) -> int:
+    """Estimated peak memory (bytes) of a my_REQPY_single / my_REQPYrotdnn / my_REQPY_sweep call with `kwargs`."""
+    import matching
+    records = [kwargs[k] for k in ('s', 's1', 's2') if kwargs.get(k) is not None]
+    n = min(np.size(r) for r in records)
+    if 'zis' in kwargs:
+        return matching.estimate_sweep_bytes(n, 1 / kwargs['fs'], len(kwargs['sizes']) * len(kwargs['zis']),
+                                             ncomp=len(records), low_memory=kwargs.get('low_memory', False))
+    return matching.estimate_peak_bytes(n, 1 / kwargs['fs'], ncomp=len(records),
+                                        low_memory=kwargs.get('low_memory', False))
+
+def _match_steps(kwargs: Dict[str, Any]) -> int:
+    """Last progress step of a matching call (a sweep counts the iterations of all combinations)."""
+    if 'zis' in kwargs:
+        return len(kwargs['sizes']) * len(kwargs['zis']) * (int(kwargs['nit']) + 1) - 1
+    return int(kwargs['nit'])
+
+def _session_id() -> str:
+    """Id of this session, recorded as the owner of the jobs it submits."""
+    return st.session_state.setdefault('session_id', uuid.uuid4().hex)
+
+def _check_memory_budget(exclude: Tuple[str, ...], peak_bytes: int, low_memory: bool) -> None:
+    """Stops the page with an error if a new job would exceed the session memory budget.
+
+    Counts the queued and running jobs of the session, except those in `exclude`.
+    """
+    budget = my_session_memory_budget()
+    running = sum(job.peak_bytes for job in jobqueue.default_queue().jobs(owner=_session_id(),
+                                                                          statuses=jobqueue.ACTIVE)
+                  if job.key not in exclude)
+    if running + peak_bytes <= budget:
+        return
+    mb = 1024**2
+    advice = ["use a shorter (or lower sample rate) seed record"]
+    if not low_memory:
+        advice.insert(0, "enable memory-aware mode")
+    if running:
+        advice.append("wait for the matching started on the other page to finish")
+    in_use = f" ({running / mb:.0f} MB of it in use by other matching jobs)" if running else ""
+    st.error(f"Matching needs about {peak_bytes / mb:.0f} MB (estimated), more than the memory budget of "
+             f"{budget / mb:.0f} MB per session{in_use}. To continue, {', or '.join(advice)}. The budget is "
+             f"set by the environment variable REQPY_SESSION_MEMORY_MB.")
+    st.stop()
+
+def _submit_job(
+    queue: jobqueue.JobQueue,
+    key: str,
+    func: Callable[..., Tuple[Dict[str, Any], str]],
+    kwargs: Dict[str, Any],
+    timer: Optional[StageTimer],
+    exclude: Tuple[str, ...] = ()
+) -> jobqueue.Job:
+    """Submits a matching job after checking the session memory budget."""
+    peak_bytes = my_estimate_match_bytes(kwargs)
+    _check_memory_budget((key, *exclude), peak_bytes, kwargs.get('low_memory', False))
+    return queue.submit(key, func.__name__, kwargs, owner=_session_id(),
+                        memory=timer is not None and timer.memory, peak_bytes=peak_bytes,
+                        steps=_match_steps(kwargs))
+
+def my_match_in_background(
+    state_key: str,
+    key: str,
+    func: Callable[..., Tuple[Dict[str, Any], str]],
+    timer: Optional[StageTimer] = None,
+    **kwargs: Any
+) -> Dict[str, Any]:
+    """Returns matching results, running the matching as a queued job if needed.
+
+    On a cache hit the results are returned directly. Otherwise the run is
+    submitted to the job queue (`jobqueue.default_queue`), or attached to the
+    job already queued, running or finished for the same inputs - also one
+    submitted by another session or before a browser reconnect. A live
+    progress fragment is shown and the page script is stopped; the fragment
+    re-runs the page once the job has finished. A job this session started
+    for different inputs is cancelled. A new job is only submitted if its
+    estimated peak memory, together with the other jobs of the session,
+    fits the session memory budget (`my_session_memory_budget`).
+
+    Parameters
+    ----------
+    state_key : str
+        st.session_state key holding the cache key of the page's job.
+    key : str
+        Cache key of the run (see `my_single_key` / `my_rotdnn_key` / `my_sweep_key`).
+    func : Callable
+        my_REQPY_single, my_REQPYrotdnn or my_REQPY_sweep.
+    timer : Optional[StageTimer], optional
+        Receives the matching stages once the results are available.
+    **kwargs : Any
+        Arguments passed to `func`.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The results dictionary (only returned once available).
+    """
+    t0 = time.perf_counter()
+    queue = jobqueue.default_queue()
+    results = rc.results_cache.get(key)
+    job = queue.get(key)
+    if results is None and (job is None or job.status == jobqueue.DONE):
+        results = queue.results(key) # Finished job, or a combination matched by a sweep
+        if results is not None:
+            results = rc.results_cache.put(key, results)
+    previous = st.session_state.get(state_key)
+    if results is not None:
+        if timer is not None:
+            if job is not None and job.status == jobqueue.DONE and previous == key:
+                _add_job_stages(timer, job)
+            else:
+                timer.add('matching (cached)', time.perf_counter() - t0)
+        return results
+    if previous is not None and previous != key:
+        old = queue.get(previous)
+        if old is not None and not old.done and old.owner == _session_id():
+            queue.cancel(previous)
+    st.session_state[state_key] = key
+    if job is None or job.status == jobqueue.DONE: # Never run, or its results were purged
+        job = _submit_job(queue, key, func, kwargs, timer, exclude=(previous,))
+
+    if job.status in (jobqueue.FAILED, jobqueue.CANCELLED):
+        if job.status == jobqueue.FAILED:
+            st.error(f"Matching failed: {job.error}")
+        else:
+            done = job.history[-1][0] if job.history else 0
+            st.warning(f"Matching was cancelled after iteration {done} of {job.nit}.")
+        if st.button("Restart matching"):
+            _submit_job(queue, key, func, kwargs, timer)
+            st.rerun()
+        st.stop()
+    my_show_match_progress(key)
+    st.stop()
+
+def _lookup_results(key: str) -> Optional[Dict[str, Any]]:
+    """Results of a finished run from the cache or the job queue, or None."""
+    results = rc.results_cache.get(key)
+    return results if results is not None else jobqueue.default_queue().results(key)
+
+def my_warm_start(lineage_key: str, match_args: Dict[str, Any], request: str) -> Tuple[Dict[str, Any], str]:
+    """Arguments and cache key of a matching run, warm-started if possible (see warmstart.py).
+
+    If the session's lineage (st.session_state[lineage_key]) holds a run
+    with the same seed whose parameters differ only marginally from
+    `match_args`, the new run starts from its matched record(s) and runs at
+    most warmstart.WARM_NIT iterations. Otherwise it is a cold start. The
+    choice is kept for the page reruns until the run is recorded with
+    `my_record_run`, and parameters of a recorded run return its arguments.
+
+    Parameters
+    ----------
+    lineage_key : str
+        st.session_state key of the page's lineage.
+    match_args : Dict[str, Any]
+        Arguments of the cold-start my_REQPY_single / my_REQPYrotdnn call.
+    request : str
+        Cache key of the cold-start run (my_single_key / my_rotdnn_key).
+    """
+    lineage = st.session_state.setdefault(lineage_key, [])
+    pending = st.session_state.get(f"{lineage_key}_pending")
+    for entry in lineage + ([pending] if pending is not None else []):
+        if entry['request'] == request:
+            return entry['args'], entry['key']
+    params = warmstart.run_params(match_args)
+    parent = warmstart.find_parent(lineage, params, lambda key: _lookup_results(key) is not None)
+    if parent is None:
+        args, key = match_args, request
+    else:
+        prev = _lookup_results(parent['key'])
+        if 's' in match_args:
+            args = {**match_args, 'warm': prev['ccs']}
+        else:
+            args = {**match_args, 'warm1': prev['scc1'], 'warm2': prev['scc2']}
+        args['nit'] = min(int(match_args['nit']), warmstart.WARM_NIT)
+        key = my_single_key(**args) if 's' in args else my_rotdnn_key(**args)
+    st.session_state[f"{lineage_key}_pending"] = warmstart.new_entry(lineage, request, key, args, params, parent)
+    return args, key
+
+def my_record_run(lineage_key: str, key: str, results: Dict[str, Any]) -> Dict[str, Any]:
+    """Adds the finished run of `key` to the session's lineage and returns its entry."""
+    lineage = st.session_state.setdefault(lineage_key, [])
+    for entry in lineage:
+        if entry['key'] == key:
+            return entry
+    entry = warmstart.complete(st.session_state.pop(f"{lineage_key}_pending"), results)
+    lineage.append(entry)
+    return entry
+
+def my_show_lineage(lineage_key: str, entry: Dict[str, Any]) -> None:
+    """Shows how the current run was started and the lineage of the session's runs."""
+    lineage = st.session_state[lineage_key]
+    if entry['parent'] is not None:
+        st.caption(f"Warm-started from the matched record of run {entry['parent']} "
+                   f"({entry['nit']} iterations).")
+    with st.expander(f"Run lineage ({len(lineage)} runs)"):
+        st.dataframe(
+            [{'Run': e['run'], 'Started from': 'seed' if e['parent'] is None else f"run {e['parent']}",
+              'T1 (s)': e['params']['T1'], 'T2 (s)': e['params']['T2'], 'Damping (%)': 100 * e['params']['zi'],
+              'Iterations used': f"{e['nit_used']} of {e['nit']}", 'RMSE (%)': e['rmsefin'],
+              'Misfit (%)': e['meanefin']}
+             for e in lineage],
+            hide_index=True)
+
+def my_record_library() -> Optional[recordlibrary.RecordLibrary]:
+    """The seed record library in REQPY_LIBRARY_DIR, or None if none is set up."""
+    library = recordlibrary.default_library()
+    return library if library is not None and len(library) else None
+
+def my_pick_library_seed(
+    library: recordlibrary.RecordLibrary,
+    target_text: str,
+    T1: float,
+    T2: float,
+    top: int = 20
+) -> str:
+    """Ranks the library against the target and lets the user pick a seed.
+
+    Parameters
+    ----------
+    library : recordlibrary.RecordLibrary
+        Record library.
+    target_text : str
+        Contents of the uploaded target spectrum file.
+    T1, T2 : float
+        Matching period range.
+    top : int, optional
+        Number of records listed. Default is 20.
+
+    Returns
+    -------
+    str
+        Library name of the chosen record (the best ranked by default).
+    """
+    To, dso = my_load_target_spectrum(io.StringIO(target_text))
+    max_sf = st.number_input("Maximum scale factor (0 = no limit)", value=0.0, min_value=0.0,
+                             help="Only list records whose scale factor is within [1/max, max].")
+    rows = library.rank(To, dso, T1, T2, top=top, sf_range=(1 / max_sf, max_sf) if max_sf > 0 else None)
+    if not rows:
+        st.warning("No library record is within the scale factor limits.")
+        st.stop()
+    st.dataframe({'Record': [r['name'] for r in rows], 'Name': [r['eqname'] for r in rows],
+                  'Scale factor': [r['sf'] for r in rows], 'RMSE (%)': [r['rmse'] for r in rows],
+                  'Misfit (%)': [r['meane'] for r in rows], 'Duration (s)': [r['dt'] * (r['npts'] - 1) for r in rows]},
+                 hide_index=True)
+    return st.selectbox("Seed record (ranked by the misfit of the scaled record spectrum)",
+                        [r['name'] for r in rows])
+
+@st.cache_data(max_entries=32)
+def my_verification_spectra(
+    records: Tuple[np.ndarray, ...],
+    dt: float,
+    T: np.ndarray,
+    dampings: Tuple[float, ...]
+) -> np.ndarray:
+    """PSA of several records at several damping ratios, in one batched pass per record.
+
+    Parameters
+    ----------
+    records : Tuple[np.ndarray, ...]
+        Acceleration time series (g), e.g. (scaled seed, matched record).
+    dt : float
+        Time step (s).
+    T : np.ndarray
+        Periods (s), e.g. results['T'].
+    dampings : Tuple[float, ...]
+        Damping ratios.
+
+    Returns
+    -------
+    np.ndarray
+        PSA (g) with shape (len(records), len(dampings), len(T)).
+    """
+    import spectra
+    return np.array([spectra.response_spectra(T, s, dt, np.array(dampings))[0] for s in records])
+
+def my_plot_verification_spectra(
+    T: np.ndarray,
+    psa: np.ndarray,
+    dampings: Tuple[float, ...],
+    labels: Tuple[str, ...],
+    T1: float = 0.0,
+    T2: float = 0.0
+) -> "plt.Figure":
+    """Plots the output of `my_verification_spectra`, one color per damping ratio."""
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(6.5, 4.5))
+    styles = ('--', '-', ':', '-.')
+    colors = plt.cm.viridis(np.linspace(0, 0.9, len(dampings)))
+    if T1 > 0 and T2 > T1:
+        ax.axvspan(T1, T2, color='silver', alpha=0.4, label='Match Range')
+    for r, label in enumerate(labels):
+        for i, z in enumerate(dampings):
+            ax.semilogx(T, psa[r, i], styles[r % len(styles)], color=colors[i], lw=1,
+                        label=f"{label}, {100 * z:g}% damping")
+    ax.set_xlabel('Period T [s]')
+    ax.set_ylabel('PSA [g]')
+    ax.set_xlim(T.min(), T.max())
+    ax.set_ylim(bottom=0)
+    ax.grid(True, which='both', linestyle=':', alpha=0.7)
+    ax.legend(fontsize=8)
+    fig.tight_layout()
+    return fig
+
+@st.cache_data(max_entries=16)
+def my_rotated_spectra(
+    s1: np.ndarray,
+    s2: np.ndarray,
+    dt: float,
+    T: np.ndarray,
+    zi: float
+) -> np.ndarray:
+    """PSA of a component pair at every rotation angle (see spectra.rotated_spectra).
+
+    Cached, so different RotDnn percentiles of the same pair only need
+    spectra.rotdnn on the returned (nangles, len(T)) array.
+    """
+    import spectra
+    return spectra.rotated_spectra(T, s1, s2, dt, zi)
+
+def my_plot_rotdnn_spectra(
+    T: np.ndarray,
+    psa_nn: np.ndarray,
+    nns: Tuple[float, ...],
+    target_spec: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    T1: float = 0.0,
+    T2: float = 0.0
+) -> "plt.Figure":
+    """Plots RotDnn spectra (rows of `psa_nn`) for several percentiles `nns`."""
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(6.5, 4.5))
+    if T1 > 0 and T2 > T1:
+        ax.axvspan(T1, T2, color='silver', alpha=0.4, label='Match Range')
+    if target_spec is not None:
+        ax.semilogx(target_spec[0], target_spec[1], color='darkgray', lw=2, label='Target')
+    colors = plt.cm.plasma(np.linspace(0, 0.8, len(nns)))
+    for i, nn_i in enumerate(nns):
+        ax.semilogx(T, psa_nn[i], color=colors[i], lw=1, label=f'Matched RotD{nn_i:g}')
+    ax.set_xlabel('Period T [s]')
+    ax.set_ylabel('PSA [g]')
+    ax.set_xlim(T.min(), T.max())
+    ax.set_ylim(bottom=0)
+    ax.grid(True, which='both', linestyle=':', alpha=0.7)
+    ax.legend(fontsize=8)
+    fig.tight_layout()
+    return fig
+
+def my_sweep_inputs(zi: float) -> Optional[Tuple[List[Any], Tuple[float, ...]]]:
+    """Widgets of the sweep mode: additional targets and the damping ratios.
+
+    Parameters
+    ----------
+    zi : float
+        Damping ratio of the page (selected by default).
+
+    Returns
+    -------
+    Optional[Tuple[List[Any], Tuple[float, ...]]]
+        Uploaded additional target files and the damping ratios, or None if
+        the sweep mode is off.
+    """
+    with st.expander("Sweep: several targets and damping ratios"):
+        enabled = st.checkbox("Match the seed to every combination of the targets and damping ratios",
+                              value=False)
+        files = st.file_uploader("Additional target spectrum files (Period (s), PSA (g))", type=["txt"],
+                                 accept_multiple_files=True)
+        options = sorted({0.02, 0.03, 0.05, 0.07, 0.10, 0.15, 0.20, zi})
+        dampings = st.multiselect("Damping ratios", options, default=(zi,), format_func=lambda z: f"{100 * z:g}%")
+    if not enabled:
+        return None
+    if not dampings:
+        st.warning("Select at least one damping ratio for the sweep.")
+        st.stop()
+    return list(files or []), tuple(sorted(dampings))
+
+def my_load_sweep_targets(
+    files: List[Any],
+    T1: float,
+    T2: float,
+    npts: int
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Loads the additional targets of a sweep, resampled as the page's target (npts = 0: not resampled)."""
+    targets = []
+    for f in files:
+        To, dso = my_load_target_spectrum(f)
+        if npts > 0:
+            To, dso, _ = my_resample_target(To, dso, T1, T2, npts=npts)
+        targets.append((To, dso))
+    return targets
+
+def my_plot_sweep(
+    summary: Dict[str, Any],
+    targets: List[Tuple[np.ndarray, np.ndarray]],
+    labels: List[str],
+    T1: float = 0.0,
+    T2: float = 0.0
+) -> "plt.Figure":
+    """Overlay of the matched spectra of a sweep (solid) on their targets (dashed), and the final misfits."""
+    import matplotlib.pyplot as plt
+    fig, (ax, axm) = plt.subplots(1, 2, figsize=(11, 4.8), gridspec_kw={'width_ratios': (3, 2)})
+    colors = plt.cm.tab10(np.arange(len(labels)) % 10)
+    if T1 > 0 and T2 > T1:
+        ax.axvspan(T1, T2, color='silver', alpha=0.4, label='Match Range')
+    for i, label in enumerate(labels):
+        To, dso = targets[summary['target'][i]]
+        ax.semilogx(To, dso, '--', color=colors[i], lw=1)
+        ax.semilogx(summary['T'][i], summary['PSA'][i], color=colors[i], lw=1.2, label=label)
+    ax.set_xlabel('Period T [s]')
+    ax.set_ylabel('PSA [g]')
+    ax.set_xlim(summary['T'].min(), summary['T'].max())
+    ax.set_ylim(bottom=0)
+    ax.grid(True, which='both', linestyle=':', alpha=0.7)
+    ax.legend(fontsize=8, title="Matched (targets dashed)", title_fontsize=8)
+    y = np.arange(len(labels))
+    axm.barh(y - 0.2, summary['rmsefin'], height=0.4, color=colors, label='RMSE')
+    axm.barh(y + 0.2, summary['meanefin'], height=0.4, color=colors, alpha=0.45, label='Misfit')
+    axm.set_yticks(y, labels, fontsize=8)
+    axm.invert_yaxis()
+    axm.set_xlabel('Final misfit (pre-BC) [%]')
+    axm.grid(True, axis='x', linestyle=':', alpha=0.7)
+    axm.legend(fontsize=8)
+    fig.tight_layout()
+    return fig
+
+def my_show_sweep(
+    summary: Dict[str, Any],
+    targets: List[Tuple[np.ndarray, np.ndarray]],
+    names: List[str],
+    T1: float = 0.0,
+    T2: float = 0.0
+) -> None:
+    """Comparison table and overlay plot of the combinations of a sweep.
+
+    Parameters
+    ----------
+    summary : Dict[str, Any]
+        Summary returned by my_REQPY_sweep.
+    targets : List[Tuple[np.ndarray, np.ndarray]]
+        (To, dso) of the targets, in the order passed to the sweep.
+    names : List[str]
+        Names of the targets.
+    T1, T2 : float, optional
+        Matching period range, shaded in the plot.
+    """
+    labels = [f"{names[t]}, {100 * z:g}%" for t, z in zip(summary['target'], summary['zi'])]
+    st.dataframe({'Target': [names[t] for t in summary['target']], 'Damping (%)': 100 * summary['zi'],
+                  'RMSE (%)': summary['rmsefin'], 'Misfit (%)': summary['meanefin'],
+                  'Scale factor': summary['sf'], 'Iterations used': summary['nit_used'],
+                  'Best iteration': summary['best_it']},
+                 hide_index=True)
+    import matplotlib.pyplot as plt
+    import plotting
+    with plotting.lock: # matplotlib is not thread safe
+        fig = my_plot_sweep(summary, targets, labels, T1, T2)
+        st.pyplot(fig)
+        plt.close(fig)
+    st.caption("Misfits before baseline correction. Switch the sweep off and select a target and damping "
+               "ratio to plot and download that combination; its matching is not run again.")
+
+_AT2_VALUES_PER_LINE = 8
+_AT2_CHUNK_LINES = 4096
+
+def _is_binary_stream(fp) -> bool:
+    """True if `fp` expects bytes rather than str."""
+    if isinstance(fp, io.TextIOBase):
+        return False
+    if isinstance(fp, (io.BufferedIOBase, io.RawIOBase)):
+        return True
+    return 'b' in getattr(fp, 'mode', '')
+
+def my_write_at2(
+    fp,
+    accel: np.ndarray,
+    dt: float,
+    comp_key: str = 'ccs',
+    header_details: Optional[Dict[str, str]] = None
+) -> None:
+    """Streams an acceleration time series to a file-like object in PEER .AT2 format.
+
+    Values are written 8 per line, formatting a block of lines with a single
+    string operation at a time, so the cost is linear in the record length
+    and the full file text is never held in memory.
+
+    Parameters
+    ----------
+    fp : file-like
+        Destination. Text streams (io.StringIO, files opened with 'w') receive
+        str; binary streams (io.BytesIO, files opened with 'wb', zip members)
+        receive ASCII-encoded bytes.
+    accel : np.ndarray
+        Acceleration time series (g).
+    dt : float
+        Time step (s).
+    comp_key : str, optional
+        Results key of the record, used in the default component name.
+    header_details : Optional[Dict[str, str]], optional
+        Header details, see `my_save_results_as_at2`.
+    """
+    npts = len(accel)
+
+    # Fill header details with defaults if not provided
+    if header_details is None:
+        header_details = {}
+    
+    title = header_details.get('title', 'REQPY SPECTRALLY MATCHED RECORD')
+    date = header_details.get('date', '01/01/2025')
+    station = header_details.get('station', 'REQPY_STATION')
+    component = header_details.get('component', f'Matched {comp_key}')
+
+    header = (f"{title}\n"
+              f"EARTHQUAKE, {date}, {station}, {component}\n"
+              "ACCELERATION IN G\n"
+              f"NPTS= {npts}, DT= {dt:.8f} SEC\n")
+
+    if _is_binary_stream(fp):
+        write = lambda text: fp.write(text.encode('ascii'))
+    else:
+        write = fp.write
+
+    write(header)
+    line_fmt = " % 15.7e" * _AT2_VALUES_PER_LINE + "\n"
+    block = _AT2_VALUES_PER_LINE * _AT2_CHUNK_LINES
+    nfull = npts - npts % _AT2_VALUES_PER_LINE
+    for i in range(0, nfull, block):
+        values = accel[i:min(i + block, nfull)]
+        write((line_fmt * (len(values) // _AT2_VALUES_PER_LINE)) % tuple(values.tolist()))
+    if nfull < npts or npts == 0:
+        # Last (partial) line; an empty record still ends with a newline
+        values = accel[nfull:]
+        write((" % 15.7e" * len(values)) % tuple(values.tolist()) + "\n")
+
+def _content_key(func: Callable, *args: Any, result_key: Optional[str] = None, **kwargs: Any) -> str:
+    """Content hash of a call: the arrays of dict/tuple arguments by value, everything else by repr.
+
+    With `result_key`, the `results` argument is identified by that key instead of being hashed.
+    """
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    arrays: List[np.ndarray] = []
+    params: Dict[str, Any] = {'func': func.__name__}
+    for name, value in bound.arguments.items():
+        if name == 'results' and result_key is not None:
+            params[name] = result_key
+            continue
+        if isinstance(value, dict):
+            items = sorted(value.items())
+        elif isinstance(value, tuple) and any(isinstance(v, np.ndarray) for v in value):
+            items = list(enumerate(value))
+        else:
+            items = [(None, value)]
+        for k, v in items:
+            label = name if k is None else f"{name}[{k}]"
+            if isinstance(v, np.ndarray):
+                arrays.append(v)
+                params[label] = 'array'
+            else:
+                params[label] = v
+    return rc.hash_inputs(*arrays, **params)
+
+def _cached_output(func: Callable) -> Callable:
+    """Caches the output of a writer in `resultcache.outputs_cache`, keyed on the content of its arguments.
+
+    The text or bytes are cached; every call gets a new StringIO/BytesIO over them. The pages pass
+    `result_key` (the cache key of the results, see `my_REQPY_single`), so that the output is keyed on
+    it and the writer options, like `my_export_bundle`, rather than on a hash of the results arrays on
+    every rerun. Without it the results are hashed.
+    """
+    @functools.wraps(func)
+    def wrapper(*args: Any, result_key: Optional[str] = None, **kwargs: Any) -> Any:
+        key = _content_key(func, *args, result_key=result_key, **kwargs)
+        cached = rc.outputs_cache.get(key)
+        if cached is None:
+            output = func(*args, **kwargs)
+            if output is None:
+                return None
+            cached = (output.getvalue(), type(output)) if isinstance(output, io.IOBase) else (output, None)
+            rc.outputs_cache.put(key, cached)
+        value, stream = cached
+        return stream(value) if stream is not None else value
+    wrapper.clear = rc.outputs_cache.clear
+    return wrapper
+
+@_cached_output
 def my_save_results_as_at2(
     results: Dict[str, Any],
     comp_key: str = 'ccs',
@@ -80,38 +1350,39 @@ def my_save_results_as_at2(
         log.error(f"Cannot save .AT2 file: '{comp_key}' or 'dt' not found in results dictionary.")
         return
 
-    npts = len(accel)
-    
-    # Fill header details with defaults if not provided
-    if header_details is None:
-        header_details = {}
-    
-    title = header_details.get('title', 'REQPY SPECTRALLY MATCHED RECORD')
-    date = header_details.get('date', '01/01/2025')
-    station = header_details.get('station', 'REQPY_STATION')
-    component = header_details.get('component', f'Matched {comp_key}')
-
-    header_line1 = f"{title}\n"
-    header_line2 = f"EARTHQUAKE, {date}, {station}, {component}\n"
-    header_line3 = "ACCELERATION IN G\n"
-    header_line4 = f"NPTS= {npts}, DT= {dt:.8f} SEC\n"
-
-    filetxt = ""
-    filetxt += header_line1
-    filetxt += header_line2
-    filetxt += header_line3
-    filetxt += header_line4
-
-    for i in range(npts):
-        filetxt += f" {accel[i]: 15.7e}"
-        if (i + 1) % 8 == 0 and i != (npts - 1): # Add newline every 8 points
-            filetxt += "\n"
-    filetxt += "\n" # Final newline
+    output = io.StringIO()
+    my_write_at2(output, np.asarray(accel), dt, comp_key=comp_key, header_details=header_details)
+    output.seek(0)
     log.info(f"Successfully saved to text string for .AT2 format.")
-    output = io.StringIO(filetxt)
     return output   
    
-@st.cache_data
+@_cached_output
+def my_save_results_as_npz(
+    results: Dict[str, Any],
+    float32: bool = False,
+    target_spec: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    metadata: Optional[Dict[str, Any]] = None
+) -> io.BytesIO:
+    """Saves a results dictionary as a binary results file (.npz).
+
+    Parameters
+    ----------
+    results : Dict[str, Any]
+        The results dictionary from a REQPY function (all components).
+    float32 : bool, optional
+        Store time series and spectra in single precision. Default False.
+    target_spec : Optional[Tuple[np.ndarray, np.ndarray]], optional
+        (periods, PSA) of the target spectrum.
+    metadata : Optional[Dict[str, Any]], optional
+        JSON-serializable metadata, see resultsfile.save_results.
+    """
+    output = io.BytesIO()
+    resultsfile.save_results(output, results, float32=float32, target_spec=target_spec, metadata=metadata)
+    output.seek(0)
+    log.info(f"Successfully saved binary results file.")
+    return output
+
+@_cached_output
 def my_save_results_as_2col(
     results: Dict[str, Any],
     comp_key: str = 'ccs',
@@ -140,9 +1411,6 @@ def my_save_results_as_2col(
 
     npts = len(data)
     t = np.linspace(0, (npts - 1) * dt, npts)
-    
-    # Stack time and data as columns
-    data_to_save = np.stack((t, data), axis=1)
 
     # Create default header if none provided
     if header_str is None:
@@ -154,13 +1422,14 @@ def my_save_results_as_2col(
 
     try:
         output = io.StringIO()
-        np.savetxt(output, data_to_save, header=header_str, fmt='%.8e', delimiter=',')
+        # Same text as np.savetxt, written a block of rows at a time (see export.write_columns)
+        export.write_columns(output.write, (t, data), header_str)
         log.info(f"Successfully saved 2-column file")
     except Exception as e:
         log.error(f"Error saving 2-column file: {e}")
     return output 
 
-@st.cache_data
+@_cached_output
 def my_save_results_as_1col(
     results: Dict[str, Any],
     comp_key: str = 'ccs',
@@ -196,12 +1465,72 @@ def my_save_results_as_1col(
 
     try:
         output = io.StringIO()
-        np.savetxt(output, data, header=header_str, fmt='%.8e')
+        export.write_columns(output.write, (data,), header_str)
         log.info(f"Successfully saved 1-column file")
     except Exception as e:
         log.error(f"Error saving 1-column file: {e}")
     return output 
 
+def my_export_bundle(
+    results: Dict[str, Any],
+    result_key: str,
+    components: List[export.Component],
+    formats: Tuple[str, ...],
+    quantities: Tuple[str, ...],
+    target_name: str,
+    target_spec: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    spectra_base: Optional[str] = None,
+    nn: Optional[int] = None
+) -> bytes:
+    """Zip archive of all requested outputs of a matching result.
+
+    Cached in `resultcache.outputs_cache` on `result_key` and the export
+    options (the results and target arrays are identified by the key rather
+    than hashed), so the archive is serialized once per result. See
+    export.write_bundle for the parameters.
+    """
+    key = rc.hash_inputs(kind='bundle', result_key=result_key, components=components, formats=tuple(formats),
+                         quantities=tuple(quantities), target_name=target_name, spectra_base=spectra_base,
+                         nn=nn, target=None if target_spec is None else rc.hash_inputs(*target_spec))
+    archive = rc.outputs_cache.get(key)
+    if archive is None:
+        archive = export.bundle_bytes(results, components, formats=formats, quantities=quantities,
+                                      target_name=target_name, target_spec=target_spec,
+                                      spectra_base=spectra_base, nn=nn)
+        rc.outputs_cache.put(key, archive)
+    return archive
+
+def my_export_bundle_button(
+    results: Dict[str, Any],
+    result_key: str,
+    components: List[export.Component],
+    base_name: str,
+    target_name: str,
+    target_spec: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    nn: Optional[int] = None
+) -> None:
+    """Export options and a download button for a zip archive of all outputs.
+
+    The archive is only built when the button is clicked (and then cached).
+    """
+    with st.expander("Download all outputs as one zip archive"):
+        c1, c2 = st.columns(2)
+        with c1:
+            formats = st.multiselect("Formats", export.FORMATS, default=export.FORMATS,
+                                     format_func={'at2': '.AT2 (acceleration)', '2col': '2-column (Time, Value)',
+                                                  '1col': '1-column (Value)'}.get)
+        with c2:
+            quantities = st.multiselect("Time series", export.QUANTITIES, default=export.QUANTITIES,
+                                        format_func={'acc': 'Acceleration', 'vel': 'Velocity',
+                                                     'disp': 'Displacement'}.get)
+        with_spectra = st.checkbox("Include the response spectra table", value=True)
+        st.download_button(
+            "Download zip archive",
+            lambda: my_export_bundle(results, result_key, components, tuple(formats), tuple(quantities),
+                                     target_name, target_spec, base_name if with_spectra else None, nn),
+            file_name=f"{base_name}_Matched.zip", mime="application/zip",
+            disabled=not (formats and quantities) and not with_spectra)
+
 @st.fragment
 def callATSave(outputfile_1,outputfile_2, at2_filepath1,at2_filepath2): 
     sc1,sc2=st.columns(2)
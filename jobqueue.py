@@ -0,0 +1,450 @@
+"""
+Local job queue and worker pool for matching runs.
+
+The pages submit matching runs (helperfunctions.my_REQPY_single /
+my_REQPYrotdnn) to a queue kept in a SQLite database, and a pool of worker
+threads runs them, so at most REQPY_WORKERS matching runs use the CPU at a
+time however many sessions submit work. A job is identified by the cache key
+of its inputs: a second submission of the same inputs - from another
+session, or from the same user after a browser reconnect - attaches to the
+queued, running or finished job instead of starting another run.
+
+The queue directory (REQPY_QUEUE_DIR, default <tmp>/reqpy_queue) holds
+
+    jobs.sqlite         status, progress (misfit per iteration) and stage
+                        timings of every job
+    inputs/<key>.npz    input arrays of a job
+    results/<key>.npz   results of the finished jobs
+
+Because all state is in files, the pages poll a job the same way whether it
+runs in a thread of the Streamlit server or in a separate worker process:
+
+    python jobqueue.py work [--workers 2] [--queue DIR]
+    python jobqueue.py status [--queue DIR]
+    python jobqueue.py purge [--days 7] [--queue DIR]
+
+With REQPY_WORKERS=0 the server runs no workers and only separate worker
+processes execute the queue. A job left 'running' by a worker that stopped
+(no progress for STALE_AFTER seconds) is picked up again by the next worker.
+Finished jobs are purged REQPY_QUEUE_RETENTION_DAYS (default 7, 0: never)
+after they finished, checked at most every PURGE_EVERY seconds when a job is
+submitted or claimed.
+"""
+
+from typing import Optional, Dict, Any, List, Tuple, Iterator
+import argparse
+import contextlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import resultcache as rc
+from profiling import StageTimer
+
+log = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+ACTIVE = (QUEUED, RUNNING)
+KINDS = ('my_REQPY_single', 'my_REQPYrotdnn', 'my_REQPY_sweep') # Matching functions of helperfunctions a job may run
+STALE_AFTER = 900.0 # s without progress after which a running job is re-queued
+PURGE_EVERY = 3600.0 # s between purges of the finished jobs past the retention
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    nit INTEGER NOT NULL,
+    peak_bytes INTEGER NOT NULL DEFAULT 0,
+    memory INTEGER NOT NULL DEFAULT 0,
+    owner TEXT NOT NULL DEFAULT '',
+    worker TEXT,
+    submitted REAL NOT NULL,
+    started REAL,
+    heartbeat REAL,
+    finished REAL,
+    history TEXT NOT NULL DEFAULT '[]',
+    stages TEXT NOT NULL DEFAULT '[]',
+    error TEXT,
+    cancel INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+
+class Job:
+    """Snapshot of a queued job (one row of the jobs table)."""
+
+    def __init__(self, row: sqlite3.Row):
+        self.key: str = row['key']
+        self.kind: str = row['kind']
+        self.status: str = row['status']
+        self.nit: int = row['nit']
+        self.peak_bytes: int = row['peak_bytes']
+        self.memory = bool(row['memory'])
+        self.owner: str = row['owner']
+        self.submitted: float = row['submitted']
+        self.started: Optional[float] = row['started']
+        self.finished: Optional[float] = row['finished']
+        self.history: List[Tuple[int, float, float]] = [tuple(h) for h in json.loads(row['history'])]
+        self.stages: List[Dict[str, Any]] = json.loads(row['stages']) # StageTimer records of the run
+        self.error: Optional[str] = row['error']
+
+    @property
+    def done(self) -> bool:
+        return self.status not in ACTIVE
+
+    @property
+    def progress(self) -> float:
+        """Fraction of the iterations completed (iteration 0 included)."""
+        return min(1.0, len(self.history) / (self.nit + 1))
+
+    @property
+    def elapsed(self) -> float:
+        """Run time so far (s); 0 while queued."""
+        if self.started is None:
+            return 0.0
+        end = self.finished if self.finished is not None else time.time()
+        return end - self.started
+
+
+class JobQueue:
+    """SQLite-backed queue of matching jobs.
+
+    Parameters
+    ----------
+    path : str
+        Queue directory (created if needed).
+    retention : Optional[float], optional
+        Finished jobs are purged this many seconds after they finished (see
+        `purge`); checked when jobs are submitted or claimed. Default: kept
+        until purged explicitly.
+    """
+
+    def __init__(self, path: str, retention: Optional[float] = None):
+        self.path = path
+        self.retention = retention if retention else None
+        self._purged = 0.0 # Time of the last automatic purge
+        for sub in ('inputs', 'results'):
+            os.makedirs(os.path.join(path, sub), exist_ok=True)
+        self.db_path = os.path.join(path, 'jobs.sqlite')
+        # Results of finished jobs; the pages copy them into resultcache.results_cache
+        self.store = rc.ResultCache(max_entries=4, disk_dir=os.path.join(path, 'results'), name='queue')
+        self.wakeup = threading.Event() # Set on submit, so idle workers of this process start at once
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Autocommit connection, closed on exit (every call opens its own, so threads never share one)."""
+        db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def _inputs_path(self, key: str) -> str:
+        return os.path.join(self.path, 'inputs', f"{key}.npz")
+
+    def submit(
+        self,
+        key: str,
+        kind: str,
+        kwargs: Dict[str, Any],
+        owner: str = '',
+        memory: bool = False,
+        peak_bytes: int = 0,
+        steps: Optional[int] = None
+    ) -> Job:
+        """Queues a matching run, or returns the job already queued, running or done for `key`.
+
+        Parameters
+        ----------
+        key : str
+            Cache key of the run (my_single_key / my_rotdnn_key).
+        kind : str
+            Name of the matching function, one of KINDS.
+        kwargs : Dict[str, Any]
+            Arguments of the matching function: arrays and scalars.
+        owner : str, optional
+            Id of the submitting session (for its memory budget).
+        memory : bool, optional
+            Record the peak memory of the matching stages.
+        peak_bytes : int, optional
+            Estimated peak memory of the run.
+        steps : Optional[int], optional
+            Last progress step the run reports (default: kwargs['nit']; a
+            sweep reports the iterations of all its combinations).
+        """
+        if kind not in KINDS:
+            raise ValueError(f"Unknown job kind '{kind}'. Use one of {KINDS}.")
+        self._purge_expired()
+        job = self.get(key)
+        if job is not None and (job.status in ACTIVE or (job.status == DONE and key in self.store)):
+            return job
+        arrays = {k: v for k, v in kwargs.items() if isinstance(v, np.ndarray)}
+        params = {k: (v.item() if isinstance(v, np.generic) else v) for k, v in kwargs.items() if k not in arrays}
+        tmp_path = f"{self._inputs_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as fp:
+            np.savez(fp, **arrays)
+        os.replace(tmp_path, self._inputs_path(key))
+        nit = kwargs['nit'] if steps is None else steps
+        with self._connect() as db:
+            db.execute('INSERT OR REPLACE INTO jobs (key, kind, status, params, nit, peak_bytes, memory, owner, '
+                       'submitted) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                       (key, kind, QUEUED, json.dumps(params), int(nit), int(peak_bytes), int(memory),
+                        owner, time.time()))
+        log.info(f"Queued {kind} job {key[:12]}")
+        self.wakeup.set()
+        return self.get(key)
+
+    def get(self, key: str) -> Optional[Job]:
+        """The job of `key`, or None if it was never submitted."""
+        with self._connect() as db:
+            row = db.execute('SELECT * FROM jobs WHERE key = ?', (key,)).fetchone()
+        return Job(row) if row is not None else None
+
+    def jobs(self, owner: Optional[str] = None, statuses: Tuple[str, ...] = ()) -> List[Job]:
+        """Jobs in submission order, optionally of one owner and/or with the given statuses."""
+        query, args = 'SELECT * FROM jobs WHERE 1', []
+        if owner is not None:
+            query += ' AND owner = ?'
+            args.append(owner)
+        if statuses:
+            query += f" AND status IN ({','.join('?' * len(statuses))})"
+            args += list(statuses)
+        with self._connect() as db:
+            return [Job(row) for row in db.execute(query + ' ORDER BY submitted', args)]
+
+    def position(self, key: str) -> int:
+        """Number of queued jobs ahead of a queued job."""
+        with self._connect() as db:
+            return db.execute("SELECT COUNT(*) FROM jobs WHERE status = ? AND submitted < "
+                              "(SELECT submitted FROM jobs WHERE key = ?)", (QUEUED, key)).fetchone()[0]
+
+    def cancel(self, key: str) -> None:
+        """Cancels a queued job, or asks its worker to stop a running one after the current iteration."""
+        with self._connect() as db:
+            db.execute('UPDATE jobs SET status = ?, finished = ? WHERE key = ? AND status = ?',
+                       (CANCELLED, time.time(), key, QUEUED))
+            db.execute('UPDATE jobs SET cancel = 1 WHERE key = ? AND status = ?', (key, RUNNING))
+
+    def cancel_requested(self, key: str) -> bool:
+        with self._connect() as db:
+            row = db.execute('SELECT cancel FROM jobs WHERE key = ?', (key,)).fetchone()
+        return row is not None and bool(row['cancel'])
+
+    def claim(self, worker: str) -> Optional[Job]:
+        """Marks the oldest queued (or stale running) job as running by `worker` and returns it."""
+        self._purge_expired()
+        now = time.time()
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE') # One claimer at a time, across processes
+            try:
+                row = db.execute('SELECT key FROM jobs WHERE status = ? OR (status = ? AND heartbeat < ?) '
+                                 'ORDER BY submitted LIMIT 1', (QUEUED, RUNNING, now - STALE_AFTER)).fetchone()
+                if row is not None:
+                    db.execute("UPDATE jobs SET status = ?, worker = ?, started = ?, heartbeat = ?, history = '[]', "
+                               "cancel = 0 WHERE key = ?", (RUNNING, worker, now, now, row['key']))
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+        return self.get(row['key']) if row is not None else None
+
+    def inputs(self, key: str) -> Dict[str, Any]:
+        """Arguments of the matching function of a job."""
+        with self._connect() as db:
+            params = json.loads(db.execute('SELECT params FROM jobs WHERE key = ?', (key,)).fetchone()['params'])
+        with np.load(self._inputs_path(key), allow_pickle=False) as data:
+            return {**params, **{k: data[k] for k in data.files}}
+
+    def report(self, key: str, history: List[Tuple[int, float, float]]) -> None:
+        """Records the misfit history of a running job (also its heartbeat)."""
+        with self._connect() as db:
+            db.execute('UPDATE jobs SET history = ?, heartbeat = ? WHERE key = ?',
+                       (json.dumps(history), time.time(), key))
+
+    def finish(self, key: str, status: str, error: Optional[str] = None,
+               stages: Optional[List[Dict[str, Any]]] = None) -> None:
+        with self._connect() as db:
+            db.execute('UPDATE jobs SET status = ?, error = ?, stages = ?, finished = ? WHERE key = ?',
+                       (status, error, json.dumps(stages or []), time.time(), key))
+        try:
+            os.remove(self._inputs_path(key))
+        except OSError:
+            pass
+
+    def results(self, key: str) -> Optional[Dict[str, Any]]:
+        """Results of a finished job, or None."""
+        return self.store.get(key)
+
+    def purge(self, older_than: float) -> int:
+        """Deletes the finished jobs (and their results) finished more than `older_than` s ago."""
+        cutoff = time.time() - older_than
+        with self._connect() as db:
+            keys = [r['key'] for r in db.execute('SELECT key FROM jobs WHERE status NOT IN (?, ?) AND finished < ?',
+                                                 (*ACTIVE, cutoff))]
+            db.executemany('DELETE FROM jobs WHERE key = ?', [(k,) for k in keys])
+        for key in keys:
+            for path in (self._inputs_path(key), os.path.join(self.path, 'results', f"{key}.npz")):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass # Never written, or removed by a concurrent purge
+        return len(keys)
+
+    def _purge_expired(self) -> None:
+        """Purges the jobs past the retention, at most once every PURGE_EVERY s per queue object."""
+        now = time.time()
+        if self.retention is None or now - self._purged < PURGE_EVERY:
+            return
+        self._purged = now
+        purged = self.purge(self.retention)
+        if purged:
+            log.info(f"Purged {purged} jobs finished more than {self.retention / 86400:g} days ago")
+
+
+def run_job(queue: JobQueue, job: Job) -> str:
+    """Runs a claimed job, recording its progress, results and status in `queue`."""
+    import helperfunctions as hf # Imported here: helperfunctions imports this module
+    from matching import MatchingCancelled
+
+    func = getattr(hf, job.kind)
+    history: List[Tuple[int, float, float]] = []
+
+    def callback(m: int, nit: int, rmse: float, meane: float) -> bool:
+        history.append((m, float(rmse), float(meane)))
+        queue.report(job.key, history)
+        return not queue.cancel_requested(job.key)
+
+    timer = StageTimer(memory=job.memory)
+    error = None
+    try:
+        func(**queue.inputs(job.key), cache=queue.store, callback=callback, timer=timer)
+        status = DONE
+    except MatchingCancelled:
+        status = CANCELLED
+    except Exception as e:
+        log.exception(f"Matching job {job.key[:12]} failed")
+        status, error = FAILED, f"{type(e).__name__}: {e}"
+    queue.finish(job.key, status, error, timer.records)
+    log.info(f"Job {job.key[:12]} {status}")
+    return status
+
+
+class WorkerPool:
+    """Worker threads executing the jobs of a queue, one job per worker at a time.
+
+    Parameters
+    ----------
+    queue : JobQueue
+        Queue to execute.
+    workers : int, optional
+        Number of worker threads. Default is 1.
+    poll : float, optional
+        Seconds between checks of an idle worker for jobs submitted by other
+        processes. Default is 0.5.
+    """
+
+    def __init__(self, queue: JobQueue, workers: int = 1, poll: float = 0.5):
+        self.queue = queue
+        self.poll = poll
+        self._stop = threading.Event()
+        self._threads = [threading.Thread(target=self._loop, name=f"reqpy-worker-{i}", daemon=True)
+                         for i in range(workers)]
+
+    def start(self) -> "WorkerPool":
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stops the workers once their current jobs are finished."""
+        self._stop.set()
+        self.queue.wakeup.set()
+
+    def join(self) -> None:
+        for thread in self._threads:
+            thread.join()
+
+    def _loop(self) -> None:
+        name = f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+        while not self._stop.is_set():
+            job = self.queue.claim(name)
+            if job is None:
+                self.queue.wakeup.wait(self.poll)
+                self.queue.wakeup.clear()
+                continue
+            run_job(self.queue, job)
+
+
+_default: Optional[Tuple[JobQueue, Optional[WorkerPool]]] = None
+_default_lock = threading.Lock()
+
+
+def _retention() -> float:
+    """Retention of the finished jobs (s) from REQPY_QUEUE_RETENTION_DAYS (default 7; 0: no automatic purge)."""
+    return float(os.environ.get('REQPY_QUEUE_RETENTION_DAYS', 7)) * 86400
+
+
+def default_queue() -> JobQueue:
+    """The queue in REQPY_QUEUE_DIR, with REQPY_WORKERS (default 1) worker threads in this process.
+
+    Created on first use and shared by all sessions of the server.
+    """
+    global _default
+    with _default_lock:
+        if _default is None:
+            queue = JobQueue(os.environ.get('REQPY_QUEUE_DIR') or os.path.join(tempfile.gettempdir(), 'reqpy_queue'),
+                             retention=_retention())
+            workers = int(os.environ.get('REQPY_WORKERS', 1))
+            _default = (queue, WorkerPool(queue, workers).start() if workers > 0 else None)
+        return _default[0]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Local job queue of matching runs.")
+    parser.add_argument('--queue', default=os.environ.get('REQPY_QUEUE_DIR') or
+                        os.path.join(tempfile.gettempdir(), 'reqpy_queue'),
+                        help="Queue directory (default: $REQPY_QUEUE_DIR or <tmp>/reqpy_queue)")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_work = sub.add_parser('work', help="Run worker threads executing the queue until interrupted")
+    p_work.add_argument('--workers', type=int, default=1, help="Number of worker threads")
+    sub.add_parser('status', help="List the jobs of the queue")
+    p_purge = sub.add_parser('purge', help="Delete finished jobs and their results")
+    p_purge.add_argument('--days', type=float, default=7.0, help="Only jobs finished more than DAYS ago")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    import streamlit.logger
+    streamlit.logger.set_log_level('error') # Caching outside the Streamlit runtime is expected here
+
+    queue = JobQueue(args.queue, retention=_retention() if args.command == 'work' else None)
+    if args.command == 'work':
+        pool = WorkerPool(queue, args.workers).start()
+        print(f"{args.workers} worker(s) executing {args.queue}; Ctrl+C to stop.")
+        try:
+            pool.join()
+        except KeyboardInterrupt:
+            pool.stop()
+        return 0
+    if args.command == 'purge':
+        print(f"Deleted {queue.purge(args.days * 86400)} finished jobs.")
+        return 0
+    print(f"{'key':<14} {'kind':<16} {'status':<10} {'iteration':>9} {'RMSE %':>7} {'time s':>7}")
+    for job in queue.jobs():
+        m, rmse = (job.history[-1][0], f"{job.history[-1][1]:.2f}") if job.history else ('-', '-')
+        print(f"{job.key[:12]:<14} {job.kind:<16} {job.status:<10} {m:>9} {rmse:>7} {job.elapsed:>7.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
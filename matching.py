@@ -0,0 +1,660 @@
+"""
+Spectral matching driver with per-iteration progress reporting.
+
+Runs the same CWT-based algorithm as reqpy_M.REQPY_single / REQPYrotdnn
+(same decomposition, scaling, update rule, best-iteration selection and
+baseline correction, built from the reqpy_M building blocks), but calls a
+user supplied callback after every iteration with the current misfit. The
+callback can cancel the run by returning False, in which case
+MatchingCancelled is raised. Response spectra are computed with the batched
+engine in spectra.py, which reproduces reqpy_M.compute_spectrum and
+compute_rotated_spectra.
+
+Only the best iteration so far is kept instead of the full history of
+matched signals, so memory does not grow with the number of iterations.
+
+Optionally the iterations stop early once the misfit within [T1, T2] is
+below a tolerance (`tol` for the RMSE, `mean_tol` for the mean misfit) or
+the best RMSE has not improved by more than `delta` for `patience`
+consecutive iterations. The best iterate so far is always the one returned;
+'nit_used' and 'best_it' in the results report the iterations run and the
+iteration selected. With the defaults all `nit` iterations are run, as in
+reqpy_M.
+
+The detail functions are built one scale at a time, without the full matrix
+of wavelet coefficients that reqpy_M keeps next to them, and are updated in
+place. With `low_memory=True` they are stored in single precision and the
+response spectra are computed in smaller blocks of oscillators, which
+roughly halves the peak memory of a run again (see `estimate_peak_bytes`);
+the matched records and spectra stay double precision.
+
+The decomposition of the seed only depends on the record(s) and the CWT
+frequency range, not on the target or the damping ratio. `match_sweep`
+matches one seed to several (target, damping ratio) combinations: it
+decomposes the seed once (`decompose_seed`) and runs the combinations in
+parallel threads, each on its own copy of the detail functions.
+"""
+
+from typing import Callable, Optional, Dict, Any, Tuple, List, Sequence, ContextManager
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import logging
+import os
+import threading
+import warnings
+import numpy as np
+from scipy import integrate, signal
+import reqpy_M
+import spectra
+from profiling import StageTimer
+
+log = logging.getLogger(__name__)
+
+# The driver is built on private reqpy_M helpers and constants, which a new
+# release may change or remove. It was checked against this release: its
+# results reproduce REQPY_single / REQPYrotdnn (tests/test_matching.py).
+REQPY_M_VERSION = '0.3.0'
+try:
+    from reqpy_M import baselinecorrect, _zumontw, _CheckPeriodRange
+except ImportError as e:
+    raise ImportError(f"matching.py needs the reqpy_M helpers of release {REQPY_M_VERSION} "
+                      f"(installed: {getattr(reqpy_M, '__version__', 'unknown')}): {e}") from e
+if getattr(reqpy_M, '__version__', None) != REQPY_M_VERSION:
+    log.warning("reqpy_M %s is installed; matching.py was checked against %s. Run tests/test_matching.py "
+                "to verify that it still reproduces REQPY_single / REQPYrotdnn.",
+                getattr(reqpy_M, '__version__', 'unknown'), REQPY_M_VERSION)
+
+# callback(iteration, nit, rmse, meane); returning False cancels the run
+ProgressCallback = Callable[[int, int, float, float], Optional[bool]]
+
+_OMEGA, _ZETA = np.pi, 0.05 # Suarez-Montejo wavelet parameters of reqpy_M
+_K_PSI = 3.18242642 # Reconstruction constant of that wavelet (as reqpy_M._getdetails)
+
+# Full-length float64 arrays of a run besides the details, per component
+# (seed, reconstruction, best iterate, baseline-corrected acc/vel/disp...)
+_SERIES_PER_COMPONENT = 10
+
+# Oscillators per frequency-domain block of the response spectra
+_SPECTRA_CHUNK, _LOW_MEMORY_SPECTRA_CHUNK = 64, 8
+
+
+class MatchingCancelled(Exception):
+    """Raised when the progress callback asks to stop a matching run."""
+
+
+def _misfit(psa: np.ndarray, ds: np.ndarray, Tlocs: np.ndarray) -> Tuple[float, float]:
+    """Returns (rmse, meane) in % over the matching range."""
+    diff = np.abs(psa[Tlocs] - ds[Tlocs]) / ds[Tlocs]
+    return np.linalg.norm(diff) / np.sqrt(len(Tlocs)) * 100, np.mean(diff) * 100
+
+
+class _Convergence:
+    """Tracks the best iterate and decides when to stop early."""
+
+    def __init__(self, tol: float, mean_tol: float, delta: float, patience: int):
+        self.tol, self.mean_tol, self.delta, self.patience = tol, mean_tol, delta, patience
+        self.best_rmse = np.inf
+        self.best_it = 0
+        self.stalled = 0
+
+    def update(self, m: int, rmse: float) -> bool:
+        """Records iteration m; returns True if it is the best so far."""
+        self.stalled = 0 if rmse < self.best_rmse - self.delta else self.stalled + 1
+        if rmse < self.best_rmse:
+            self.best_rmse, self.best_it = rmse, m
+            return True
+        return False
+
+    def stop_reason(self, rmse: float, meane: float) -> Optional[str]:
+        if self.tol > 0 and rmse <= self.tol:
+            return f"RMSE {rmse:.2f}% <= {self.tol:g}%"
+        if self.mean_tol > 0 and meane <= self.mean_tol:
+            return f"mean misfit {meane:.2f}% <= {self.mean_tol:g}%"
+        if self.patience > 0 and self.stalled >= self.patience:
+            return f"RMSE improved by less than {self.delta:g}% in {self.patience} iterations"
+        return None
+
+
+def _stage(timer: Optional[StageTimer], name: str) -> ContextManager:
+    return timer.stage(name) if timer is not None else contextlib.nullcontext()
+
+
+def _report(callback: Optional[ProgressCallback], m: int, nit: int, rmse: float, meane: float) -> None:
+    log.info("Iteration %d: RMSE=%.2f%%, Misfit=%.2f%%", m, rmse, meane)
+    if callback is not None and callback(m, nit, rmse, meane) is False:
+        log.info("Matching cancelled at iteration %d.", m)
+        raise MatchingCancelled(f"Matching cancelled at iteration {m} of {nit}")
+
+
+def estimate_peak_bytes(n: int, dt: float, ncomp: int = 1, NS: int = 100, low_memory: bool = False) -> int:
+    """Estimated peak memory (bytes) of a matching run.
+
+    Parameters
+    ----------
+    n : int
+        Number of points of the seed record(s).
+    dt : float
+        Time step (s).
+    ncomp : int, optional
+        Number of components (1 for match_single, 2 for match_rotdnn).
+    NS : int, optional
+        Number of wavelet scales.
+    low_memory : bool, optional
+        Single-precision detail functions.
+    """
+    details = NS * n * (4 if low_memory else 8)
+    # Padded FFT length of the spectra: 10 x the longest period, as in spectra._fd_padding
+    Tmax = max(n * dt / 4, 10.0)
+    nfft = 2 ** int(np.ceil(np.log2(n + 10 * Tmax / dt)))
+    chunk = _LOW_MEMORY_SPECTRA_CHUNK if low_memory else _SPECTRA_CHUNK // ncomp
+    spectra_blocks = ncomp * min(chunk, NS) * nfft * 32 # Displacements and complex work arrays
+    rotation = n * 180 * 16 if ncomp > 1 else 0 # Projection on the rotation angles
+    return ncomp * (details + _SERIES_PER_COMPONENT * 8 * n) + spectra_blocks + rotation
+
+
+def sweep_workers(ncases: int, workers: Optional[int] = None) -> int:
+    """Number of combinations `match_sweep` runs at a time (default: one per CPU)."""
+    return max(1, min(ncases, workers or os.cpu_count() or 1))
+
+
+def estimate_sweep_bytes(
+    n: int,
+    dt: float,
+    ncases: int,
+    ncomp: int = 1,
+    NS: int = 100,
+    low_memory: bool = False,
+    workers: Optional[int] = None
+) -> int:
+    """Estimated peak memory (bytes) of `match_sweep`.
+
+    The shared decomposition, plus one matching run (with its own copy of
+    the details) per combination running at the same time.
+    """
+    shared = ncomp * NS * n * (4 if low_memory else 8)
+    return shared + sweep_workers(ncases, workers) * estimate_peak_bytes(n, dt, ncomp, NS, low_memory)
+
+
+def _details(
+    s: np.ndarray,
+    t: np.ndarray,
+    scales: np.ndarray,
+    dtype: type = np.float64
+) -> np.ndarray:
+    """Detail functions D(scale, time) of a record (as reqpy_M._cwtzm + _getdetails).
+
+    The wavelet coefficients of each scale are convolved back right away, so
+    only one row of coefficients is held at a time.
+    """
+    dt = t[1] - t[0]
+    centertime = np.median(t)
+    D = np.empty((len(scales), len(s)), dtype=dtype)
+    for k, scale in enumerate(scales):
+        wv = _zumontw((t - centertime) / scale, _OMEGA, _ZETA)
+        coefs = signal.fftconvolve(s, wv / np.sqrt(scale), mode='same') * dt
+        D[k] = signal.fftconvolve(coefs, wv, mode='same') * (-dt / (_K_PSI * scale ** 2.5))
+    return D
+
+
+def _trapz_weights(x: np.ndarray) -> np.ndarray:
+    """Weights w such that w @ y == trapezoid(y, x, axis=0)."""
+    w = np.zeros(len(x))
+    dx = np.diff(x)
+    w[:-1] += dx / 2
+    w[1:] += dx / 2
+    return w
+
+
+def _reconstruct(D: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Integral of the details over the scales, in double precision."""
+    return np.asarray(weights.astype(D.dtype) @ D, dtype=float)
+
+
+def _period_range(n: int, dt: float, To: np.ndarray, T1: float, T2: float) -> Tuple[float, float, float]:
+    """Matching range (T1, T2) and lowest CWT frequency FF1 (as reqpy_M), `To` sorted."""
+    return _CheckPeriodRange(T1, T2, To, min(4 / (n * dt), 0.1), 1 / (2 * dt))
+
+
+def decompose_seed(
+    records: Tuple[np.ndarray, ...],
+    fs: float,
+    FF1: float,
+    NS: int = 100,
+    low_memory: bool = False
+) -> Dict[str, Any]:
+    """CWT decomposition of the seed record(s) from the Nyquist frequency down to FF1 (Hz).
+
+    Returns
+    -------
+    Dict[str, Any]
+        't', 'dt', 'T' (periods of the scales), 'weights' (of the integral
+        over the scales), 'details' ([(D, reconstruction)] per record) and
+        the parameters 'n', 'FF1', 'NS' and 'low_memory'.
+    """
+    n = np.size(records[0])
+    dt = 1 / fs
+    t = np.linspace(0, (n - 1) * dt, n)
+    freqs = np.geomspace(1 / (2 * dt), FF1, NS)
+    scales = _OMEGA / (2 * np.pi * freqs)
+    weights = _trapz_weights(scales)
+    details = []
+    for s in records:
+        D = _details(s, t, scales, np.float32 if low_memory else np.float64)
+        details.append((D, _reconstruct(D, weights)))
+    log.info("Wavelet decomposition performed.")
+    return {'t': t, 'dt': dt, 'T': 1 / freqs, 'weights': weights, 'details': details,
+            'n': n, 'FF1': FF1, 'NS': NS, 'low_memory': low_memory}
+
+
+def _decompose(
+    records: Tuple[np.ndarray, ...],
+    fs: float,
+    dso: np.ndarray,
+    To: np.ndarray,
+    T1: float,
+    T2: float,
+    NS: int,
+    low_memory: bool = False,
+    seed: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """CWT decomposition of the seed record(s) and target interpolation.
+
+    A matching `seed` decomposition (`decompose_seed`) is reused: its
+    details are copied, as the iterations update them in place.
+    """
+    n = np.size(records[0])
+    order = np.argsort(To)
+    To = np.asarray(To)[order]; dso = np.asarray(dso)[order]
+    T1, T2, FF1 = _period_range(n, 1 / fs, To, T1, T2)
+
+    if seed is not None and (seed['n'], seed['FF1'], seed['NS'], seed['low_memory']) == (n, FF1, NS, low_memory):
+        dec = dict(seed, details=[(D.copy(), sr) for D, sr in seed['details']])
+    else:
+        dec = decompose_seed(records, fs, FF1, NS, low_memory)
+
+    ds = np.interp(dec['T'], To, dso, left=np.nan, right=np.nan)
+    Tlocs = np.where((dec['T'] >= T1) & (dec['T'] <= T2))[0]
+    if len(Tlocs) == 0:
+        raise ValueError("No target spectrum points found within the specified matching range.")
+    dec.update(ds=ds, Tlocs=Tlocs)
+    return dec
+
+
+def match_single(
+    s: np.ndarray,
+    fs: float,
+    dso: np.ndarray,
+    To: np.ndarray,
+    T1: float = 0.0,
+    T2: float = 0.0,
+    zi: float = 0.05,
+    nit: int = 30,
+    NS: int = 100,
+    baseline: bool = True,
+    porder: int = -1,
+    callback: Optional[ProgressCallback] = None,
+    tol: float = 0.0,
+    mean_tol: float = 0.0,
+    delta: float = 0.0,
+    patience: int = 0,
+    timer: Optional[StageTimer] = None,
+    low_memory: bool = False,
+    seed: Optional[Dict[str, Any]] = None,
+    warm: Optional[np.ndarray] = None
+) -> Dict[str, Any]:
+    """Matches a single component to a target spectrum (as REQPY_single).
+
+    Parameters
+    ----------
+    s, fs, dso, To, T1, T2, zi, nit, NS, baseline, porder
+        As for reqpy_M.REQPY_single.
+    callback : Optional[ProgressCallback], optional
+        Called as callback(iteration, nit, rmse, meane) after iteration 0
+        (the scaled seed) and after every matching iteration. Returning False
+        cancels the run.
+    tol, mean_tol : float, optional
+        Stop once the RMSE / mean misfit (%) is at or below this value.
+        Default is 0 (off).
+    delta : float, optional
+        Minimum decrease of the best RMSE (% points) that counts as an
+        improvement. Default is 0.
+    patience : int, optional
+        Stop after this many iterations without an improvement. Default is
+        0 (off).
+    timer : Optional[StageTimer], optional
+        If given, the decomposition, iterations and baseline correction are
+        recorded as stages.
+    low_memory : bool, optional
+        Store the detail functions in single precision (half the memory; the
+        misfits agree with the double precision run to about 1e-4 % points).
+    seed : Optional[Dict[str, Any]], optional
+        Decomposition of the seed record(s) from `decompose_seed`. Used
+        instead of decomposing again if it was made with the same CWT
+        frequency range, number of scales and precision.
+    warm : Optional[np.ndarray], optional
+        Matched record of an earlier run of the same seed (results['ccs']).
+        The iterations start from it instead of from the scaled seed; `s`
+        still gives the seed spectrum and scale factor of the results.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The same results dictionary as REQPY_single, plus 'nit_used' (the
+        number of iterations run) and 'best_it' (the iteration returned).
+
+    Raises
+    ------
+    MatchingCancelled
+        If the callback returned False.
+    """
+    if warm is not None and np.size(warm) != np.size(s):
+        raise ValueError(f"The warm start record has {np.size(warm)} points, the seed {np.size(s)}.")
+    with _stage(timer, 'decomposition'):
+        if warm is None:
+            dec = _decompose((s,), fs, dso, To, T1, T2, NS, low_memory, seed)
+        else:
+            dec = _decompose((warm,), fs, dso, To, T1, T2, NS, low_memory)
+        t, dt, T, weights, ds, Tlocs = dec['t'], dec['dt'], dec['T'], dec['weights'], dec['ds'], dec['Tlocs']
+        D, sr = dec['details'][0]
+
+        chunk = _LOW_MEMORY_SPECTRA_CHUNK if low_memory else _SPECTRA_CHUNK
+        PSAs = spectra.response_spectra(T, s, dt, zi, chunk_size=chunk)[0]
+        PSAsr = spectra.response_spectra(T, sr, dt, zi, chunk_size=chunk)[0]
+        sf = np.sum(ds[Tlocs]) / np.sum(PSAs[Tlocs])
+        log.info("Initial scaling factor: %.4f", sf)
+        scale = sf if warm is None else 1.0 # A warm start record is already scaled
+        sr = scale * sr; D *= scale
+
+    with _stage(timer, 'iterations'):
+        conv = _Convergence(tol, mean_tol, delta, patience)
+        PSA = scale * PSAsr
+        sc = sr
+        factor = np.ones(NS)
+        for m in range(nit + 1):
+            if m > 0:
+                factor[Tlocs] = ds[Tlocs] / PSA[Tlocs]
+                D *= factor[:, np.newaxis]
+                sc = _reconstruct(D, weights)
+                PSA = spectra.response_spectra(T, sc, dt, zi, chunk_size=chunk)[0]
+            rmse, meane = _misfit(PSA, ds, Tlocs)
+            if conv.update(m, rmse) or m == 0: # Kept even if the misfit is not finite
+                best = (rmse, meane, sc, PSA)
+            _report(callback, m, nit, rmse, meane)
+            reason = conv.stop_reason(rmse, meane)
+            if reason:
+                log.info("Stopping early at iteration %d: %s.", m, reason)
+                break
+
+    rmsefin, meanefin, sc, PSAbest = best
+    with _stage(timer, 'baseline correction'):
+        if baseline:
+            ccs, cvel, cdespl = baselinecorrect(sc, t, porder=porder)
+            PSAccs = spectra.response_spectra(T, ccs, dt, zi, chunk_size=chunk)[0]
+            log.info("After Baseline Correction: RMSE=%.2f%%, Misfit=%.2f%%", *_misfit(PSAccs, ds, Tlocs))
+        else:
+            ccs = sc
+            cvel = integrate.cumulative_trapezoid(ccs, x=t, initial=0)
+            cdespl = integrate.cumulative_trapezoid(cvel, x=t, initial=0)
+            PSAccs = PSAbest
+    log.info("Matching finished after %d of %d iterations (best: %d). Final RMSE: %.2f%%, Misfit: %.2f%%",
+             m, nit, conv.best_it, rmsefin, meanefin)
+
+    return {'ccs': ccs, 'rmsefin': rmsefin, 'meanefin': meanefin,
+            'cvel': cvel, 'cdespl': cdespl, 'PSAccs': PSAccs, 'PSAs': PSAs,
+            'T': T, 'sf': sf, 'dt': dt, 'nit_used': m, 'best_it': conv.best_it}
+
+
+def match_rotdnn(
+    s1: np.ndarray,
+    s2: np.ndarray,
+    fs: float,
+    dso: np.ndarray,
+    To: np.ndarray,
+    nn: int,
+    T1: float = 0.0,
+    T2: float = 0.0,
+    zi: float = 0.05,
+    nit: int = 15,
+    NS: int = 100,
+    baseline: bool = True,
+    porder: int = -1,
+    callback: Optional[ProgressCallback] = None,
+    tol: float = 0.0,
+    mean_tol: float = 0.0,
+    delta: float = 0.0,
+    patience: int = 0,
+    timer: Optional[StageTimer] = None,
+    low_memory: bool = False,
+    seed: Optional[Dict[str, Any]] = None,
+    warm: Optional[Tuple[np.ndarray, np.ndarray]] = None
+) -> Dict[str, Any]:
+    """Matches a horizontal pair to a RotDnn target spectrum (as REQPYrotdnn).
+
+    Parameters
+    ----------
+    s1, s2, fs, dso, To, nn, T1, T2, zi, nit, NS, baseline, porder
+        As for reqpy_M.REQPYrotdnn.
+    callback : Optional[ProgressCallback], optional
+        Called as callback(iteration, nit, rmse, meane) after iteration 0
+        (the scaled seeds) and after every matching iteration. Returning False
+        cancels the run.
+    tol, mean_tol : float, optional
+        Stop once the RMSE / mean misfit (%) is at or below this value.
+        Default is 0 (off).
+    delta : float, optional
+        Minimum decrease of the best RMSE (% points) that counts as an
+        improvement. Default is 0.
+    patience : int, optional
+        Stop after this many iterations without an improvement. Default is
+        0 (off).
+    timer : Optional[StageTimer], optional
+        If given, the decomposition, iterations and baseline correction are
+        recorded as stages.
+    low_memory : bool, optional
+        Store the detail functions in single precision (half the memory; the
+        misfits agree with the double precision run to about 1e-4 % points).
+    seed : Optional[Dict[str, Any]], optional
+        Decomposition of the seed record(s) from `decompose_seed`. Used
+        instead of decomposing again if it was made with the same CWT
+        frequency range, number of scales and precision.
+    warm : Optional[Tuple[np.ndarray, np.ndarray]], optional
+        Matched pair of an earlier run of the same seeds (results['scc1'],
+        results['scc2']). The iterations start from it instead of from the
+        scaled seeds; `s1` and `s2` still give the seed spectrum and scale
+        factor of the results.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The same results dictionary as REQPYrotdnn, plus 'nit_used' (the
+        number of iterations run) and 'best_it' (the iteration returned).
+
+    Raises
+    ------
+    MatchingCancelled
+        If the callback returned False.
+    """
+    n1, n2 = np.size(s1), np.size(s2); n = min(n1, n2)
+    if n1 != n2:
+        warnings.warn(f"Input records have different lengths ({n1} vs {n2}). Truncating to {n} points.")
+    s1 = s1[:n]; s2 = s2[:n]
+    if warm is not None and (np.size(warm[0]), np.size(warm[1])) != (n, n):
+        raise ValueError(f"The warm start records have {np.size(warm[0])} and {np.size(warm[1])} points, "
+                         f"the seeds {n}.")
+
+    with _stage(timer, 'decomposition'):
+        if warm is None:
+            dec = _decompose((s1, s2), fs, dso, To, T1, T2, NS, low_memory, seed)
+        else:
+            dec = _decompose(tuple(warm), fs, dso, To, T1, T2, NS, low_memory)
+        t, dt, T, weights, ds, Tlocs = dec['t'], dec['dt'], dec['T'], dec['weights'], dec['ds'], dec['Tlocs']
+        (D1, sr1), (D2, sr2) = dec['details']
+
+        chunk = _LOW_MEMORY_SPECTRA_CHUNK if low_memory else _SPECTRA_CHUNK // 2
+
+        def psa_rotnn(a1: np.ndarray, a2: np.ndarray) -> np.ndarray:
+            return spectra.rotdnn(spectra.rotated_spectra(T, a1, a2, dt, zi, chunk_size=chunk), nn)
+
+        PSArotnnor = psa_rotnn(s1, s2)
+        sf = np.sum(ds[Tlocs]) / np.sum(PSArotnnor[Tlocs])
+        log.info("Initial scaling factor: %.4f", sf)
+        scale = sf if warm is None else 1.0 # Warm start records are already scaled
+        sc1 = scale * sr1; D1 *= scale
+        sc2 = scale * sr2; D2 *= scale
+
+    with _stage(timer, 'iterations'):
+        conv = _Convergence(tol, mean_tol, delta, patience)
+        PSA = psa_rotnn(sc1, sc2)
+        factor = np.ones(NS)
+        for m in range(nit + 1):
+            if m > 0:
+                factor[Tlocs] = ds[Tlocs] / PSA[Tlocs]
+                D1 *= factor[:, np.newaxis]
+                D2 *= factor[:, np.newaxis]
+                sc1 = _reconstruct(D1, weights)
+                sc2 = _reconstruct(D2, weights)
+                PSA = psa_rotnn(sc1, sc2)
+            rmse, meane = _misfit(PSA, ds, Tlocs)
+            if conv.update(m, rmse) or m == 0: # Kept even if the misfit is not finite
+                best = (rmse, meane, sc1, sc2, PSA)
+            _report(callback, m, nit, rmse, meane)
+            reason = conv.stop_reason(rmse, meane)
+            if reason:
+                log.info("Stopping early at iteration %d: %s.", m, reason)
+                break
+
+    rmsefin, meanefin, sc1, sc2, PSAbest = best
+    with _stage(timer, 'baseline correction'):
+        if baseline:
+            scc1, cvel1, cdisp1 = baselinecorrect(sc1, t, porder=porder)
+            scc2, cvel2, cdisp2 = baselinecorrect(sc2, t, porder=porder)
+            PSArotnn = psa_rotnn(scc1, scc2)
+            log.info("After Baseline Correction: RMSE=%.2f%%, Misfit=%.2f%%", *_misfit(PSArotnn, ds, Tlocs))
+        else:
+            scc1, scc2 = sc1, sc2
+            cvel1 = integrate.cumulative_trapezoid(scc1, x=t, initial=0)
+            cdisp1 = integrate.cumulative_trapezoid(cvel1, x=t, initial=0)
+            cvel2 = integrate.cumulative_trapezoid(scc2, x=t, initial=0)
+            cdisp2 = integrate.cumulative_trapezoid(cvel2, x=t, initial=0)
+            PSArotnn = PSAbest
+    log.info("Matching finished after %d of %d iterations (best: %d). Final RMSE: %.2f%%, Misfit: %.2f%%",
+             m, nit, conv.best_it, rmsefin, meanefin)
+
+    return {'scc1': scc1, 'scc2': scc2, 'cvel1': cvel1, 'cvel2': cvel2,
+            'cdisp1': cdisp1, 'cdisp2': cdisp2, 'PSArotnn': PSArotnn,
+            'PSArotnnor': PSArotnnor, 'T': T, 'meanefin': meanefin,
+            'rmsefin': rmsefin, 'sf': sf, 'dt': dt, 'nit_used': m, 'best_it': conv.best_it}
+
+
+def match_sweep(
+    records: Tuple[np.ndarray, ...],
+    fs: float,
+    cases: Sequence[Tuple[np.ndarray, np.ndarray, float]],
+    nn: int = 100,
+    T1: float = 0.0,
+    T2: float = 0.0,
+    nit: int = 15,
+    NS: int = 100,
+    baseline: bool = True,
+    porder: int = -1,
+    callback: Optional[ProgressCallback] = None,
+    tol: float = 0.0,
+    mean_tol: float = 0.0,
+    delta: float = 0.0,
+    patience: int = 0,
+    timer: Optional[StageTimer] = None,
+    low_memory: bool = False,
+    workers: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """Matches one seed record (or pair) to several targets and damping ratios.
+
+    The seed is decomposed once (once per distinct CWT frequency range of
+    the targets, which is usually the same for all of them) and the
+    combinations run in parallel threads, each on its own copy of the
+    detail functions.
+
+    Parameters
+    ----------
+    records : Tuple[np.ndarray, ...]
+        (s,) for single component matching (as `match_single`) or (s1, s2)
+        for RotDnn matching (as `match_rotdnn`).
+    fs : float
+        Sampling frequency (Hz).
+    cases : Sequence[Tuple[np.ndarray, np.ndarray, float]]
+        (To, dso, zi) of each combination: target periods, target PSA and
+        damping ratio.
+    nn, T1, T2, nit, NS, baseline, porder, tol, mean_tol, delta, patience, low_memory
+        As for `match_single` / `match_rotdnn`, the same for all combinations.
+    callback : Optional[ProgressCallback], optional
+        Called as callback(step, steps, rmse, meane) after every iteration of
+        any combination, `step` counting the iterations of all combinations
+        (0 ... steps). Returning False cancels all combinations.
+    timer : Optional[StageTimer], optional
+        Records the decomposition and the combinations as stages.
+    workers : Optional[int], optional
+        Combinations run at the same time. Default: one per CPU.
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        The results dictionary of each combination, in the order of `cases`.
+
+    Raises
+    ------
+    MatchingCancelled
+        If the callback returned False.
+    """
+    n = min(np.size(r) for r in records)
+    if len(records) > 1 and len({np.size(r) for r in records}) > 1:
+        warnings.warn(f"Input records have different lengths ({np.size(records[0])} vs {np.size(records[1])}). "
+                      f"Truncating to {n} points.")
+    records = tuple(r[:n] for r in records)
+    dt = 1 / fs
+
+    with _stage(timer, 'decomposition'):
+        seeds: Dict[float, Dict[str, Any]] = {}
+        case_seeds = []
+        for To, dso, zi in cases:
+            FF1 = _period_range(n, dt, np.sort(To), T1, T2)[2]
+            if FF1 not in seeds:
+                seeds[FF1] = decompose_seed(records, fs, FF1, NS, low_memory)
+            case_seeds.append(seeds[FF1])
+    log.info("Sweep of %d combinations on %d decomposition(s) of the seed.", len(cases), len(seeds))
+
+    steps = len(cases) * (nit + 1) - 1
+    lock = threading.Lock()
+    cancelled = threading.Event()
+    reported = [0]
+
+    def progress(m: int, nit: int, rmse: float, meane: float) -> bool:
+        if cancelled.is_set():
+            return False
+        with lock:
+            step = reported[0]
+            reported[0] += 1
+        if callback is not None and callback(step, steps, rmse, meane) is False:
+            cancelled.set()
+            return False
+        return True
+
+    def run(case: Tuple[np.ndarray, np.ndarray, float], seed: Dict[str, Any]) -> Dict[str, Any]:
+        To, dso, zi = case
+        params = dict(fs=fs, dso=dso, To=To, T1=T1, T2=T2, zi=zi, nit=nit, NS=NS, baseline=baseline,
+                      porder=porder, callback=progress, tol=tol, mean_tol=mean_tol, delta=delta,
+                      patience=patience, low_memory=low_memory, seed=seed)
+        try:
+            if len(records) == 1:
+                return match_single(records[0], **params)
+            return match_rotdnn(records[0], records[1], nn=nn, **params)
+        except BaseException:
+            cancelled.set() # Stop the other combinations as well
+            raise
+
+    with _stage(timer, 'combinations'):
+        with ThreadPoolExecutor(max_workers=sweep_workers(len(cases), workers),
+                                thread_name_prefix='reqpy-sweep') as pool:
+            futures = [pool.submit(run, case, seed) for case, seed in zip(cases, case_seeds)]
+        errors = [f.exception() for f in futures if f.exception() is not None]
+    if errors: # The error that stopped the sweep, rather than the cancellations it caused
+        raise min(errors, key=lambda e: isinstance(e, MatchingCancelled))
+    return [f.result() for f in futures]
@@ -0,0 +1,319 @@
+"""
+Decimated plotting of matching results.
+
+reqpy_M's plot_single_results / plot_rotdnn_results draw every sample of the
+acceleration, velocity and displacement histories and every target ordinate,
+so long records and dense targets are slow to draw and produce heavy PNGs.
+The figures here look the same but are drawn from reduced data:
+
+* time histories keep the minimum and the maximum of each of `max_points` / 2
+  consecutive buckets, so every peak stays visible at screen resolution;
+* target spectra are reduced to a log-spaced subset of `spec_points` periods
+  (plus the peak ordinate).
+
+The reduced series are built once (plot_data_single / plot_data_rotdnn) and
+rendered either as matplotlib figures or as interactive Altair (Vega-Lite)
+charts that are drawn in the browser.
+"""
+
+from typing import Dict, Any, List, Optional, Tuple
+import threading
+import numpy as np
+import matplotlib as mpl
+import matplotlib.pyplot as plt
+from scipy import integrate
+
+SEED_COLOR = 'cornflowerblue'
+MATCHED_COLOR = 'salmon'
+ORIGINAL_COLOR = 'blueviolet'
+TARGET_COLOR = 'darkgray'
+
+# matplotlib is not thread safe and Streamlit runs every session in its own
+# thread: the pages build and draw (st.pyplot) their figures under this lock
+lock = threading.RLock()
+
+# A series is (label, color, linewidth, x, y); a panel is (ylabel, [series])
+Series = Tuple[str, str, float, np.ndarray, np.ndarray]
+
+
+def minmax_indices(y: np.ndarray, max_points: int) -> np.ndarray:
+    """Indices of a peak-preserving subset of at most ~`max_points` samples.
+
+    The series is split into max_points / 2 buckets of consecutive samples
+    and the minimum and maximum of each bucket are kept (in time order),
+    together with the first and last sample.
+    """
+    n = len(y)
+    if n <= max_points:
+        return np.arange(n)
+    size = int(np.ceil(n / max(1, max_points // 2)))
+    nfull = n // size
+    blocks = y[:nfull * size].reshape(nfull, size)
+    base = np.arange(nfull) * size
+    idx = [base + blocks.argmin(axis=1), base + blocks.argmax(axis=1), [0, n - 1]]
+    if nfull * size < n:
+        rest = y[nfull * size:]
+        idx.append(nfull * size + np.array([rest.argmin(), rest.argmax()]))
+    return np.unique(np.concatenate(idx))
+
+
+def log_indices(T: np.ndarray, y: np.ndarray, npts: int) -> np.ndarray:
+    """Indices of a log-spaced subset of a spectrum (periods ascending)."""
+    n = len(T)
+    if n <= npts:
+        return np.arange(n)
+    positive = T > 0
+    grid = np.geomspace(T[positive].min(), T.max(), npts)
+    idx = np.searchsorted(T, grid).clip(0, n - 1)
+    return np.unique(np.concatenate((idx, [0, n - 1, np.argmax(y)])))
+
+
+def _history(t: np.ndarray, y: np.ndarray, label: str, color: str, max_points: int) -> Series:
+    idx = minmax_indices(y, max_points)
+    return (label, color, 1.0, t[idx], y[idx])
+
+
+def _integrate(acc: np.ndarray, t: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    vel = integrate.cumulative_trapezoid(acc, x=t, initial=0)
+    return vel, integrate.cumulative_trapezoid(vel, x=t, initial=0)
+
+
+def _spectra_data(
+    T: np.ndarray,
+    curves: List[Tuple[str, str, np.ndarray]],
+    target_spec: Optional[Tuple[np.ndarray, np.ndarray]],
+    T1: float,
+    T2: float,
+    ylabel: str,
+    spec_points: int
+) -> Dict[str, Any]:
+    series: List[Series] = []
+    peaks = [np.nanmax(psa) for _, _, psa in curves]
+    if target_spec is not None:
+        To, dso = target_spec
+        idx = log_indices(To, dso, spec_points)
+        series.append(('Target', TARGET_COLOR, 2.0, To[idx], dso[idx]))
+        peaks.append(np.nanmax(dso))
+    series += [(label, color, 1.0, T, psa) for label, color, psa in curves]
+    limy = 1.06 * max([0.0] + peaks)
+    if limy == 0 or not np.isfinite(limy):
+        limy = 1.0
+    lo = T1 if T1 > T.min() else T.min()
+    hi = T2 if 0 < T2 < T.max() else T.max()
+    if T1 <= 1e-9 and T2 <= 1e-9: # No range given: the full computed range was matched
+        lo, hi = T.min(), T.max()
+    return {'series': series, 'ylabel': ylabel, 'limy': limy, 'xlim': (T.min(), T.max()),
+            'range': (lo, hi) if lo < hi else None}
+
+
+def plot_data_single(
+    results: Dict[str, Any],
+    s_orig: np.ndarray,
+    target_spec: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    T1: float = 0.0,
+    T2: float = 0.0,
+    max_points: int = 4000,
+    spec_points: int = 300
+) -> Dict[str, Any]:
+    """Reduced plot data of a single component matching result.
+
+    Parameters
+    ----------
+    results : Dict[str, Any]
+        Results dictionary of REQPY_single / hf.my_REQPY_single.
+    s_orig : np.ndarray
+        Original (unscaled) seed record (g).
+    target_spec : Optional[Tuple[np.ndarray, np.ndarray]], optional
+        (periods, PSA) of the target spectrum.
+    T1, T2 : float, optional
+        Matching period range (highlighted).
+    max_points : int, optional
+        Samples kept per time history. Default is 4000.
+    spec_points : int, optional
+        Periods kept of the target spectrum. Default is 300.
+
+    Returns
+    -------
+    Dict[str, Any]
+        'columns': [(title, [panels])] of the time histories and 'spectra'.
+    """
+    ccs, dt, sf, T = results['ccs'], results['dt'], results['sf'], results['T']
+    n = len(ccs)
+    t = np.linspace(0, (n - 1) * dt, n)
+    s_scaled = s_orig[:n] * sf
+    vel_scaled, disp_scaled = _integrate(s_scaled, t)
+    panels = []
+    for ylabel, seed, matched in (('Acc. [g]', s_scaled, ccs), ('Vel./g', vel_scaled, results['cvel']),
+                                  ('Displ./g', disp_scaled, results['cdespl'])):
+        panels.append((ylabel, [_history(t, seed, 'Scaled Seed', SEED_COLOR, max_points),
+                                _history(t, matched, 'Matched', MATCHED_COLOR, max_points)]))
+    PSAs = results['PSAs']
+    spec = _spectra_data(T, [('Original Seed', ORIGINAL_COLOR, PSAs), ('Scaled Seed', SEED_COLOR, PSAs * sf),
+                             ('Matched', MATCHED_COLOR, results['PSAccs'])],
+                         target_spec, T1, T2, 'PSA [g]', spec_points)
+    return {'columns': [(None, panels)], 'spectra': spec}
+
+
+def plot_data_rotdnn(
+    results: Dict[str, Any],
+    s1_orig: np.ndarray,
+    s2_orig: np.ndarray,
+    target_spec: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    T1: float = 0.0,
+    T2: float = 0.0,
+    nn: Optional[int] = None,
+    max_points: int = 4000,
+    spec_points: int = 300
+) -> Dict[str, Any]:
+    """Reduced plot data of a RotDnn matching result.
+
+    Parameters
+    ----------
+    results : Dict[str, Any]
+        Results dictionary of REQPYrotdnn / hf.my_REQPYrotdnn.
+    s1_orig, s2_orig : np.ndarray
+        Original (unscaled) seed records (g).
+    target_spec, T1, T2, max_points, spec_points
+        See `plot_data_single`.
+    nn : Optional[int], optional
+        Percentile, for the spectra axis label.
+
+    Returns
+    -------
+    Dict[str, Any]
+        'columns': [(title, [panels])] of the time histories and 'spectra'.
+    """
+    dt, sf, T = results['dt'], results['sf'], results['T']
+    n = len(results['scc1'])
+    t = np.linspace(0, (n - 1) * dt, n)
+    columns = []
+    for i, s_orig in ((1, s1_orig), (2, s2_orig)):
+        s_scaled = s_orig[:n] * sf
+        vel_scaled, disp_scaled = _integrate(s_scaled, t)
+        panels = []
+        for ylabel, seed, matched in (('Acc. [g]', s_scaled, results[f'scc{i}']),
+                                      ('Vel./g', vel_scaled, results[f'cvel{i}']),
+                                      ('Displ./g', disp_scaled, results[f'cdisp{i}'])):
+            panels.append((ylabel, [_history(t, seed, 'Scaled Seed', SEED_COLOR, max_points),
+                                    _history(t, matched, 'Matched', MATCHED_COLOR, max_points)]))
+        columns.append((f'Component {i}', panels))
+    PSAor = results['PSArotnnor']
+    label = f'PSA RotD{nn} [g]' if nn is not None else 'PSA RotDnn [g]'
+    spec = _spectra_data(T, [('Original Seed', ORIGINAL_COLOR, PSAor), ('Scaled Seed', SEED_COLOR, PSAor * sf),
+                             ('Matched', MATCHED_COLOR, results['PSArotnn'])],
+                         target_spec, T1, T2, label, spec_points)
+    return {'columns': columns, 'spectra': spec}
+
+
+def _row_series(columns: List[Tuple[Optional[str], List]], i: int) -> List[Series]:
+    """All series of row i across the columns (rows share the y limits)."""
+    return [s for _, panels in columns for s in panels[i][1]]
+
+
+def figures(data: Dict[str, Any]) -> Tuple[plt.Figure, plt.Figure]:
+    """Renders plot data as matplotlib figures (fig_hist, fig_spec), styled as reqpy_M."""
+    mpl.rcParams['font.size'] = 9
+    mpl.rcParams['legend.frameon'] = False
+    columns = data['columns']
+    ncols = len(columns)
+    fig_hist, axs = plt.subplots(3, ncols, figsize=(6.5, 6.5 if ncols == 1 else 5), sharex=True,
+                                 sharey='row', squeeze=False)
+    for j, (title, panels) in enumerate(columns):
+        for i, (ylabel, series) in enumerate(panels):
+            ax = axs[i, j]
+            for label, color, lw, x, y in series:
+                ax.plot(x, y, lw=lw, color=color, label=label)
+            lim = 1.05 * max(np.max(np.abs(y)) for *_, y in _row_series(columns, i))
+            ax.set_ylim(-lim, lim)
+            ax.grid(True, linestyle=':', alpha=0.7)
+            if j == 0:
+                ax.set_ylabel(ylabel)
+        if title:
+            axs[0, j].set_title(title)
+        axs[2, j].set_xlabel('Time [s]')
+    if ncols == 1:
+        axs[0, 0].legend(loc='upper right')
+        fig_hist.tight_layout()
+    else:
+        handles, labels = axs[2, -1].get_legend_handles_labels()
+        fig_hist.legend(handles, labels, loc='lower center', ncol=2, bbox_to_anchor=(0.5, 0))
+        fig_hist.tight_layout(h_pad=0.3, w_pad=0.3, rect=(0, 0.05, 1, 0.96))
+
+    spec = data['spectra']
+    fig_spec, ax = plt.subplots(figsize=(6.5, 6.5))
+    limy = spec['limy']
+    series = spec['series']
+    if series[0][0] == 'Target':
+        label, color, lw, x, y = series[0]
+        ax.semilogx(x, y, color=color, lw=lw, label=label)
+        series = series[1:]
+    if spec['range'] is not None:
+        lo, hi = spec['range']
+        auxx = [lo, lo, hi, hi, lo]
+        auxy = [0, limy, limy, 0, 0]
+        ax.fill_between(auxx, auxy, color='silver', alpha=0.4, label='Match Range')
+        ax.plot(auxx, auxy, color='silver', alpha=1, lw=0.5)
+    for label, color, lw, x, y in series:
+        ax.semilogx(x, y, color=color, lw=lw, label=label)
+    ax.set_xlabel('Period T [s]')
+    ax.set_ylabel(spec['ylabel'])
+    ax.set_ylim(bottom=0, top=limy)
+    ax.set_xlim(*spec['xlim'])
+    ax.grid(True, which='both', linestyle=':', alpha=0.7)
+    ax.legend(ncol=3, bbox_to_anchor=(0.5, 1.02), loc='lower center')
+    fig_spec.tight_layout(rect=(0, 0, 1, 0.95))
+    return fig_hist, fig_spec
+
+
+def charts(data: Dict[str, Any], max_points: int = 1500) -> Tuple[Any, Any]:
+    """Renders plot data as interactive Altair charts (hist_chart, spec_chart).
+
+    The chart data is sent to the browser as JSON, so the time histories are
+    decimated further to `max_points` samples per series.
+    """
+    import altair as alt
+    import pandas as pd
+
+    colors = alt.Scale(domain=['Target', 'Original Seed', 'Scaled Seed', 'Matched'],
+                       range=[TARGET_COLOR, ORIGINAL_COLOR, SEED_COLOR, MATCHED_COLOR])
+    columns = data['columns']
+    zoom = alt.selection_interval(bind='scales', encodings=['x'])
+    rows = []
+    for i in range(3):
+        row = []
+        for j, (title, panels) in enumerate(columns):
+            ylabel, series = panels[i]
+            frames = []
+            for label, _, _, x, y in series:
+                idx = minmax_indices(y, max_points)
+                frames.append(pd.DataFrame({'Time [s]': x[idx], 'value': y[idx], 'series': label}))
+            df = pd.concat(frames, ignore_index=True)
+            chart = alt.Chart(df).mark_line(strokeWidth=1).encode(
+                x=alt.X('Time [s]:Q', title='Time [s]' if i == 2 else None),
+                y=alt.Y('value:Q', title=ylabel),
+                color=alt.Color('series:N', scale=colors, title=None),
+                tooltip=['series:N', alt.Tooltip('Time [s]:Q', format='.3f'), alt.Tooltip('value:Q', format='.4g')])
+            if i == 0 and j == 0:
+                chart = chart.add_params(zoom) # The x scale is shared, so this zooms every panel
+            row.append(chart.properties(height=150, title=title if i == 0 and title else ''))
+        rows.append(alt.hconcat(*row) if len(row) > 1 else row[0])
+    hist_chart = alt.vconcat(*rows).resolve_scale(x='shared')
+
+    spec = data['spectra']
+    df = pd.concat([pd.DataFrame({'T': x, 'PSA': y, 'series': label, 'width': lw})
+                    for label, _, lw, x, y in spec['series']], ignore_index=True)
+    df = df[df['T'] > 0] # Log axis
+    lines = alt.Chart(df).mark_line().encode(
+        x=alt.X('T:Q', scale=alt.Scale(type='log', domain=list(spec['xlim'])), title='Period T [s]'),
+        y=alt.Y('PSA:Q', scale=alt.Scale(domain=[0, spec['limy']]), title=spec['ylabel']),
+        color=alt.Color('series:N', scale=colors, title=None),
+        strokeWidth=alt.StrokeWidth('width:Q', legend=None),
+        tooltip=['series:N', alt.Tooltip('T:Q', format='.3f'), alt.Tooltip('PSA:Q', format='.4g')])
+    layers = [lines]
+    if spec['range'] is not None:
+        lo, hi = spec['range']
+        band = alt.Chart(pd.DataFrame({'lo': [lo], 'hi': [hi]})).mark_rect(color='silver', opacity=0.4).encode(
+            x='lo:Q', x2='hi:Q')
+        layers.insert(0, band)
+    spec_chart = alt.layer(*layers).properties(height=450)
+    return hist_chart, spec_chart
@@ -0,0 +1,109 @@
+"""
+Per-stage timing and peak memory instrumentation.
+
+A StageTimer records the wall time (and optionally the peak traced memory)
+of named stages of one run - parsing, target loading, matching, plotting,
+serialization - so the pages can show where the time goes and batch runs can
+log it as JSON lines to track regressions.
+
+Peak memory uses tracemalloc, which numpy reports its array buffers to. It is
+only enabled when requested, as tracing slows down allocation-heavy code.
+tracemalloc is process wide. Tracing is started by the first timer that
+opens a stage and stopped when the last open stage of any timer closes, and
+the peak is only reset when no other timer has a stage open. With several
+sessions measuring at once, a stage's peak is thus an upper bound: it
+includes the other sessions' allocations and can include earlier peaks of
+the process, but it is never zeroed by another session. In batch runs every
+worker is a separate process and the peaks are exact.
+"""
+
+from typing import Optional, Dict, Any, List, Iterator
+from contextlib import contextmanager
+import json
+import threading
+import time
+import tracemalloc
+
+MB = 1024 * 1024
+
+_lock = threading.Lock() # Guards the tracing state shared by all timers
+_active = 0 # Timers with an open stage that record memory
+_started = False # Tracing was started by a timer (and is stopped by the last one)
+
+
+class StageTimer:
+    """Records wall time and peak memory of named stages.
+
+    Parameters
+    ----------
+    memory : bool, optional
+        Also record the peak traced memory of each stage (MB). Default False.
+
+    Notes
+    -----
+    Stages may be nested: a nested stage is recorded with its parent name
+    as prefix ("matching/iterations"), and the peak memory of the parent
+    includes the peaks of its children.
+    """
+
+    def __init__(self, memory: bool = False):
+        self.memory = memory
+        self.records: List[Dict[str, Any]] = []
+        self._stack: List[List[Any]] = [] # [name, running peak in bytes]
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Context manager timing the enclosed block as stage `name`."""
+        global _active, _started
+        if self.memory:
+            with _lock:
+                if not self._stack:
+                    if _active == 0 and not tracemalloc.is_tracing():
+                        tracemalloc.start()
+                        _started = True
+                    _active += 1
+                if self._stack: # Keep the parent's peak before resetting it for this stage
+                    self._stack[-1][1] = max(self._stack[-1][1], tracemalloc.get_traced_memory()[1])
+                if _active == 1: # Other timers' peaks would be lost
+                    tracemalloc.reset_peak()
+        full_name = '/'.join([s[0] for s in self._stack] + [name])
+        self._stack.append([name, 0])
+        record = {'stage': full_name, 'seconds': None, 'peak_mb': None}
+        self.records.append(record) # Added on entry, so parents are listed before their children
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - t0
+            _, peak = self._stack.pop()
+            peak_mb = None
+            if self.memory:
+                with _lock:
+                    peak = max(peak, tracemalloc.get_traced_memory()[1])
+                    peak_mb = peak / MB
+                    if self._stack:
+                        self._stack[-1][1] = max(self._stack[-1][1], peak)
+                    else:
+                        _active -= 1
+                        if _active == 0 and _started:
+                            tracemalloc.stop()
+                            _started = False
+            record.update(seconds=seconds, peak_mb=peak_mb)
+
+    def add(self, name: str, seconds: float, peak_mb: Optional[float] = None) -> None:
+        """Adds a stage measured elsewhere (e.g. in a background job)."""
+        self.records.append({'stage': name, 'seconds': seconds, 'peak_mb': peak_mb})
+
+    def extend(self, other: "StageTimer", prefix: str = '') -> None:
+        """Appends the records of another timer, optionally under `prefix`."""
+        for r in other.records:
+            self.add(f"{prefix}{r['stage']}", r['seconds'], r['peak_mb'])
+
+    @property
+    def total(self) -> float:
+        """Wall time of the top-level stages (s)."""
+        return sum(r['seconds'] or 0.0 for r in self.records if '/' not in r['stage'])
+
+    def to_json(self, **extra: Any) -> str:
+        """One JSON line with the stage records and any extra fields."""
+        return json.dumps({**extra, 'total_seconds': self.total, 'stages': self.records})
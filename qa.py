@@ -0,0 +1,185 @@
+"""
+Quality assurance report of a matched record suite.
+
+The pages and batchmatch.py report the final RMSE and misfit of each record;
+anything else meant going through the plots of every record. The QA stage of
+batchmatch.py (--qa) checks the whole suite at once. The spectra and time
+histories of all records are stacked into 2-D arrays (one row per record or
+component, zero-padded to the longest one) and every figure is computed in
+one vectorized pass:
+
+* the ratio of each matched spectrum to the target at the target periods in
+  the matching range, and its extremes per record. In rotdnn mode the pair
+  is matched on its RotDnn spectrum, so there is one ratio per pair, not
+  per component;
+* the suite-mean spectrum against 90% and 110% of the target, the lower
+  bounds ASCE 7-16 Ch. 16 sets for the mean of amplitude-scaled and of
+  spectrally matched suites;
+* PGA (g), PGV (cm/s), PGD (cm) and Arias intensity (m/s) of each matched
+  component, and their ratios to those of the scaled seed. The seed
+  velocity and displacement are not baseline corrected, so PGD ratios well
+  below 1 usually show the drift removed by the baseline correction.
+"""
+
+from typing import Dict, Any, List, Sequence, Tuple
+import numpy as np
+
+G = 9.81 # m/s2
+BOUNDS = (0.9, 1.1) # Suite mean / target
+MOTION_PARAMS = (('pga', 'PGA', 'g'), ('pgv', 'PGV', 'cm/s'), ('pgd', 'PGD', 'cm'), ('arias', 'Arias', 'm/s'))
+
+
+def record_data(results: Dict[str, Any], seeds: Sequence[np.ndarray], comp_keys: Sequence[str]) -> Dict[str, Any]:
+    """Arrays of one matched record (or pair) used by `suite_report`.
+
+    Parameters
+    ----------
+    results : Dict[str, Any]
+        Results dictionary of my_REQPY_single / my_REQPYrotdnn.
+    seeds : Sequence[np.ndarray]
+        Unscaled seed record(s) (g), in the order of `comp_keys`.
+    comp_keys : Sequence[str]
+        Keys of the matched components in `results` ('ccs' or 'scc1', 'scc2').
+    """
+    n = len(results[comp_keys[0]])
+    rotdnn = 'PSArotnn' in results
+    return {'T': results['T'], 'psa': results['PSArotnn' if rotdnn else 'PSAccs'],
+            'spectrum': 'RotDnn' if rotdnn else 'component', 'dt': results['dt'],
+            'matched': [results[k] for k in comp_keys],
+            'seed': [np.asarray(s[:n]) * results['sf'] for s in seeds]}
+
+
+def _stack(arrays: Sequence[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """Zero-padded rows of `arrays` and their lengths."""
+    npts = np.array([len(a) for a in arrays])
+    out = np.zeros((len(arrays), npts.max()))
+    for i, a in enumerate(arrays):
+        out[i, :len(a)] = a
+    return out, npts
+
+
+def motion_params(acc: np.ndarray, npts: np.ndarray, dt: np.ndarray) -> Dict[str, np.ndarray]:
+    """PGA (g), PGV (cm/s), PGD (cm) and Arias intensity (m/s) of zero-padded records (one per row)."""
+    valid = np.arange(acc.shape[1]) < npts[:, np.newaxis]
+    acc = np.where(valid, acc, 0.0)
+    vel = np.zeros_like(acc)
+    vel[:, 1:] = np.cumsum((acc[:, 1:] + acc[:, :-1]) / 2, axis=1) * dt[:, np.newaxis]
+    disp = np.zeros_like(acc)
+    disp[:, 1:] = np.cumsum((vel[:, 1:] + vel[:, :-1]) / 2, axis=1) * dt[:, np.newaxis]
+    return {'pga': np.abs(acc).max(axis=1),
+            'pgv': np.abs(np.where(valid, vel, 0.0)).max(axis=1) * G * 100,
+            'pgd': np.abs(np.where(valid, disp, 0.0)).max(axis=1) * G * 100,
+            'arias': np.pi * G / 2 * np.sum(acc ** 2, axis=1) * dt}
+
+
+def suite_report(records: List[Dict[str, Any]], names: List[str], To: np.ndarray, dso: np.ndarray,
+                 T1: float, T2: float) -> Dict[str, Any]:
+    """QA figures of a matched suite.
+
+    Parameters
+    ----------
+    records : List[Dict[str, Any]]
+        `record_data` of each matched record (or pair).
+    names : List[str]
+        Name of each record.
+    To, dso : np.ndarray
+        Target spectrum (periods ascending).
+    T1, T2 : float
+        Matching period range.
+
+    Returns
+    -------
+    Dict[str, Any]
+        'T' and 'target' (target in the matching range), 'ratio' (records x
+        periods), 'mean_ratio', 'rows' (spectral ratio extremes, one per
+        record or pair, with the 'spectrum' they refer to), 'components'
+        (motion parameters, one per matched component) and 'summary' (suite
+        mean extremes and bound checks).
+    """
+    inside = (To >= T1) & (To <= T2)
+    T, target = To[inside], dso[inside]
+    psa = np.array([np.exp(np.interp(np.log(T), np.log(r['T']), np.log(r['psa']))) for r in records])
+    ratio = psa / target
+    mean_ratio = ratio.mean(axis=0)
+
+    comps = [(i, c) for i, r in enumerate(records) for c in range(len(r['matched']))]
+    owner = np.array([i for i, _ in comps])
+    dt = np.array([records[i]['dt'] for i in owner])
+    matched, npts = _stack([records[i]['matched'][c] for i, c in comps])
+    seed, _ = _stack([records[i]['seed'][c] for i, c in comps])
+    after, before = motion_params(matched, npts, dt), motion_params(seed, npts, dt)
+
+    lo, hi = ratio.min(axis=1), ratio.max(axis=1)
+    rows = [{'record': names[i], 'spectrum': r.get('spectrum', 'component'), 'ratio_min': lo[i],
+             'T_ratio_min': T[ratio[i].argmin()], 'ratio_max': hi[i], 'T_ratio_max': T[ratio[i].argmax()]}
+            for i, r in enumerate(records)]
+    components = []
+    for j, (i, c) in enumerate(comps):
+        row = {'record': names[i], 'component': c + 1}
+        for key, _, _ in MOTION_PARAMS:
+            row[key] = after[key][j]
+            row[f'{key}_ratio'] = after[key][j] / before[key][j]
+        components.append(row)
+    k_min, k_max = mean_ratio.argmin(), mean_ratio.argmax()
+    summary = {'records': len(records), 'T1': T1, 'T2': T2,
+               'mean_ratio_min': mean_ratio[k_min], 'T_mean_ratio_min': T[k_min],
+               'mean_ratio_max': mean_ratio[k_max], 'T_mean_ratio_max': T[k_max],
+               **{f'mean_above_{round(100 * b)}': bool(mean_ratio[k_min] >= b) for b in BOUNDS}}
+    return {'T': T, 'target': target, 'ratio': ratio, 'mean_ratio': mean_ratio, 'rows': rows,
+            'components': components, 'summary': summary}
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """The QA report as fixed-width text tables (spectral ratios, motion parameters) and summary lines."""
+    rows, components, s = report['rows'], report['components'], report['summary']
+    width = max([len('record')] + [len(r['record']) for r in rows])
+    lines = [f"{'record':<{width}s}  {'spectrum':<9s}  {'PSA/target':>12s}  {'at T (s)':>13s}"]
+    for r in rows:
+        periods = f"{r['T_ratio_min']:.3f}-{r['T_ratio_max']:.3f}"
+        lines.append(f"{r['record']:<{width}s}  {r['spectrum']:<9s}  {r['ratio_min']:5.2f}-{r['ratio_max']:<6.2f}  "
+                     f"{periods:>13s}")
+    if any(r['spectrum'] == 'RotDnn' for r in rows):
+        lines.append("RotDnn: ratio of the RotDnn spectrum of the pair, which both components are matched on.")
+    lines += ['', f"{'record':<{width}s}  {'comp':>4s}" +
+              ''.join(f"  {label + ' ratio':>12s}" for _, label, _ in MOTION_PARAMS)]
+    for r in components:
+        lines.append(f"{r['record']:<{width}s}  {r['component']:4d}" +
+                     ''.join(f"  {r[f'{key}_ratio']:12.2f}" for key, _, _ in MOTION_PARAMS))
+    lines.append(f"Suite mean / target in {s['T1']:g}-{s['T2']:g} s: {s['mean_ratio_min']:.3f} "
+                 f"(T = {s['T_mean_ratio_min']:.3f} s) to {s['mean_ratio_max']:.3f} (T = {s['T_mean_ratio_max']:.3f} s)")
+    lines.append('; '.join(f"mean {'>=' if s[f'mean_above_{round(100 * b)}'] else 'below'} {100 * b:g}% of target"
+                           for b in BOUNDS))
+    return '\n'.join(lines)
+
+
+def plot_report(report: Dict[str, Any], path: str) -> None:
+    """Saves the summary figure: spectral ratios of the suite and motion parameter ratios."""
+    import matplotlib.pyplot as plt # Imported here: only needed for the figure
+    import plotting
+
+    T, ratio, rows = report['T'], report['ratio'], report['components']
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(11, 4.5), gridspec_kw={'width_ratios': (2, 1)})
+    ax1.semilogx(T, ratio.T, color=plotting.TARGET_COLOR, lw=0.6)
+    ax1.semilogx(T, report['mean_ratio'], color=plotting.MATCHED_COLOR, lw=2, label='Suite mean')
+    for b in BOUNDS:
+        ax1.axhline(b, color='k', ls='--', lw=0.8,
+                    label=' / '.join(f"{100 * x:g}%" for x in BOUNDS) + ' of target' if b == BOUNDS[0] else None)
+    ax1.axhline(1.0, color='k', lw=0.8)
+    ax1.set_xlabel('Period [s]')
+    ax1.set_ylabel('PSA / target')
+    ax1.set_title(f"{report['summary']['records']} records")
+    ax1.legend(loc='best', frameon=False)
+    ax1.grid(True, which='both', linestyle=':', alpha=0.7)
+
+    rng = np.random.default_rng(0) # Reproducible jitter
+    for k, (key, label, _) in enumerate(MOTION_PARAMS):
+        values = np.array([r[f'{key}_ratio'] for r in rows])
+        ax2.scatter(k + rng.uniform(-0.15, 0.15, len(values)), values, s=12, color=plotting.SEED_COLOR)
+        ax2.plot([k - 0.25, k + 0.25], [np.median(values)] * 2, color=plotting.MATCHED_COLOR, lw=2)
+    ax2.axhline(1.0, color='k', lw=0.8)
+    ax2.set_xticks(range(len(MOTION_PARAMS)), [label for _, label, _ in MOTION_PARAMS])
+    ax2.set_ylabel('Matched / scaled seed')
+    ax2.grid(True, axis='y', linestyle=':', alpha=0.7)
+    fig.tight_layout()
+    fig.savefig(path, dpi=150)
+    plt.close(fig)
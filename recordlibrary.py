@@ -0,0 +1,287 @@
+"""
+Local library of seed records with precomputed spectra.
+
+Picking a seed record by uploading one .AT2 file after another is slow, and
+a poor seed needs many matching iterations (or never matches well). The
+library ingests directories of PEER .AT2 files once: every record is parsed,
+its acceleration stored as a .npy file and its 5%-damped spectrum computed
+on a fixed log-spaced period grid. The spectra of all records are kept in
+one matrix, so ranking the whole library against a target is a handful of
+vectorized operations: each record is scaled to the target over [T1, T2]
+the way the matching driver scales its seed, and records are ordered by the
+remaining RMSE misfit.
+
+Layout of a library directory:
+
+    index.npz           names, files, eqnames, dt, npts, hashes, T, psa, zi
+    records/<hash>.npy  parsed acceleration of each record (g)
+
+The library used by the pages is set with the environment variable
+REQPY_LIBRARY_DIR. From the command line:
+
+    python recordlibrary.py ingest RECORDS_DIR [--library DIR]
+    python recordlibrary.py rank TARGET [--library DIR] [--T1 0.05] [--T2 6.0] [--top 10]
+"""
+
+from typing import Optional, Dict, Any, List, Tuple
+import argparse
+import glob
+import hashlib
+import logging
+import os
+import sys
+import threading
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+DEFAULT_DIR = 'record_library'
+PERIODS = np.geomspace(0.01, 10.0, 200) # Grid of the stored spectra (s)
+
+_INDEX_FIELDS = ('names', 'files', 'eqnames', 'dt', 'npts', 'hashes')
+
+
+class RecordLibrary:
+    """Seed records with precomputed spectra, stored in a directory.
+
+    Parameters
+    ----------
+    path : str
+        Library directory (created on the first ingest).
+    zi : float, optional
+        Damping ratio of the stored spectra. Default is 0.05.
+    """
+
+    def __init__(self, path: str, zi: float = 0.05):
+        self.path = path
+        self.zi = zi
+        self.T = PERIODS
+        self._lock = threading.Lock()
+        self._load_index()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.path, 'index.npz')
+
+    def _record_path(self, digest: str) -> str:
+        return os.path.join(self.path, 'records', f"{digest}.npy")
+
+    def _load_index(self) -> None:
+        self.names: List[str] = []
+        self.files: List[str] = []
+        self.eqnames: List[str] = []
+        self.dt = np.zeros(0)
+        self.npts = np.zeros(0, dtype=int)
+        self.hashes: List[str] = []
+        self.psa = np.zeros((0, len(self.T)))
+        self.index_mtime = os.path.getmtime(self._index_path) if os.path.exists(self._index_path) else None
+        if self.index_mtime is None:
+            return
+        with np.load(self._index_path, allow_pickle=False) as data:
+            if not np.allclose(data['T'], self.T) or float(data['zi']) != self.zi:
+                log.warning(f"Library {self.path} was built for another period grid or damping; "
+                            f"re-ingest the records.")
+                return
+            self.names = data['names'].tolist()
+            self.files = data['files'].tolist()
+            self.eqnames = data['eqnames'].tolist()
+            self.dt = data['dt']
+            self.npts = data['npts']
+            self.hashes = data['hashes'].tolist()
+            self.psa = data['psa']
+
+    def _save_index(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = f"{self._index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as fp:
+            np.savez(fp, names=np.array(self.names, dtype=str), files=np.array(self.files, dtype=str),
+                     eqnames=np.array(self.eqnames, dtype=str), dt=self.dt, npts=self.npts,
+                     hashes=np.array(self.hashes, dtype=str), T=self.T, psa=self.psa, zi=self.zi)
+        os.replace(tmp_path, self._index_path) # Atomic, so readers never see a partial index
+        self.index_mtime = os.path.getmtime(self._index_path)
+
+    def ingest(self, records: str) -> Dict[str, Any]:
+        """Adds the .AT2 files of a directory (or a single file) to the library.
+
+        Files already in the library (same content) are skipped; files that
+        cannot be parsed are reported and skipped.
+
+        Returns
+        -------
+        Dict[str, Any]
+            'added', 'skipped' (already present) and 'failed' ([(file, error)]).
+        """
+        import helperfunctions as hf # Imported here: helperfunctions imports this module
+        import spectra
+
+        if os.path.isdir(records):
+            paths = sorted(glob.glob(os.path.join(records, '*.[Aa][Tt]2')))
+        else:
+            paths = [records]
+        report: Dict[str, Any] = {'added': 0, 'skipped': 0, 'failed': []}
+        new = {field: [] for field in _INDEX_FIELDS}
+        new_psa = []
+        with self._lock:
+            known = set(self.hashes)
+            for p in paths:
+                try:
+                    with open(p, 'rb') as fp:
+                        raw = fp.read()
+                    digest = hashlib.sha256(raw).hexdigest()[:24]
+                    if digest in known:
+                        report['skipped'] += 1
+                        continue
+                    with open(p) as fp:
+                        acc, dt, npts, eqname = hf.my_parse_PEERNGA_record(fp)
+                    psa = spectra.response_spectra(self.T, acc, dt, self.zi)[0]
+                except Exception as e:
+                    log.warning(f"Skipping {p}: {e}")
+                    report['failed'].append((p, f"{type(e).__name__}: {e}"))
+                    continue
+                os.makedirs(os.path.dirname(self._record_path(digest)), exist_ok=True)
+                np.save(self._record_path(digest), acc)
+                known.add(digest)
+                for field, value in zip(_INDEX_FIELDS, (os.path.basename(p), os.path.abspath(p), eqname,
+                                                        dt, npts, digest)):
+                    new[field].append(value)
+                new_psa.append(psa)
+                report['added'] += 1
+            if new_psa:
+                self.names += new['names']
+                self.files += new['files']
+                self.eqnames += new['eqnames']
+                self.dt = np.concatenate((self.dt, new['dt']))
+                self.npts = np.concatenate((self.npts, np.asarray(new['npts'], dtype=int)))
+                self.hashes += new['hashes']
+                self.psa = np.vstack((self.psa, new_psa))
+                self._save_index()
+        log.info(f"Library {self.path}: {report['added']} added, {report['skipped']} already present, "
+                 f"{len(report['failed'])} failed.")
+        return report
+
+    def load_record(self, name: str) -> Tuple[np.ndarray, float, int, str]:
+        """Acceleration (g), dt (s), number of points and record name of a library record.
+
+        The acceleration is memory-mapped read-only, so sessions using the
+        same record share its pages instead of holding a copy each.
+        """
+        i = self.names.index(name)
+        acc = np.load(self._record_path(self.hashes[i]), mmap_mode='r')
+        return acc, float(self.dt[i]), int(self.npts[i]), self.eqnames[i]
+
+    def rank(
+        self,
+        To: np.ndarray,
+        dso: np.ndarray,
+        T1: float = 0.0,
+        T2: float = 0.0,
+        top: Optional[int] = 10,
+        sf_range: Optional[Tuple[float, float]] = None
+    ) -> List[Dict[str, Any]]:
+        """Ranks the records by their scaled spectral misfit to a target.
+
+        Each record is scaled by sf = sum(target) / sum(PSA) over the library
+        periods in [T1, T2] (the scaling of the matching driver), and the
+        RMSE and mean misfit of the scaled spectrum are computed there.
+
+        Parameters
+        ----------
+        To, dso : np.ndarray
+            Target periods (s, ascending) and PSA (g).
+        T1, T2 : float, optional
+            Period range; 0 uses the range of the target.
+        top : Optional[int], optional
+            Number of records returned (None: all). Default is 10.
+        sf_range : Optional[Tuple[float, float]], optional
+            Only rank records whose scale factor is within (min, max).
+
+        Returns
+        -------
+        List[Dict[str, Any]]
+            Rows with 'name', 'eqname', 'sf', 'rmse', 'meane' (%), 'dt' and
+            'npts', best record first.
+        """
+        if not len(self):
+            return []
+        lo = T1 if T1 > 0 else To[To > 0].min()
+        hi = T2 if T2 > 0 else To.max()
+        mask = (self.T >= max(lo, To[To > 0].min())) & (self.T <= min(hi, To.max()))
+        if not mask.any():
+            raise ValueError(f"No library periods in the range [{lo:g}, {hi:g}] s covered by the target.")
+        positive = (To > 0) & (dso > 0)
+        target = np.exp(np.interp(np.log(self.T[mask]), np.log(To[positive]), np.log(dso[positive])))
+        psa = self.psa[:, mask]
+        sf = target.sum() / psa.sum(axis=1)
+        diff = np.abs(sf[:, None] * psa - target) / target
+        rmse = np.sqrt(np.mean(diff ** 2, axis=1)) * 100
+        meane = diff.mean(axis=1) * 100
+        order = np.argsort(rmse)
+        if sf_range is not None:
+            order = order[(sf[order] >= sf_range[0]) & (sf[order] <= sf_range[1])]
+        if top is not None:
+            order = order[:top]
+        return [{'name': self.names[i], 'eqname': self.eqnames[i], 'sf': float(sf[i]), 'rmse': float(rmse[i]),
+                 'meane': float(meane[i]), 'dt': float(self.dt[i]), 'npts': int(self.npts[i])} for i in order]
+
+
+_libraries: Dict[str, RecordLibrary] = {}
+
+
+def default_library() -> Optional[RecordLibrary]:
+    """The library in REQPY_LIBRARY_DIR, or None if the variable is not set.
+
+    The instance is shared by all sessions; the index is re-read when its
+    file changes (e.g. after an ingest from the command line).
+    """
+    path = os.environ.get('REQPY_LIBRARY_DIR')
+    if not path:
+        return None
+    index = os.path.join(path, 'index.npz')
+    mtime = os.path.getmtime(index) if os.path.exists(index) else None
+    library = _libraries.get(path)
+    if library is None or library.index_mtime != mtime:
+        library = _libraries[path] = RecordLibrary(path)
+    return library
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Seed record library with precomputed spectra.")
+    parser.add_argument('--library', default=os.environ.get('REQPY_LIBRARY_DIR') or DEFAULT_DIR,
+                        help=f"Library directory (default: $REQPY_LIBRARY_DIR or ./{DEFAULT_DIR})")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_ingest = sub.add_parser('ingest', help="Add the .AT2 files of a directory to the library")
+    p_ingest.add_argument('records', help="Directory of .AT2 files (or one .AT2 file)")
+    p_rank = sub.add_parser('rank', help="Rank the library records against a target spectrum")
+    p_rank.add_argument('target', help="Target spectrum file (two columns: Period (s), PSA (g))")
+    p_rank.add_argument('--T1', type=float, default=0.05, help="Lower period limit (s)")
+    p_rank.add_argument('--T2', type=float, default=6.0, help="Upper period limit (s)")
+    p_rank.add_argument('--top', type=int, default=10, help="Number of records listed")
+    p_rank.add_argument('--sf-max', type=float, default=None, help="Maximum scale factor (and 1/min)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    import streamlit.logger
+    streamlit.logger.set_log_level('error') # Caching outside the Streamlit runtime is expected here
+    import helperfunctions as hf
+
+    library = RecordLibrary(args.library)
+    if args.command == 'ingest':
+        report = library.ingest(args.records)
+        for p, error in report['failed']:
+            print(f"FAILED {p}: {error}")
+        print(f"{report['added']} added, {report['skipped']} already present; {len(library)} records in {args.library}")
+        return 1 if report['failed'] else 0
+
+    To, dso = hf.my_load_target_spectrum(args.target)
+    sf_range = (1 / args.sf_max, args.sf_max) if args.sf_max else None
+    rows = library.rank(To, dso, args.T1, args.T2, top=args.top, sf_range=sf_range)
+    print(f"{'rank':>4}  {'record':<50} {'sf':>7} {'RMSE %':>7} {'misfit %':>8}")
+    for i, r in enumerate(rows, start=1):
+        print(f"{i:>4}  {r['name']:<50} {r['sf']:>7.3f} {r['rmse']:>7.2f} {r['meane']:>8.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
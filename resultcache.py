@@ -0,0 +1,318 @@
+"""
+Content-addressed caches shared by all Streamlit sessions.
+
+Streamlit re-executes the whole page script on every widget interaction, so
+without a cache the full CWT matching (REQPY_single / REQPYrotdnn) runs again
+whenever e.g. the output format selectbox changes. Results are cached here in
+an in-memory LRU keyed on a content hash of the seed record(s), the target
+spectrum and every matching parameter. An optional on-disk store (.npz files)
+lets identical re-submissions return instantly across server restarts.
+
+The same cache class holds the other per-upload work of the pages, each in
+its own instance: parsed seed records and target spectra (keyed on the bytes
+of the uploaded file, so a re-upload of the same file is a hit) and the
+serialized outputs (keyed on the content of the results and the writer
+options). All instances are process wide, so identical inputs from different
+sessions share one entry.
+
+Every cache is bounded by a number of entries and by the memory of its
+values, evicting the least recently used entries first, and entries can
+expire after a time to live. Hits, misses, evictions and expirations are
+counted (see `cache_stats`). The limits of all caches are set with the
+environment variables
+
+    REQPY_CACHE_ENTRIES   maximum number of entries of each cache (default 16)
+    REQPY_CACHE_MB        memory of all caches together in MB (default 512)
+    REQPY_CACHE_TTL       time to live of an entry in seconds (default 0: none)
+    REQPY_CACHE_DIR       on-disk store of the matching results (default: none)
+
+REQPY_CACHE_MB is split between the caches in the proportions of `SHARES`
+(half of it for the matching results), so the caches never hold more than
+REQPY_CACHE_MB together. It is process wide, unlike the per-session budget
+REQPY_SESSION_MEMORY_MB, and the default leaves room for both.
+
+The arrays of cached values are read-only: one entry is handed to every
+session that asks for it, without copies, so an accidental in-place change
+would otherwise leak into the results of other sessions. `ResultCache.put`
+stores read-only copies of the arrays (the caller's arrays are left
+writable) and returns the stored value, which callers should hand out from
+then on, as a later `get` would.
+"""
+
+from typing import Optional, Dict, Any, List, Tuple
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import sys
+import threading
+import time
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+def hash_inputs(*arrays: Any, **params: Any) -> str:
+    """Builds a content hash of the matching inputs.
+
+    Parameters
+    ----------
+    *arrays : np.ndarray or bytes
+        Input arrays (seed record(s), target periods and ordinates). The
+        dtype, shape and raw bytes of each array are hashed. Raw file
+        contents can be given as bytes.
+    **params : Any
+        Scalar matching parameters (zi, T1, T2, nit, nn, baseline, porder...).
+        They are hashed by name and repr, so the order of the keywords does
+        not matter.
+
+    Returns
+    -------
+    str
+        Hexadecimal SHA-256 digest.
+    """
+    h = hashlib.sha256()
+    for a in arrays:
+        if isinstance(a, (bytes, bytearray, memoryview)):
+            h.update(f"bytes{len(a)}".encode())
+            h.update(a)
+            continue
+        a = np.ascontiguousarray(a)
+        h.update(f"{a.dtype.str}{a.shape}".encode())
+        h.update(a.tobytes())
+    for name in sorted(params):
+        h.update(f"{name}={params[name]!r};".encode())
+    return h.hexdigest()
+
+
+def _nbytes(value: Any) -> int:
+    """Approximate memory held by a cached value."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+def _read_only(a: np.ndarray) -> bool:
+    """True if neither the array nor any array it is a view of can be written."""
+    while isinstance(a, np.ndarray):
+        if a.flags.writeable:
+            return False
+        a = a.base
+    return True
+
+
+def _frozen(a: Any, copy: bool) -> Any:
+    if not isinstance(a, np.ndarray) or (copy and _read_only(a)):
+        return a
+    if copy:
+        a = a.copy()
+    a.setflags(write=False)
+    return a
+
+
+def _freeze(value: Any, copy: bool = True) -> Any:
+    """Read-only version of a results dictionary or tuple.
+
+    With `copy`, writable arrays are copied and `value` is left untouched;
+    arrays that are already read-only (parsed records, memory maps) are kept
+    as they are. Without it, the arrays of `value` are made read-only in place.
+    """
+    if isinstance(value, dict):
+        return {k: _frozen(v, copy) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return tuple(_frozen(v, copy) for v in value)
+    return value
+
+
+class ResultCache:
+    """Thread-safe LRU cache with a time to live and an optional on-disk store.
+
+    Parameters
+    ----------
+    max_entries : int, optional
+        Maximum number of entries held in memory. The least recently used
+        entry is evicted once the limit is exceeded. Default is 16.
+    disk_dir : Optional[str], optional
+        Directory for the on-disk store. Values written to disk must be
+        dictionaries of numpy arrays and scalars (i.e. REQPY results
+        dictionaries). If None (default), the cache is memory only.
+    max_bytes : Optional[int], optional
+        Maximum memory of the values held in memory. Least recently used
+        entries are evicted beyond it; a single value larger than the limit
+        is not kept in memory. Default: no limit.
+    ttl : Optional[float], optional
+        Time to live of an entry (s), in memory and on disk. Default: entries
+        do not expire.
+    name : str, optional
+        Name of the cache in `cache_stats`.
+    """
+
+    def __init__(self, max_entries: int = 16, disk_dir: Optional[str] = None, max_bytes: Optional[int] = None,
+                 ttl: Optional[float] = None, name: str = 'results'):
+        self.max_entries = max(1, int(max_entries))
+        self.disk_dir = disk_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl if ttl else None
+        self.name = name
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = self.expirations = 0
+        self._entries: "OrderedDict[str, Tuple[Any, float, int]]" = OrderedDict() # value, time stored, bytes
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            if key in self._entries and not self._expired(self._entries[key][1]):
+                return True
+        path = self._disk_path(key)
+        return path is not None and os.path.exists(path) and not self._expired(os.path.getmtime(path))
+
+    def _expired(self, stored: float) -> bool:
+        return self.ttl is not None and time.time() - stored > self.ttl
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns the cached value for `key`, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[1]):
+                self._drop(key)
+                self.expirations += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+        value = self._read_disk(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if value is not None:
+            value = self._put_memory(key, value, copy=False) # Read from disk, not shared with anyone
+        return value
+
+    def put(self, key: str, value: Any) -> Any:
+        """Stores `value` under `key` (and on disk if a store is configured).
+
+        Returns the stored value: a dictionary or tuple of read-only copies of
+        the arrays of `value`, the same object later `get` calls return.
+        """
+        stored = self._put_memory(key, value)
+        self._write_disk(key, value)
+        return stored
+
+    def clear(self) -> None:
+        """Empties the in-memory cache. The on-disk store is left untouched."""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Size, limits and hit/miss counters of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'cache': self.name, 'entries': len(self._entries), 'max_entries': self.max_entries,
+                    'mb': self.nbytes / 1024**2,
+                    'max_mb': self.max_bytes / 1024**2 if self.max_bytes is not None else None,
+                    'ttl_s': self.ttl, 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else None,
+                    'evictions': self.evictions, 'expirations': self.expirations}
+
+    def _drop(self, key: str) -> None:
+        _, _, nbytes = self._entries.pop(key)
+        self.nbytes -= nbytes
+
+    def _put_memory(self, key: str, value: Any, copy: bool = True) -> Any:
+        value = _freeze(value, copy)
+        nbytes = _nbytes(value)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if self.max_bytes is not None and nbytes > self.max_bytes:
+                log.info(f"Not keeping {nbytes / 1024**2:.1f} MB entry {key[:12]} in the {self.name} cache "
+                         f"(limit {self.max_bytes / 1024**2:.0f} MB)")
+                return value
+            self._entries[key] = (value, time.time(), nbytes)
+            self.nbytes += nbytes
+            while len(self._entries) > self.max_entries or (self.max_bytes is not None
+                                                            and self.nbytes > self.max_bytes):
+                evicted = next(iter(self._entries))
+                self._drop(evicted)
+                self.evictions += 1
+                log.debug(f"Evicted {self.name} cache entry {evicted[:12]}")
+        return value
+
+    def _disk_path(self, key: str) -> Optional[str]:
+        if not self.disk_dir:
+            return None
+        return os.path.join(self.disk_dir, f"{key}.npz")
+
+    def _read_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._disk_path(key)
+        if path is None or not os.path.exists(path):
+            return None
+        if self._expired(os.path.getmtime(path)):
+            with self._lock:
+                self.expirations += 1
+            try:
+                os.remove(path)
+            except OSError as e:
+                log.warning(f"Could not remove expired cache file {path}: {e}")
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                # 0-d arrays were scalars (rmsefin, sf, dt...) when stored
+                return {k: (data[k].item() if data[k].ndim == 0 else data[k]) for k in data.files}
+        except Exception as e:
+            log.warning(f"Could not read cache file {path}: {e}")
+            return None
+
+    def _write_disk(self, key: str, value: Any) -> None:
+        path = self._disk_path(key)
+        if path is None:
+            return
+        if not isinstance(value, dict):
+            log.debug("Only results dictionaries are written to the disk store.")
+            return
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as fp:
+                np.savez(fp, **value)
+            os.replace(tmp_path, path) # Atomic, so readers never see a partial file
+        except Exception as e:
+            log.warning(f"Could not write cache file {path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+# Fraction of REQPY_CACHE_MB given to each cache
+SHARES = {'results': 0.5, 'outputs': 0.25, 'records': 0.15, 'targets': 0.1}
+
+
+def _from_env(name: str, disk_dir: Optional[str] = None) -> ResultCache:
+    total_mb = float(os.environ.get('REQPY_CACHE_MB', 512))
+    return ResultCache(max_entries=int(os.environ.get('REQPY_CACHE_ENTRIES', 16)), disk_dir=disk_dir,
+                       max_bytes=int(total_mb * SHARES[name] * 1024**2),
+                       ttl=float(os.environ.get('REQPY_CACHE_TTL', 0)), name=name)
+
+
+results_cache = _from_env('results', disk_dir=os.environ.get('REQPY_CACHE_DIR') or None)
+records_cache = _from_env('records')   # Parsed seed records, keyed on the file bytes
+targets_cache = _from_env('targets')   # Target spectra, keyed on the file bytes
+outputs_cache = _from_env('outputs')   # Serialized outputs (text files, .npz, zip archives)
+
+CACHES = (records_cache, targets_cache, results_cache, outputs_cache)
+
+
+def cache_stats() -> List[Dict[str, Any]]:
+    """`ResultCache.stats` of the shared caches."""
+    return [cache.stats() for cache in CACHES]
@@ -0,0 +1,195 @@
+"""
+Binary results files (.npz).
+
+The text outputs (.AT2, 1-column, 2-column with '%.8e') take 13-30 bytes per
+value and have to be parsed again by downstream analyses. A results file
+stores the whole results dictionary of a matching run - acceleration,
+velocity and displacement of each component, dt, the matched and seed
+spectra - together with the target spectrum and JSON metadata in a single
+uncompressed .npz archive, at 8 (or, optionally, 4) bytes per value.
+
+The archive is a plain np.savez file, so np.load reads it, and so does the
+on-disk store of resultcache.ResultCache. As the members are stored
+uncompressed, individual arrays of a file on disk can be memory-mapped
+(load_results(..., mmap=True)), e.g. to read one component of a long record
+without loading the others. A results file can also be used as a seed record
+again: hf.my_load_PEERNGA_record accepts it in place of an .AT2 file.
+"""
+
+from typing import Optional, Dict, Any, List, Tuple, Union, Iterable
+import io
+import json
+import logging
+import os
+import struct
+import zipfile
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+FORMAT = 'reqpy-results'
+VERSION = 1
+METADATA_KEY = '__metadata__'
+TARGET_KEYS = ('target_T', 'target_PSA')
+
+# Period vectors keep double precision with float32 storage
+_PERIOD_KEYS = ('T', 'target_T')
+
+
+def save_results(
+    file: Union[str, io.IOBase],
+    results: Dict[str, Any],
+    float32: bool = False,
+    target_spec: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    metadata: Optional[Dict[str, Any]] = None
+) -> None:
+    """Writes a results dictionary as a binary results file.
+
+    Parameters
+    ----------
+    file : str or binary file-like
+        Destination path or binary stream. np.savez appends '.npz' to paths
+        without it.
+    results : Dict[str, Any]
+        Results dictionary of hf.my_REQPY_single / hf.my_REQPYrotdnn. Arrays
+        and scalars are stored; other values are skipped.
+    float32 : bool, optional
+        Store the time series and spectra in single precision (periods and
+        scalars stay double). Halves the file size. Default is False.
+    target_spec : Optional[Tuple[np.ndarray, np.ndarray]], optional
+        (periods, PSA) of the target spectrum, stored as target_T / target_PSA.
+    metadata : Optional[Dict[str, Any]], optional
+        JSON-serializable metadata, e.g. 'records' (the seed record names,
+        in component order), 'target' and the matching parameters.
+    """
+    arrays: Dict[str, np.ndarray] = {}
+    for key, value in results.items():
+        if isinstance(value, np.ndarray) or np.isscalar(value):
+            arrays[key] = np.asarray(value)
+        else:
+            log.debug(f"Skipping non-array result '{key}' ({type(value).__name__}).")
+    if target_spec is not None:
+        arrays.update(zip(TARGET_KEYS, (np.asarray(a, dtype=float) for a in target_spec)))
+    if float32:
+        for key, a in arrays.items():
+            if a.ndim > 0 and a.dtype.kind == 'f' and key not in _PERIOD_KEYS:
+                arrays[key] = a.astype(np.float32)
+    meta = {'format': FORMAT, 'version': VERSION, 'dtype': 'float32' if float32 else 'float64',
+            **(metadata or {})}
+    arrays[METADATA_KEY] = np.array(json.dumps(meta))
+    np.savez(file, **arrays)
+
+
+def _scalar(a: np.ndarray) -> Any:
+    return a.item() if a.ndim == 0 else a
+
+
+def _stored_members(path: str) -> Dict[str, Tuple[int, np.dtype, Tuple[int, ...], bool]]:
+    """(data offset, dtype, shape, fortran order) of each uncompressed .npy member."""
+    members = {}
+    with zipfile.ZipFile(path) as zf, open(path, 'rb') as fp:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED or not info.filename.endswith('.npy'):
+                continue
+            fp.seek(info.header_offset)
+            local_header = fp.read(30)
+            name_len, extra_len = struct.unpack('<HH', local_header[26:30])
+            fp.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(fp)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(fp)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(fp)
+            members[info.filename[:-4]] = (fp.tell(), dtype, shape, fortran)
+    return members
+
+
+def load_results(
+    file: Union[str, io.IOBase],
+    mmap: bool = False,
+    keys: Optional[Iterable[str]] = None
+) -> Dict[str, Any]:
+    """Reads a binary results file into a results dictionary.
+
+    Parameters
+    ----------
+    file : str or binary file-like
+        Results file written by `save_results` (or any .npz of a results
+        dictionary, such as the ResultCache disk store).
+    mmap : bool, optional
+        Memory-map the arrays instead of reading them (read-only; `file`
+        must be a path). Default is False.
+    keys : Optional[Iterable[str]], optional
+        Only read these entries (e.g. ['scc1', 'dt']). Default: all.
+
+    Returns
+    -------
+    Dict[str, Any]
+        Results dictionary: 0-d entries as Python scalars, the rest as
+        arrays, plus 'metadata' (dict) if the file has any.
+    """
+    wanted = None if keys is None else set(keys)
+    if mmap:
+        if not isinstance(file, (str, os.PathLike)):
+            raise ValueError("Memory-mapped reading needs a file path.")
+        members = _stored_members(str(file))
+    else:
+        members = {}
+    results: Dict[str, Any] = {}
+    with np.load(file, allow_pickle=False) as data:
+        for key in data.files:
+            if wanted is not None and key not in wanted and key != METADATA_KEY:
+                continue
+            if key in members and members[key][2] != ():
+                offset, dtype, shape, fortran = members[key]
+                results[key] = np.memmap(file, dtype=dtype, mode='r', offset=offset, shape=shape,
+                                         order='F' if fortran else 'C')
+            else:
+                results[key] = _scalar(data[key])
+    if METADATA_KEY in results:
+        results['metadata'] = json.loads(results.pop(METADATA_KEY))
+    return results
+
+
+def load_component(file: str, key: str) -> np.ndarray:
+    """Memory-maps a single array (e.g. 'scc2') of a results file."""
+    return load_results(file, mmap=True, keys=[key])[key]
+
+
+def component_keys(keys: Iterable[str]) -> List[str]:
+    """Acceleration keys of the components among results keys ('ccs' or 'scc1', 'scc2')."""
+    keys = set(keys)
+    return [k for k in ('ccs', 'scc1', 'scc2') if k in keys]
+
+
+def read_record(fp, component: int = 1) -> Tuple[np.ndarray, float, int, str]:
+    """Reads one matched acceleration of a results file as a seed record.
+
+    Parameters
+    ----------
+    fp : str or binary file-like
+        Results file.
+    component : int, optional
+        Component of a two-component (RotDnn) result: 1 or 2. Single
+        component results have one record and ignore it.
+
+    Returns
+    -------
+    Tuple[np.ndarray, float, int, str]
+        Acceleration (g), time step (s), number of points and record name,
+        as hf.my_parse_PEERNGA_record.
+    """
+    with np.load(fp, allow_pickle=False) as data: # Only the members needed are read
+        keys = component_keys(data.files)
+        if not keys:
+            raise ValueError("The results file has no matched acceleration ('ccs' or 'scc1'/'scc2').")
+        key = keys[0] if len(keys) == 1 else f'scc{component}'
+        if key not in keys:
+            raise ValueError(f"The results file has no component {component}.")
+        acc = data[key].astype(float)
+        dt = float(data['dt'])
+        meta = json.loads(data[METADATA_KEY].item()) if METADATA_KEY in data.files else {}
+    names = meta.get('records', [])
+    index = keys.index(key)
+    eqname = names[index] if index < len(names) else f"results_comp_{index + 1}"
+    return acc, dt, len(acc), eqname
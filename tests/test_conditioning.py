@@ -0,0 +1,81 @@
+"""
+Input conditioning: common time step and length of the seed records.
+"""
+
+import numpy as np
+import pytest
+
+import conditioning
+
+
+def _sine(dt, duration=4.0, f=2.0):
+    return np.sin(2 * np.pi * f * np.arange(0, duration, dt))
+
+
+def test_unchanged_records():
+    acc = _sine(0.01)
+    records = [(acc, 0.01), (-acc, 0.01)]
+    assert conditioning.is_conditioned(records)
+    accs, dt, report = conditioning.condition_records(records)
+    assert accs[0] is acc and dt == 0.01 and not report['changed']
+    assert conditioning.describe(report) == []
+
+
+@pytest.mark.parametrize('length, n', [('pad', 400), ('trim', 300)])
+def test_pad_and_trim(length, n):
+    a, b = _sine(0.01), _sine(0.01, duration=3.0)
+    accs, dt, report = conditioning.condition_records([(a, 0.01), (b, 0.01)], length=length)
+    assert [len(x) for x in accs] == [n, n] and report['npts'] == n and report['changed']
+    rows = report['records']
+    if length == 'pad':
+        assert (rows[0]['padded'], rows[1]['padded']) == (0, 100)
+        np.testing.assert_array_equal(accs[1][:300], b)
+        assert not accs[1][300:].any()
+    else:
+        assert (rows[0]['trimmed'], rows[1]['trimmed']) == (100, 0)
+        np.testing.assert_array_equal(accs[0], a[:300])
+    assert all(r['method'] == 'none' for r in rows)
+
+
+def test_length_option():
+    with pytest.raises(ValueError):
+        conditioning.condition_records([(_sine(0.01), 0.01)], length='crop')
+
+
+def test_polyphase_for_simple_ratio():
+    fine, coarse = _sine(0.005), _sine(0.01)
+    accs, dt, report = conditioning.condition_records([(fine, 0.005), (coarse, 0.01)])
+    assert dt == 0.005 and [r['method'] for r in report['records']] == ['none', 'polyphase x2/1']
+    assert len(accs[1]) == len(fine)
+    inner = slice(50, -50) # Away from the filter edges
+    np.testing.assert_allclose(accs[1][inner], fine[inner], atol=0.02)
+    assert not conditioning.is_conditioned([(fine, 0.005), (coarse, 0.01)])
+
+
+def test_fft_for_other_ratios():
+    dt2 = 0.0073 # 73/50 of the finer step: beyond the polyphase factors
+    acc, method = conditioning.resample(_sine(dt2), dt2, 0.005)
+    assert method == 'FFT' and len(acc) == round(len(_sine(dt2)) * dt2 / 0.005)
+    t = np.arange(len(acc)) * 0.005
+    inner = slice(100, -100)
+    np.testing.assert_allclose(acc[inner], np.sin(2 * np.pi * 2.0 * t)[inner], atol=0.02)
+
+
+@pytest.mark.parametrize('dt, T1, q', [(0.005, 0.05, 2), (0.005, 0.1, 4), (0.01, 0.05, 1),
+                                       (0.002, 0.03, 3), (0.005, 0.0, 1), (0.02, 0.05, 1)])
+def test_decimation_factor(dt, T1, q):
+    assert conditioning.decimation_factor(dt, T1) == q
+
+
+def test_decimation():
+    acc = _sine(0.005)
+    records = [(acc, 0.005)]
+    assert conditioning.is_conditioned(records, T1=0.05) # Only with decimate
+    assert not conditioning.is_conditioned(records, T1=0.05, decimate=True)
+    accs, dt, report = conditioning.condition_records(records, T1=0.05, decimate=True)
+    assert dt == pytest.approx(0.01) and report['decimation'] == 2 and len(accs[0]) == len(acc) // 2
+    assert report['points_per_period'] == conditioning.POINTS_PER_PERIOD
+    assert report['records'][0]['method'] == 'polyphase x1/2'
+    assert conditioning.describe(report, ['seed'])[-1].startswith("Decimated by 2")
+    _, _, report = conditioning.condition_records(records, T1=0.05, decimate=True, points_per_period=10)
+    assert report['decimation'] == 1 and report['points_per_period'] == 10.0
@@ -0,0 +1,64 @@
+"""
+The export archive against the per-format savers of helperfunctions.py.
+"""
+
+import io
+import zipfile
+import numpy as np
+import pytest
+import streamlit.logger
+
+streamlit.logger.set_log_level('error') # Run outside Streamlit
+import helperfunctions as hf
+import export
+
+EQNAME, SEED, TARGET = '1979_Imperial Valley-06_El Centro Array #12_comp_140', 'seed.AT2', 'target.txt'
+
+
+@pytest.fixture(scope='module')
+def results():
+    rng = np.random.default_rng(1)
+    n = 2 * export._ROWS_PER_BLOCK + 11 # Several blocks and a partial one
+    T = np.geomspace(0.01, 10, 50)
+    return {'ccs': rng.normal(size=n), 'cvel': rng.normal(size=n), 'cdespl': rng.normal(size=n), 'dt': 0.005,
+            'T': T, 'sf': 1.7, 'PSAs': rng.random(50), 'PSAccs': rng.random(50), 'rmsefin': 2.0, 'meanefin': 1.0}
+
+
+@pytest.fixture(scope='module')
+def archive(results):
+    data = export.bundle_bytes(results, [('rec', SEED, EQNAME, export.SINGLE_KEYS)], target_name=TARGET,
+                               spectra_base='rec')
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        return {name: zf.read(name) for name in zf.namelist()}
+
+
+def test_members(archive):
+    assert sorted(archive) == sorted(['rec_Matched.AT2', 'rec_Spectra.csv'] +
+                                     [f'rec_Matched{s}_{f}.txt' for s in ('', '_Vel', '_Disp') for f in ('2col', '1col')])
+
+
+def test_at2_member_matches_saver(results, archive):
+    header = {'title': f'Matched record from {SEED} (Target: {TARGET})', 'date': '01/01/2025',
+              'station': EQNAME.split('_comp_')[0], 'component': f"{EQNAME.split('_comp_')[-1]}-Matched"}
+    saved = hf.my_save_results_as_at2(results, comp_key='ccs', header_details=header).getvalue()
+    assert archive['rec_Matched.AT2'] == saved.encode('ascii')
+
+
+def test_text_members_match_savers(results, archive):
+    header_2col = (f"Matched acceleration (g) vs. Time (s)\nOriginal Seed: {EQNAME}\n"
+                   f"Target Spectrum: {TARGET}\nTime (s), Acceleration (g)")
+    header_1col = (f"Matched acceleration (g), dt={results['dt']:.8f}s\nOriginal Seed: {EQNAME}\n"
+                   f"Target Spectrum: {TARGET}\nData points follow:")
+    assert archive['rec_Matched_2col.txt'] == \
+        hf.my_save_results_as_2col(results, comp_key='ccs', header_str=header_2col).getvalue().encode('ascii')
+    assert archive['rec_Matched_1col.txt'] == \
+        hf.my_save_results_as_1col(results, comp_key='ccs', header_str=header_1col).getvalue().encode('ascii')
+
+
+@pytest.mark.parametrize('ncols', [1, 2, 5])
+def test_write_columns_matches_savetxt(ncols):
+    columns = list(np.random.default_rng(ncols).normal(size=(ncols, export._ROWS_PER_BLOCK + 3)))
+    ours, ref = io.StringIO(), io.StringIO()
+    export.write_columns(ours.write, columns, 'a\nb')
+    np.savetxt(ref, np.column_stack(columns), header='a\nb', fmt='%.8e', delimiter=',')
+    assert ours.getvalue() == ref.getvalue()
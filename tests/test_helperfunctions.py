@@ -0,0 +1,61 @@
+"""
+Writers and loaders of helperfunctions.py.
+"""
+
+import io
+import os
+import numpy as np
+import pytest
+import streamlit.logger
+
+streamlit.logger.set_log_level('error') # Run outside Streamlit
+import helperfunctions as hf
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEED = 'SampleInput_RSN175_IMPVALL.H_H-E12140.AT2'
+
+
+def _baseline_at2(accel, dt, comp_key='ccs'):
+    """The .AT2 text of the original my_save_results_as_at2 (one string concatenation per value)."""
+    npts = len(accel)
+    filetxt = ("REQPY SPECTRALLY MATCHED RECORD\n"
+               f"EARTHQUAKE, 01/01/2025, REQPY_STATION, Matched {comp_key}\n"
+               "ACCELERATION IN G\n"
+               f"NPTS= {npts}, DT= {dt:.8f} SEC\n")
+    for i in range(npts):
+        filetxt += f" {accel[i]: 15.7e}"
+        if (i + 1) % 8 == 0 and i != (npts - 1):
+            filetxt += "\n"
+    return filetxt + "\n"
+
+
+@pytest.mark.parametrize('npts', [0, 1, 7, 8, 9, 8 * hf._AT2_CHUNK_LINES, 8 * hf._AT2_CHUNK_LINES + 3])
+def test_at2_matches_baseline(npts):
+    accel = np.random.default_rng(npts).normal(scale=0.3, size=npts)
+    accel[::5] *= -1e-6 # Small and negative values
+    text = hf.my_save_results_as_at2({'ccs': accel, 'dt': 0.005}).getvalue()
+    assert text == _baseline_at2(accel, 0.005)
+
+
+def test_at2_of_record_matches_baseline():
+    accel, dt, _, _ = hf.my_load_PEERNGA_record(os.path.join(ROOT, SEED))
+    assert hf.my_save_results_as_at2({'scc1': accel, 'dt': dt}, 'scc1').getvalue() == \
+        _baseline_at2(accel, dt, 'scc1')
+
+
+def test_write_at2_binary_stream():
+    accel = np.linspace(-1, 1, 21)
+    text, data = io.StringIO(), io.BytesIO()
+    hf.my_write_at2(text, accel, 0.01)
+    hf.my_write_at2(data, accel, 0.01)
+    assert data.getvalue() == text.getvalue().encode('ascii') == _baseline_at2(accel, 0.01).encode('ascii')
+
+
+def test_saver_keyed_on_result_key():
+    results = {'ccs': np.linspace(-1, 1, 11), 'dt': 0.01}
+    text = hf.my_save_results_as_1col(results, result_key='run-1', comp_key='ccs').getvalue()
+    other = {'ccs': np.zeros(11), 'dt': 0.01} # Not hashed: the key identifies the results
+    assert hf.my_save_results_as_1col(other, result_key='run-1', comp_key='ccs').getvalue() == text
+    assert hf.my_save_results_as_1col(other, result_key='run-2', comp_key='ccs').getvalue() != text
+    assert hf.my_save_results_as_1col(results, result_key='run-1', comp_key='ccs',
+                                      header_str='Other').getvalue() != text
@@ -0,0 +1,97 @@
+"""
+Job queue: submission, claiming, stale jobs, cancellation and purging.
+"""
+
+import os
+import numpy as np
+import pytest
+
+import jobqueue
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(jobqueue.time, 'time', lambda: now[0])
+    return now
+
+
+def _submit(queue, key, **kwargs):
+    return queue.submit(key, 'my_REQPY_single', {'s': np.arange(4.0), 'fs': 100.0, 'nit': 5}, **kwargs)
+
+
+def test_submit(tmp_path, clock):
+    queue = jobqueue.JobQueue(str(tmp_path))
+    job = _submit(queue, 'a', owner='session-1')
+    assert (job.status, job.nit, job.owner, job.progress) == (jobqueue.QUEUED, 5, 'session-1', 0.0)
+    clock[0] += 1
+    _submit(queue, 'b')
+    assert _submit(queue, 'a', owner='session-2').owner == 'session-1' # Attached to the queued job
+    assert [queue.position(k) for k in 'ab'] == [0, 1]
+    inputs = queue.inputs('a')
+    np.testing.assert_array_equal(inputs['s'], np.arange(4.0))
+    assert (inputs['fs'], inputs['nit']) == (100.0, 5)
+    with pytest.raises(ValueError):
+        queue.submit('c', 'print', {'nit': 1})
+
+
+def test_claim_and_stale_reclaim(tmp_path, clock):
+    queue = jobqueue.JobQueue(str(tmp_path))
+    _submit(queue, 'a')
+    clock[0] += 1
+    _submit(queue, 'b')
+    assert queue.claim('w1').key == 'a' # Oldest first
+    assert queue.claim('w2').key == 'b'
+    assert queue.claim('w3') is None
+    queue.report('b', [(0, 20.0, 15.0)])
+    clock[0] += jobqueue.STALE_AFTER / 2
+    queue.report('a', [(0, 20.0, 15.0), (1, 10.0, 8.0)])
+    clock[0] += jobqueue.STALE_AFTER / 2 + 1
+    job = queue.claim('w3') # 'b' stopped reporting, 'a' did not
+    assert (job.key, job.status, job.history) == ('b', jobqueue.RUNNING, [])
+    assert queue.claim('w4') is None
+
+
+def test_cancel(tmp_path, clock):
+    queue = jobqueue.JobQueue(str(tmp_path))
+    _submit(queue, 'a')
+    _submit(queue, 'b')
+    queue.cancel('a')
+    assert queue.get('a').status == jobqueue.CANCELLED and queue.get('a').done
+    assert queue.claim('w1').key == 'b'
+    queue.cancel('b') # Running: the worker stops after the current iteration
+    assert queue.get('b').status == jobqueue.RUNNING and queue.cancel_requested('b')
+    queue.finish('b', jobqueue.CANCELLED)
+    assert queue.get('b').status == jobqueue.CANCELLED
+    assert _submit(queue, 'b').status == jobqueue.QUEUED # A cancelled run can be submitted again
+    assert not queue.cancel_requested('b')
+
+
+def test_purge(tmp_path, clock):
+    queue = jobqueue.JobQueue(str(tmp_path))
+    for key in 'abc':
+        _submit(queue, key)
+    for key in 'ab':
+        queue.claim('w1')
+        queue.store.put(key, {'ccs': np.zeros(3), 'dt': 0.01})
+        queue.finish(key, jobqueue.DONE)
+        clock[0] += 100
+    assert not os.path.exists(queue._inputs_path('a'))
+    assert queue.purge(older_than=150) == 1 # Only 'a' finished more than 150 s ago
+    assert queue.get('a') is None and queue.get('b').status == jobqueue.DONE
+    assert not os.path.exists(os.path.join(str(tmp_path), 'results', 'a.npz'))
+    assert queue.purge(older_than=0) == 1 and queue.get('c').status == jobqueue.QUEUED # Never active jobs
+
+
+def test_retention(tmp_path, clock):
+    queue = jobqueue.JobQueue(str(tmp_path), retention=10)
+    _submit(queue, 'a') # First purge (nothing to purge)
+    queue.claim('w1')
+    queue.finish('a', jobqueue.DONE)
+    clock[0] += 20
+    _submit(queue, 'b')
+    assert queue.get('a') is not None # Past the retention, but purged at most every PURGE_EVERY s
+    clock[0] += jobqueue.PURGE_EVERY
+    assert queue.claim('w1').key == 'b'
+    assert queue.get('a') is None
+    assert jobqueue.JobQueue(str(tmp_path), retention=0).retention is None
@@ -0,0 +1,50 @@
+"""
+Peak memory of StageTimer with several timers measuring at once.
+"""
+
+import tracemalloc
+import numpy as np
+
+from profiling import StageTimer, MB
+
+
+def test_nested_stages():
+    timer = StageTimer(memory=True)
+    with timer.stage('run'):
+        a = np.ones(4 * MB // 8)
+        del a
+        with timer.stage('child'): # Its peak is reset on entry
+            b = np.ones(2 * MB // 8)
+            del b
+    run, child = timer.records
+    assert child['stage'] == 'run/child'
+    assert 2 <= child['peak_mb'] < 4 <= run['peak_mb']
+    assert not tracemalloc.is_tracing()
+
+
+def test_interleaved_timers_keep_tracing():
+    """A session closing its stages must not stop tracing or reset the peak of another one."""
+    a, b = StageTimer(memory=True), StageTimer(memory=True)
+    stage_a, stage_b = a.stage('a'), b.stage('b')
+    stage_a.__enter__()
+    stage_b.__enter__()
+    x = np.ones(8 * MB // 8)
+    del x
+    stage_a.__exit__(None, None, None)
+    assert tracemalloc.is_tracing()
+    with a.stage('a2'): # Does not reset the peak of b's open stage
+        pass
+    stage_b.__exit__(None, None, None)
+    assert b.records[0]['peak_mb'] >= 8
+    assert not tracemalloc.is_tracing()
+
+
+def test_external_tracing_left_on():
+    tracemalloc.start()
+    try:
+        timer = StageTimer(memory=True)
+        with timer.stage('run'):
+            pass
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
@@ -0,0 +1,70 @@
+"""
+Suite QA report: motion parameters and spectral ratios.
+"""
+
+import numpy as np
+import pytest
+
+import qa
+
+T = np.geomspace(0.01, 10.0, 60)
+TARGET = 0.5 / (1 + T)
+
+
+def test_motion_params_constant():
+    acc = np.full((1, 101), 0.1) # 0.1 g for 1 s
+    params = qa.motion_params(acc, np.array([101]), np.array([0.01]))
+    assert params['pga'][0] == pytest.approx(0.1)
+    assert params['pgv'][0] == pytest.approx(0.1 * 1.0 * qa.G * 100) # a t
+    assert params['pgd'][0] == pytest.approx(0.1 * 1.0**2 / 2 * qa.G * 100) # a t^2 / 2
+    assert params['arias'][0] == pytest.approx(np.pi * qa.G / 2 * 0.1**2 * 101 * 0.01)
+
+
+def test_arias_of_sine():
+    dt, A = 0.01, 0.2
+    acc = A * np.sin(2 * np.pi * np.arange(0, 2.0, dt)) # Two periods of 1 Hz
+    arias = qa.motion_params(acc[np.newaxis], np.array([len(acc)]), np.array([dt]))['arias'][0]
+    # Ia = pi / (2 g) * integral of (g a)^2 dt, with the integral of sin^2 over 2 s equal to 1 s
+    assert arias == pytest.approx(np.pi * qa.G / 2 * A**2 * 1.0)
+
+
+def test_zero_padded_rows():
+    rng = np.random.default_rng(3)
+    a, b = rng.normal(scale=0.1, size=500), rng.normal(scale=0.1, size=300)
+    stacked = np.vstack((a, np.concatenate((b, np.full(200, 5.0))))) # Junk past the end of b
+    together = qa.motion_params(stacked, np.array([500, 300]), np.array([0.01, 0.02]))
+    alone = qa.motion_params(b[np.newaxis], np.array([300]), np.array([0.02]))
+    for key in together:
+        assert together[key][1] == pytest.approx(alone[key][0])
+
+
+def _pair(scale, rng):
+    s1, s2 = rng.normal(scale=0.1, size=400), rng.normal(scale=0.1, size=400)
+    results = {'T': T, 'PSArotnn': scale * TARGET, 'dt': 0.01, 'sf': 2.0, 'scc1': 1.5 * s1, 'scc2': 2.5 * s2}
+    return qa.record_data(results, (s1, s2), ('scc1', 'scc2'))
+
+
+def test_rotdnn_report():
+    rng = np.random.default_rng(4)
+    records = [_pair(1.05, rng), _pair(0.95, rng)]
+    report = qa.suite_report(records, ['rec1', 'rec2'], T, TARGET, 0.1, 2.0)
+    rows = report['rows']
+    assert [(r['record'], r['spectrum']) for r in rows] == [('rec1', 'RotDnn'), ('rec2', 'RotDnn')] # One per pair
+    assert rows[0]['ratio_min'] == pytest.approx(1.05) and rows[1]['ratio_max'] == pytest.approx(0.95)
+    assert [(r['record'], r['component']) for r in report['components']] == \
+        [('rec1', 1), ('rec1', 2), ('rec2', 1), ('rec2', 2)]
+    # Matched = 1.5 and 2.5 x the seed, which is scaled by sf = 2
+    assert [r['pga_ratio'] for r in report['components'][:2]] == pytest.approx([0.75, 1.25])
+    assert report['summary']['mean_ratio_min'] == pytest.approx(1.0)
+    assert report['summary']['mean_above_90'] and not report['summary']['mean_above_110']
+    text = qa.format_report(report)
+    assert "RotDnn" in text and text.count('rec1') == 3
+
+
+def test_single_report():
+    acc = np.random.default_rng(5).normal(scale=0.1, size=400)
+    results = {'T': T, 'PSAccs': TARGET, 'dt': 0.01, 'sf': 1.0, 'ccs': acc}
+    report = qa.suite_report([qa.record_data(results, (acc,), ('ccs',))], ['rec'], T, TARGET, 0.1, 2.0)
+    assert report['rows'][0]['spectrum'] == 'component' and len(report['components']) == 1
+    assert report['components'][0]['arias_ratio'] == pytest.approx(1.0)
+    assert "RotDnn" not in qa.format_report(report)
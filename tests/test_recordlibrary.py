@@ -0,0 +1,66 @@
+"""
+Record library: ingest and ranking against a target.
+"""
+
+import os
+import shutil
+import numpy as np
+import pytest
+import streamlit.logger
+
+streamlit.logger.set_log_level('error') # Run outside Streamlit
+import helperfunctions as hf
+from recordlibrary import RecordLibrary
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEEDS = ('SampleInput_RSN175_IMPVALL.H_H-E12140.AT2', 'SampleInput_RSN175_IMPVALL.H_H-E12230.AT2')
+
+
+@pytest.fixture
+def library(tmp_path):
+    records = tmp_path / 'records'
+    records.mkdir()
+    for name in SEEDS:
+        shutil.copy(os.path.join(ROOT, name), records / name)
+    (records / 'broken.AT2').write_text("not a PEER record\n")
+    lib = RecordLibrary(str(tmp_path / 'lib'))
+    return lib, lib.ingest(str(records)), records
+
+
+def test_ingest(library):
+    lib, report, records = library
+    assert report['added'] == 2 and report['skipped'] == 0
+    assert [os.path.basename(f) for f, _ in report['failed']] == ['broken.AT2']
+    assert sorted(lib.names) == sorted(SEEDS) and lib.psa.shape == (2, len(lib.T))
+    assert lib.ingest(str(records))['skipped'] == 2 # Same content is not added again
+    reopened = RecordLibrary(lib.path)
+    assert reopened.names == lib.names
+    np.testing.assert_array_equal(reopened.psa, lib.psa)
+
+
+def test_load_record(library):
+    lib, _, _ = library
+    acc, dt, npts, eqname = lib.load_record(SEEDS[1])
+    ref = hf.my_load_PEERNGA_record(os.path.join(ROOT, SEEDS[1]))
+    np.testing.assert_array_equal(acc, ref[0])
+    assert (dt, npts, eqname) == ref[1:]
+    assert not acc.flags.writeable
+
+
+def test_rank(library):
+    lib, _, _ = library
+    i = lib.names.index(SEEDS[0])
+    target = 2.0 * lib.psa[i] # The spectrum of one record, scaled
+    rows = lib.rank(lib.T, target, T1=0.05, T2=6.0)
+    assert [r['name'] for r in rows] == [SEEDS[0], SEEDS[1]]
+    assert rows[0]['sf'] == pytest.approx(2.0) and rows[0]['rmse'] == pytest.approx(0.0, abs=1e-9)
+    assert rows[1]['rmse'] > 1.0 and rows[1]['meane'] <= rows[1]['rmse']
+    assert len(lib.rank(lib.T, target, top=1)) == 1
+    assert rows[1]['sf'] > 2.1
+    assert [r['name'] for r in lib.rank(lib.T, target, sf_range=(2.1, 3.0))] == [SEEDS[1]]
+
+
+def test_rank_outside_target(library):
+    lib, _, _ = library
+    with pytest.raises(ValueError):
+        lib.rank(np.array([20.0, 30.0]), np.array([0.1, 0.1]))
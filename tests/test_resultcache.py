@@ -0,0 +1,83 @@
+"""
+Shared result caches: LRU, memory and time-to-live eviction, the on-disk store.
+"""
+
+import numpy as np
+import pytest
+
+import resultcache as rc
+
+
+def _results(n=100, value=1.0):
+    return {'ccs': np.full(n, value), 'dt': 0.01, 'sf': 1.5, 'nit_used': 3}
+
+
+def test_lru_eviction():
+    cache = rc.ResultCache(max_entries=2)
+    cache.put('a', _results())
+    cache.put('b', _results())
+    assert cache.get('a') is not None # 'b' is now the least recently used
+    cache.put('c', _results())
+    assert 'b' not in cache and 'a' in cache and 'c' in cache
+    assert cache.get('b') is None
+    stats = cache.stats()
+    assert (stats['entries'], stats['hits'], stats['misses'], stats['evictions']) == (2, 1, 1, 1)
+
+
+def test_byte_limit():
+    nbytes = _results()['ccs'].nbytes
+    cache = rc.ResultCache(max_entries=10, max_bytes=int(2.5 * nbytes) + 100)
+    for key in 'abc':
+        cache.put(key, _results())
+    assert len(cache) == 2 and 'a' not in cache and cache.nbytes <= cache.max_bytes
+    stored = cache.put('big', _results(n=1000)) # Larger than the limit: not kept, still returned
+    assert 'big' not in cache and len(stored['ccs']) == 1000
+    assert len(cache) == 2
+
+
+def test_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rc.time, 'time', lambda: now[0])
+    cache = rc.ResultCache(ttl=10)
+    cache.put('a', _results())
+    now[0] += 5
+    assert cache.get('a') is not None
+    now[0] += 6
+    assert 'a' not in cache and cache.get('a') is None
+    assert cache.stats()['expirations'] == 1 and len(cache) == 0
+
+
+def test_disk_read_back(tmp_path):
+    results = _results(value=2.0)
+    rc.ResultCache(disk_dir=str(tmp_path)).put('a', results)
+    cache = rc.ResultCache(disk_dir=str(tmp_path)) # e.g. after a restart
+    loaded = cache.get('a')
+    np.testing.assert_array_equal(loaded['ccs'], results['ccs'])
+    assert loaded['dt'] == 0.01 and loaded['nit_used'] == 3 and isinstance(loaded['sf'], float)
+    assert not loaded['ccs'].flags.writeable
+    assert cache.get('a') is loaded and cache.stats()['hits'] == 2 # Kept in memory after the first read
+    assert list(tmp_path.iterdir()) == [tmp_path / 'a.npz'] # No temporary files left behind
+
+
+def test_put_stores_read_only_copies():
+    cache = rc.ResultCache()
+    results = _results()
+    stored = cache.put('a', results)
+    assert results['ccs'].flags.writeable # The caller's arrays are left alone
+    results['ccs'][0] = -1.0
+    assert stored['ccs'][0] == 1.0 and cache.get('a') is stored
+    with pytest.raises(ValueError):
+        stored['ccs'][0] = 0.0
+    acc = np.arange(5.0)
+    acc.setflags(write=False)
+    record = cache.put('record', (acc, 0.01, 5, 'name'))
+    assert record[0] is acc # Already read-only: no copy
+    view = np.arange(5.0)[1:]
+    view.setflags(write=False)
+    assert cache.put('view', (view,))[0] is not view # Its base can still be written
+
+
+def test_limit_is_shared(monkeypatch):
+    monkeypatch.setenv('REQPY_CACHE_MB', '100')
+    caches = [rc._from_env(name) for name in rc.SHARES]
+    assert sum(c.max_bytes for c in caches) == pytest.approx(100 * 1024**2, abs=len(caches))
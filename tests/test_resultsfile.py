@@ -0,0 +1,85 @@
+"""
+Binary results files: round trip, memory-mapped reads and use as a seed record.
+"""
+
+import io
+import numpy as np
+import pytest
+import streamlit.logger
+
+streamlit.logger.set_log_level('error') # Run outside Streamlit
+import helperfunctions as hf
+import resultsfile
+
+
+@pytest.fixture
+def rotdnn_results():
+    rng = np.random.default_rng(2)
+    n = 1001
+    return {'scc1': rng.normal(size=n), 'scc2': rng.normal(size=n), 'cvel1': rng.normal(size=n),
+            'cvel2': rng.normal(size=n), 'dt': 0.01, 'T': np.geomspace(0.01, 10, 40),
+            'PSArotnn': rng.random(40), 'sf': 1.3, 'rmsefin': 2.5, 'nit_used': 15, 'history': [(1, 2.5)]}
+
+
+def _save(tmp_path, results, **kwargs):
+    path = str(tmp_path / 'run.npz')
+    resultsfile.save_results(path, results, **kwargs)
+    return path
+
+
+@pytest.mark.parametrize('mmap', [False, True])
+def test_round_trip(tmp_path, rotdnn_results, mmap):
+    path = _save(tmp_path, rotdnn_results, target_spec=(np.array([0.1, 1.0]), np.array([0.5, 0.2])),
+                 metadata={'records': ['a', 'b']})
+    loaded = resultsfile.load_results(path, mmap=mmap)
+    for key in ('scc1', 'scc2', 'cvel1', 'cvel2', 'T', 'PSArotnn'):
+        np.testing.assert_array_equal(loaded[key], rotdnn_results[key])
+        assert isinstance(loaded[key], np.memmap) == mmap
+    assert loaded['dt'] == 0.01 and loaded['nit_used'] == 15 and isinstance(loaded['sf'], float)
+    assert 'history' not in loaded # Not an array or scalar
+    np.testing.assert_array_equal(loaded['target_PSA'], [0.5, 0.2])
+    assert loaded['metadata']['records'] == ['a', 'b'] and loaded['metadata']['dtype'] == 'float64'
+
+
+def test_mmap_is_read_only(tmp_path, rotdnn_results):
+    scc2 = resultsfile.load_component(_save(tmp_path, rotdnn_results), 'scc2')
+    np.testing.assert_array_equal(scc2, rotdnn_results['scc2'])
+    with pytest.raises(ValueError):
+        scc2[0] = 0.0
+
+
+def test_mmap_needs_a_path(rotdnn_results):
+    buffer = io.BytesIO()
+    resultsfile.save_results(buffer, rotdnn_results)
+    buffer.seek(0)
+    with pytest.raises(ValueError):
+        resultsfile.load_results(buffer, mmap=True)
+
+
+def test_float32(tmp_path, rotdnn_results):
+    loaded = resultsfile.load_results(_save(tmp_path, rotdnn_results, float32=True), mmap=True)
+    assert loaded['scc1'].dtype == np.float32 and loaded['T'].dtype == np.float64
+    np.testing.assert_allclose(loaded['scc1'], rotdnn_results['scc1'], rtol=1e-6)
+
+
+def test_read_record_as_seed(tmp_path, rotdnn_results):
+    path = _save(tmp_path, rotdnn_results, metadata={'records': ['rec_140', 'rec_230']})
+    for component, key, name in ((1, 'scc1', 'rec_140'), (2, 'scc2', 'rec_230')):
+        acc, dt, npts, eqname = resultsfile.read_record(path, component)
+        np.testing.assert_array_equal(acc, rotdnn_results[key])
+        assert (dt, npts, eqname) == (0.01, 1001, name)
+    with pytest.raises(ValueError):
+        resultsfile.read_record(path, 3)
+    # The page loader recognises the results file in place of an .AT2 upload
+    with open(path, 'rb') as fp:
+        upload = io.BytesIO(fp.read())
+    acc, dt, npts, eqname = hf.my_load_PEERNGA_record(upload, component=2)
+    np.testing.assert_array_equal(acc, rotdnn_results['scc2'])
+    assert (dt, eqname) == (0.01, 'rec_230')
+
+
+def test_read_record_single(tmp_path):
+    path = _save(tmp_path, {'ccs': np.arange(5.0), 'dt': 0.02})
+    acc, dt, npts, eqname = resultsfile.read_record(path, component=2) # Ignored for one component
+    np.testing.assert_array_equal(acc, np.arange(5.0))
+    assert (dt, npts, eqname) == (0.02, 5, 'results_comp_1')
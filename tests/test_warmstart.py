@@ -0,0 +1,66 @@
+"""
+Warm-start candidates: which parameter changes still allow a warm start.
+"""
+
+import numpy as np
+import pytest
+
+import warmstart
+
+TO = np.geomspace(0.01, 10.0, 50)
+
+
+def _params(**changes):
+    args = {'s': np.arange(100.0), 'fs': 100.0, 'baseline': True, 'porder': -1, 'zi': 0.05,
+            'T1': 0.1, 'T2': 4.0, 'To': TO, 'dso': 0.5 / (1 + TO), 'nit': 15}
+    args.update(changes)
+    return warmstart.run_params(args)
+
+
+def test_small_changes_allowed():
+    prev = _params()
+    assert warmstart.change_reason(prev, _params()) is None
+    assert warmstart.change_reason(prev, _params(T1=0.12, T2=3.5, zi=0.055, nit=5)) is None
+    assert warmstart.change_reason(prev, _params(dso=1.1 * prev['dso'])) is None
+
+
+@pytest.mark.parametrize('changes, reason', [
+    ({'s': np.arange(1.0, 101.0)}, "different seed record"),
+    ({'fs': 200.0}, "different fs"),
+    ({'baseline': False}, "different baseline"),
+    ({'T1': 0.2}, "T1 changed"),
+    ({'T2': 2.0}, "T2 changed"),
+    ({'zi': 0.07}, "damping ratio changed"),
+    ({'dso': 1.5 * 0.5 / (1 + TO)}, "target changed"),
+])
+def test_change_reasons(changes, reason):
+    assert warmstart.change_reason(_params(), _params(**changes)).startswith(reason)
+
+
+def test_target_change_outside_range_ignored():
+    dso = 0.5 / (1 + TO)
+    new = _params(dso=np.where(TO > 5.0, 3 * dso, dso)) # Changed beyond T2 only
+    assert warmstart.target_change(_params(), new) == pytest.approx(0.0)
+
+
+def test_zero_target_ordinate():
+    dso = 0.5 / (1 + TO)
+    zero = np.where((TO > 0.5) & (TO < 0.6), 0.0, dso)
+    with np.errstate(all='raise'): # No division by zero
+        assert warmstart.target_change(_params(dso=zero), _params(dso=zero)) == 0.0
+        assert warmstart.target_change(_params(dso=zero), _params()) == np.inf
+    assert warmstart.change_reason(_params(dso=zero), _params()).startswith("target changed")
+    assert warmstart.change_reason(_params(dso=zero), _params(dso=zero)) is None
+
+
+def test_nonfinite_target():
+    dso = 0.5 / (1 + TO)
+    new = _params(dso=np.where((TO > 0.5) & (TO < 0.6), np.nan, dso))
+    assert warmstart.change_reason(_params(), new).startswith("target changed")
+
+
+def test_find_parent():
+    lineage = [{'run': 1, 'key': 'a', 'params': _params()}, {'run': 2, 'key': 'b', 'params': _params(T1=0.3)}]
+    assert warmstart.find_parent(lineage, _params(T1=0.11), lambda key: True)['run'] == 1
+    assert warmstart.find_parent(lineage, _params(T1=0.11), lambda key: key != 'a') is None
+    assert warmstart.find_parent(lineage, _params(T1=0.32), lambda key: True)['run'] == 2
@@ -0,0 +1,119 @@
+"""
+Warm-started re-matching and the lineage of a session's runs.
+
+While exploring the matching parameters, an engineer typically changes T1,
+T2 or the target only slightly between runs. A warm-started run does not
+start from the scaled seed again, but from the matched record(s) of the
+closest earlier run of the same seed; it then needs only a few iterations
+(WARM_NIT) instead of the full count. The reported scale factor and seed
+spectrum still refer to the original seed, so plots and outputs are the same
+as for a cold start.
+
+An earlier run is a warm start candidate if it matched the same seed
+record(s) with the same sampling frequency, percentile and baseline
+settings, and the other parameters changed only marginally:
+
+* T1 and T2 by at most MAX_PERIOD_CHANGE (relative);
+* the damping ratio by at most MAX_DAMPING_CHANGE;
+* the target ordinates in the new matching range by at most
+  MAX_TARGET_CHANGE (relative).
+
+The number of iterations and the early-stopping settings may change freely.
+Each run is recorded as a lineage entry (a dict) with its parameters, its
+parent run and its misfits, so the chain of warm starts can be traced.
+"""
+
+from typing import Optional, Dict, Any, List, Callable
+import numpy as np
+
+import resultcache as rc
+
+WARM_NIT = 5 # Iterations of a warm-started run
+MAX_PERIOD_CHANGE = 0.25
+MAX_DAMPING_CHANGE = 0.01
+MAX_TARGET_CHANGE = 0.15
+
+_SAME = ('seed', 'fs', 'nn', 'baseline', 'porder', 'low_memory')
+
+
+def run_params(match_args: Dict[str, Any]) -> Dict[str, Any]:
+    """Parameters of a my_REQPY_single / my_REQPYrotdnn call that decide whether it can be warm-started."""
+    seeds = [match_args[k] for k in ('s', 's1', 's2') if k in match_args]
+    return {'seed': rc.hash_inputs(*seeds), 'fs': float(match_args['fs']), 'nn': match_args.get('nn'),
+            'baseline': bool(match_args['baseline']), 'porder': int(match_args['porder']),
+            'low_memory': bool(match_args.get('low_memory', False)), 'zi': float(match_args['zi']),
+            'T1': float(match_args['T1']), 'T2': float(match_args['T2']),
+            'To': np.asarray(match_args['To']), 'dso': np.asarray(match_args['dso'])}
+
+
+def target_change(prev: Dict[str, Any], new: Dict[str, Any]) -> float:
+    """Largest relative change of the target ordinates in the new matching range.
+
+    An ordinate that was 0 before counts as an infinite change unless it is
+    still 0.
+    """
+    inside = (new['To'] >= new['T1']) & (new['To'] <= new['T2'])
+    if not inside.any():
+        inside[:] = True
+    order = np.argsort(prev['To'])
+    old = np.interp(new['To'][inside], prev['To'][order], prev['dso'][order])
+    dso = new['dso'][inside]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = np.where(old != 0, np.abs(dso / old - 1), np.where(dso == 0, 0.0, np.inf))
+    return float(np.max(change))
+
+
+def change_reason(prev: Dict[str, Any], new: Dict[str, Any]) -> Optional[str]:
+    """Why a run with `new` parameters cannot be warm-started from one with `prev`, or None if it can."""
+    for name in _SAME:
+        if prev[name] != new[name]:
+            return f"different {'seed record' if name == 'seed' else name}"
+    for name in ('T1', 'T2'):
+        lo, hi = sorted((prev[name], new[name]))
+        if hi != lo and (lo <= 0 or hi / lo > 1 + MAX_PERIOD_CHANGE):
+            return f"{name} changed by more than {100 * MAX_PERIOD_CHANGE:g}%"
+    if abs(prev['zi'] - new['zi']) > MAX_DAMPING_CHANGE:
+        return f"damping ratio changed by more than {MAX_DAMPING_CHANGE:g}"
+    change = target_change(prev, new)
+    if not np.isfinite(change) or change > MAX_TARGET_CHANGE: # nan from non-finite ordinates
+        return f"target changed by more than {100 * MAX_TARGET_CHANGE:g}%"
+    return None
+
+
+def find_parent(lineage: List[Dict[str, Any]], params: Dict[str, Any],
+                available: Callable[[str], bool]) -> Optional[Dict[str, Any]]:
+    """Most recent lineage entry a run with `params` can be warm-started from.
+
+    Parameters
+    ----------
+    lineage : List[Dict[str, Any]]
+        Entries of `new_entry`, oldest first.
+    params : Dict[str, Any]
+        `run_params` of the new run.
+    available : Callable[[str], bool]
+        Whether the results of a cache key can still be loaded.
+    """
+    for entry in reversed(lineage):
+        if change_reason(entry['params'], params) is None and available(entry['key']):
+            return entry
+    return None
+
+
+def new_entry(lineage: List[Dict[str, Any]], request: str, key: str, args: Dict[str, Any],
+              params: Dict[str, Any], parent: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Lineage entry of a run (its misfits are added by `complete`).
+
+    `request` is the cache key of the cold-start run with the same
+    parameters and `key` that of the run made (warm-started or not).
+    """
+    return {'run': len(lineage) + 1, 'request': request, 'key': key, 'args': args, 'params': params,
+            'parent': None if parent is None else parent['run'], 'nit': int(args['nit']),
+            'nit_used': None, 'rmsefin': None, 'meanefin': None}
+
+
+def complete(entry: Dict[str, Any], results: Dict[str, Any]) -> Dict[str, Any]:
+    """Adds the misfits of the finished run to its lineage entry."""
+    entry.update(nit_used=int(results['nit_used']), rmsefin=float(results['rmsefin']),
+                 meanefin=float(results['meanefin']))
+    return entry
+